@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# Copyright (c) 2010-2015, Yahoo Inc.
+# Copyrights licensed under the Apache 2.0 License
+# See the accompanying LICENSE.txt file for terms.
+"""
+Benchmark of aggregating the output of a run with the aggregate_output
+callback
+
+Times running aggregate_output on the results of growing numbers of hosts,
+where most hosts print the same thing and one in DISTINCT_EVERY prints
+something of its own, next to the md5 and list(set()) aggregation used
+before, and with the hostname and numbers normalizers, which put all the
+hosts in one group.  The time per host of the current aggregation stays
+flat as the number of hosts grows, the old one grows with the size of the
+largest group, so it is only timed up to REBUILD_MAX hosts.  The hash the
+current aggregation used, xxh64 when xxhash is installed, is printed first.
+
+    python benchmarks/bench_aggregate_output.py [max_hosts]
+"""
+from __future__ import print_function
+import hashlib
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import sshmap.callback  # noqa: E402
+import sshmap.sshmap  # noqa: E402
+
+
+REBUILD_MAX = 25000
+DISTINCT_EVERY = 100
+
+
+def aggregate_rebuild(result):
+    """ How aggregate_output used to group the results """
+    aggregate_hosts = result.parm.setdefault('aggregate_hosts', {})
+    collapsed_output = result.parm.setdefault('collapsed_output', {})
+    h = hashlib.md5()
+    h.update(result.stdout)
+    h.update(result.stderr)
+    digest = h.hexdigest()
+    if digest in aggregate_hosts.keys():
+        aggregate_hosts[digest].append(result.host)
+        aggregate_hosts[digest] = list(set(aggregate_hosts[digest]))
+    else:
+        aggregate_hosts[digest] = [result.host]
+        collapsed_output[digest] = (result.out, result.err)
+    return result
+
+
+def make_results(count):
+    output = ['Linux 4.4.0-generic x86_64 GNU/Linux\n'] * 5
+    results = []
+    for index in range(count):
+        out = output
+        if index % DISTINCT_EVERY == 0:
+            out = output + ['host%d\n' % index]
+        results.append(sshmap.sshmap.ssh_result(
+            out, [], 'host%d.example.com' % index
+        ))
+    return results
+
+
+def time_aggregate(func, results, parm=None):
+    parm = dict(parm or {})
+    start = time.time()
+    for result in results:
+        result.parm = parm
+        func(result)
+    return time.time() - start
+
+
+def main():
+    max_hosts = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    print('hash: %s' % sshmap.aggregate.output_hash().name)
+    print('%10s %10s %18s %18s %18s' % (
+        'hosts', 'groups', 'current us/host', 'normalized us/host',
+        'rebuild us/host'
+    ))
+    count = 1000
+    while True:
+        count = min(count, max_hosts)
+        results = make_results(count)
+        rebuild = '-'
+        if count <= REBUILD_MAX:
+            rebuild = '%.1f' % (
+                time_aggregate(aggregate_rebuild, results) / count * 1e6
+            )
+        normalized = time_aggregate(
+            sshmap.callback.aggregate_output, results,
+            parm={'aggregate_normalize': 'hostname,numbers'}
+        )
+        seconds = time_aggregate(sshmap.callback.aggregate_output, results)
+        print('%10d %10d %18.1f %18.1f %18s' % (
+            count, len(results[0].parm['aggregate']), seconds / count * 1e6,
+            normalized / count * 1e6, rebuild
+        ))
+        if count >= max_hosts:
+            break
+        count *= 4
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# Copyright (c) 2010-2015, Yahoo Inc.
+# Copyrights licensed under the Apache 2.0 License
+# See the accompanying LICENSE.txt file for terms.
+"""
+Benchmark of passing the results of a run to a callback script
+
+Times passing the results of growing numbers of hosts to a script that
+reads them and throws them away, with exec_command starting the script for
+each host one after the other, with exec_command in a pool of
+POOL_WORKERS threads, which is what --callback_pool does, and with a
+single ScriptStream process getting a JSON line for each host.  Starting a
+process for each host costs milliseconds a host, the stream costs
+microseconds, so the per host modes are only timed up to EXEC_MAX hosts.
+The pool only gains on the serial exec with more than one cpu, or with a
+script that waits on something.
+
+    python benchmarks/bench_callback_script.py [max_hosts]
+"""
+from __future__ import print_function
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import sshmap.callback  # noqa: E402
+import sshmap.pipeline  # noqa: E402
+import sshmap.sshmap  # noqa: E402
+
+
+EXEC_MAX = 2000
+POOL_WORKERS = 8
+SCRIPT = 'cat > /dev/null'
+
+
+def make_results(count, parm):
+    return [
+        sshmap.sshmap.ssh_result(
+            ['Linux 4.4.0-generic x86_64 GNU/Linux\n'], [],
+            'host%d.example.com' % index, parm=parm
+        )
+        for index in range(count)
+    ]
+
+
+def time_pipeline(callbacks, results, parm, mode='serial'):
+    pipeline = sshmap.pipeline.CallbackPipeline(
+        callbacks, mode=mode, workers=POOL_WORKERS
+    )
+    # exec_command prints the output of the script for each host, keep it
+    # out of the table
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        start = time.time()
+        for _ in pipeline.run(iter(results), parm):
+            pass
+        return time.time() - start
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+
+def main():
+    max_hosts = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    parm = {'callback_script': SCRIPT + ' #'}
+    print('%10s %16s %16s %16s' % (
+        'hosts', 'exec us/host', 'pool us/host', 'stream us/host'
+    ))
+    count = 500
+    while True:
+        count = min(count, max_hosts)
+        results = make_results(count, parm)
+        exec_time = pool_time = '-'
+        if count <= EXEC_MAX:
+            exec_time = '%.1f' % (time_pipeline(
+                [sshmap.callback.exec_command], results, parm
+            ) / count * 1e6)
+            pool_time = '%.1f' % (time_pipeline(
+                [sshmap.callback.exec_command], results, parm, mode='thread'
+            ) / count * 1e6)
+        stream = sshmap.callback.ScriptStream(SCRIPT)
+        start = time.time()
+        time_pipeline([stream], results, parm)
+        stream.close()
+        stream_time = time.time() - start
+        print('%10d %16s %16s %16.1f' % (
+            count, exec_time, pool_time, stream_time / count * 1e6
+        ))
+        if count >= max_hosts:
+            break
+        count *= 4
+
+
+if __name__ == '__main__':
+    main()
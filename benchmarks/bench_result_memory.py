@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# Copyright (c) 2010-2015, Yahoo Inc.
+# Copyrights licensed under the Apache 2.0 License
+# See the accompanying LICENSE.txt file for terms.
+"""
+Benchmark of the memory used by each result of a large run
+
+Builds the results of a run on a number of hosts, each with a few lines of
+stdout and no stderr, and reports the memory allocated per result with
+tracemalloc, next to results kept the way they used to be, as objects with
+a __dict__ holding lists of decoded lines.
+
+    python benchmarks/bench_result_memory.py [hosts] [lines]
+"""
+from __future__ import print_function
+import gc
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import sshmap.sshmap  # noqa: E402
+from sshmap.output import OutputBuffer  # noqa: E402
+
+
+class ListResult(object):
+    """ A result holding decoded lines in lists, like results used to """
+
+    def __init__(self, out, err, host, retcode=0, ssh_ret=0, parm=None,
+                 command=None):
+        self.out = out
+        self.err = err
+        self.retcode = retcode
+        self.ssh_retcode = ssh_ret
+        self.parm = parm
+        self.host = host
+        self.command = command
+
+
+def list_result(host, data, parm):
+    lines = [line.decode('utf-8') for line in data.splitlines(True)]
+    return ListResult(lines, [], host, parm=parm, command='uptime')
+
+
+def buffer_result(host, data, parm):
+    return sshmap.sshmap.ssh_result(
+        OutputBuffer(data), None, host, parm=parm, command='uptime'
+    )
+
+
+def measure(factory, hosts, lines):
+    """
+    Get the bytes allocated per result by building the results of a run
+    """
+    parm = {}
+    data = [
+        ''.join(
+            'host%d line %d of the output of the command\n' % (host, line)
+            for line in range(lines)
+        ).encode() for host in range(hosts)
+    ]
+    names = ['host%d' % host for host in range(hosts)]
+    gc.collect()
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    results = [
+        factory(name, output, parm) for name, output in zip(names, data)
+    ]
+    used = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+    del results
+    return used / float(hosts)
+
+
+def main():
+    hosts = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    lines = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    print('%d results with %d lines of output each' % (hosts, lines))
+    list_bytes = measure(list_result, hosts, lines)
+    buffer_bytes = measure(buffer_result, hosts, lines)
+    print('%-30s %10.0f bytes per result' % ('lists of decoded lines', list_bytes))
+    print('%-30s %10.0f bytes per result' % ('__slots__ and raw bytes', buffer_bytes))
+    print('%-30s %10.1f%%' % ('saved', 100 * (1 - buffer_bytes / list_bytes)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# Copyright (c) 2010-2015, Yahoo Inc.
+# Copyrights licensed under the Apache 2.0 License
+# See the accompanying LICENSE.txt file for terms.
+"""
+Micro benchmark of building and rendering the output of results
+
+Times creating a result from a list of lines and reading its stdout,
+out_string() and str() for growing numbers of lines, next to the line by
+line bytes concatenation results used before.  The time per line of the
+current results stays flat as the output grows, the concatenation grows
+with it, so it is only timed up to CONCATENATE_MAX lines.
+
+    python benchmarks/bench_result_output.py [max_lines]
+"""
+from __future__ import print_function
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import sshmap.sshmap  # noqa: E402
+
+
+CONCATENATE_MAX = 40000
+
+
+def concatenate(lines):
+    """ How SSHResult.sequence_to_bytes() used to build the output """
+    output = b''
+    for line in lines:
+        output += line.encode()
+    return output
+
+
+def render_result(lines):
+    result = sshmap.sshmap.ssh_result(lines, lines[:10], 'host')
+    result.stdout
+    result.out_string()
+    str(result)
+
+
+def render_concatenated(lines):
+    concatenate(lines)
+    concatenate(lines).decode()
+    concatenate(lines) + concatenate(lines[:10])
+
+
+def render_results(lines):
+    results = sshmap.sshmap.ssh_results()
+    for i in range(len(lines) // 10):
+        results.append(
+            sshmap.sshmap.ssh_result(lines[:10], [], 'host%d' % i)
+        )
+    results._repr_text_()
+    results.output
+
+
+def best_time(func, lines, repeat=3):
+    return min(timeit.repeat(lambda: func(lines), number=1, repeat=repeat))
+
+
+def main():
+    max_lines = int(sys.argv[1]) if len(sys.argv) > 1 else 320000
+    line = 'x' * 79 + '\n'
+    print('%10s %18s %18s %18s' % (
+        'lines', 'result ns/line', 'results ns/line', 'concat ns/line'
+    ))
+    count = 10000
+    while count <= max_lines:
+        lines = [line] * count
+        concatenated = '-'
+        if count <= CONCATENATE_MAX:
+            concatenated = '%.1f' % (
+                best_time(render_concatenated, lines) / count * 1e9
+            )
+        print('%10d %18.1f %18.1f %18s' % (
+            count,
+            best_time(render_result, lines) / count * 1e9,
+            best_time(render_results, lines) / count * 1e9,
+            concatenated
+        ))
+        count *= 2
+
+
+if __name__ == '__main__':
+    main()
@@ -131,10 +131,11 @@ setup_arguments = dict(
     extras_require={
         'test': ['nose', 'serviceping'],
         'django_template': ['django'],
-        'all': ['django'],
+        'fast_hash': ['xxhash'],
+        'all': ['django', 'xxhash'],
     },
     install_requires=[
-        'paramiko>=1.13.0',
+        'paramiko>=2.1.0',
         'hostlists>=0.6.9'
     ],
     package_data={
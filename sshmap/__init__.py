@@ -11,7 +11,16 @@ from .callback import exec_command as callback_exec_command
 from .callback import filter_match as callback_filter_match
 from .callback import status_count as callback_status_count
 
-from .sshmap import run, run_command, run_with_runner, SSHCommand
+from .connection import ConnectionPool
+from .journal import Journal
+from .mapreduce import MapReduce
+from .pipeline import CallbackPipeline
+from .retry import RetryPolicy
+from .store import ResultStore
+from .timing import Timeouts
+from .sshmap import run, run_command, run_commands, run_with_runner, stream
+from .sshmap import OutputLine, SSHCommand, SSHCommandBatch
+from .rolling import SSHCommandRolling, run_rolling
 
 
 _metadata_file = os.path.join(
@@ -34,4 +43,9 @@ if os.path.exists(_metadata_file):  # pragma: no cover
         __source_url__ = __git_base_url__ + '/tree/' + __git_hash__
 
 
-__all__ = ['callback', 'defaults', 'jupyter', 'runner', 'sshmap', 'utility']
\ No newline at end of file
+__all__ = [
+    'aggregate', 'callback', 'connection', 'defaults', 'engine', 'hosts',
+    'journal', 'jupyter', 'mapreduce', 'metrics', 'output', 'pipeline',
+    'ratelimit', 'retry', 'rolling', 'runner', 'sshmap', 'store', 'timing',
+    'utility'
+]
\ No newline at end of file
@@ -0,0 +1,403 @@
+# Copyright (c) 2010-2015, Yahoo Inc.
+# Copyrights licensed under the Apache 2.0 License
+# See the accompanying LICENSE.txt file for terms.
+"""
+sshmap streaming aggregation of identical output
+
+An OutputAggregator groups the results of a run by their output as they
+come back, without keeping the results.  The output of each result is
+hashed with a 64 bit hash, the output of each distinct group is kept once,
+from its first result, and the hosts of a group are kept as numbers in an
+array indexing a single list of the host names, so adding a result takes
+the same time however large its group gets.
+
+The hash is the fast non cryptographic xxh64 when the xxhash package is
+installed, it comes with the sshmap[fast_hash] extra.  Without it the
+output is hashed with blake2b cut to 64 bits, which is slower.
+
+Output that differs from host to host only in numbers, addresses, times or
+the name of the host can be grouped too by passing normalizers, which mask
+those parts of each line before it is hashed.  The groups then have a
+template, the masked lines, and keep track of the lines that differ
+between their hosts with a few samples of each, in a bounded amount of
+memory.
+
+>>> aggregator = OutputAggregator()
+>>> for host in ['web1', 'web2']:
+...     _ = aggregator.add(sshmap.ssh_result(['ok\\n'], [], host))
+>>> [(group.hosts, list(group.out)) for group in aggregator]
+[(['web1', 'web2'], ['ok\\n'])]
+"""
+from array import array
+from collections import OrderedDict
+import hashlib
+import re
+try:
+    from collections.abc import Mapping
+except ImportError:  # pragma: no cover
+    from collections import Mapping
+try:
+    import xxhash
+except ImportError:  # pragma: no cover
+    xxhash = None
+
+from .utility import basestring
+
+
+# The number of the different values of a line kept as samples
+SAMPLE_VALUES = 3
+
+
+def regex_normalizer(pattern, mask='<*>'):
+    """
+    Get a normalizer replacing the matches of a regular expression
+    :param pattern: A pattern string or a compiled pattern
+    :param mask: The text the matches are replaced with
+    """
+    pattern = re.compile(pattern)
+
+    def normalize(line, host):
+        return pattern.sub(mask, line)
+
+    return normalize
+
+
+def host_normalizer(line, host):
+    """
+    Mask the name of the host, and its short name, in a line
+    :param line:
+    :param host:
+    """
+    if not host:
+        return line
+    line = _replace_name(line, host)
+    short = host.split('.')[0]
+    if short != host and len(short) > 1:
+        line = _replace_name(line, short)
+    return line
+
+
+def _replace_name(line, name):
+    """
+    Mask a host name where it is a whole word of a line, so web1 isn't
+    masked in web10
+    :param line:
+    :param name:
+    """
+    # Like \b, but also for the names that start or end with a non word
+    # character, like ::1
+    return re.sub(r'(?<!\w)%s(?!\w)' % re.escape(name), '<HOST>', line)
+
+
+# The built in normalizers, applied in this order when they are passed by
+# name, the more specific patterns come before numbers
+NORMALIZERS = OrderedDict([
+    ('hostname', host_normalizer),
+    ('timestamps', regex_normalizer(
+        r'\b\d{4}-\d{2}-\d{2}([T ]\d{2}:\d{2}(:\d{2}(\.\d+)?)?'
+        r'(Z|[+-]\d{2}:?\d{2})?)?\b|\b\d{1,2}:\d{2}(:\d{2}(\.\d+)?)?\b',
+        '<TIME>'
+    )),
+    ('ips', regex_normalizer(
+        r'\b\d{1,3}(\.\d{1,3}){3}\b|\b([0-9a-fA-F]{0,4}:){2,7}[0-9a-fA-F]{0,4}\b',
+        '<IP>'
+    )),
+    ('numbers', regex_normalizer(r'\d+(\.\d+)?', '<N>')),
+])
+
+
+def get_normalizers(normalizers=None):
+    """
+    Get the list of normalizer functions for the normalizers argument of an
+    aggregation
+    :param normalizers: A list, or comma separated string, of the names of
+                        NORMALIZERS, regular expressions whose matches are
+                        masked and functions taking a line and the host
+                        name and returning the normalized line.  The names
+                        are applied in the order of NORMALIZERS, before the
+                        rest.
+    :return: A list of functions
+
+    >>> get_normalizers('numbers,hostname') == [
+    ...     NORMALIZERS['hostname'], NORMALIZERS['numbers']
+    ... ]
+    True
+    """
+    if not normalizers:
+        return []
+    if isinstance(normalizers, basestring):
+        normalizers = [item.strip() for item in normalizers.split(',')]
+    names = [item for item in normalizers if item in NORMALIZERS]
+    functions = [
+        function for name, function in NORMALIZERS.items() if name in names
+    ]
+    for item in normalizers:
+        if callable(item):
+            functions.append(item)
+        elif item not in NORMALIZERS and item:
+            functions.append(regex_normalizer(item))
+    return functions
+
+
+def normalize(line, host, normalizers):
+    """
+    Run a line through normalizers
+    :param line:
+    :param host:
+    :param normalizers: A list of normalizer functions
+    """
+    for normalizer in normalizers:
+        line = normalizer(line, host)
+    return line
+
+
+def output_hash():
+    """
+    Get a new 64 bit hash object to hash output with, xxhash when it is
+    installed, otherwise blake2b, or md5 where blake2b isn't available
+    """
+    if xxhash is not None:
+        return xxhash.xxh64()
+    if hasattr(hashlib, 'blake2b'):
+        return hashlib.blake2b(digest_size=8)
+    return hashlib.md5()  # pragma: no cover
+
+
+class OutputGroup(object):
+    """
+    The hosts that got the same output and the output they got
+    """
+
+    __slots__ = (
+        'digest', 'out', 'err', 'host_ids', '_names', 'template', 'differs',
+        'samples', '_lines'
+    )
+
+    def __init__(self, digest, out, err, names, template=None):
+        """
+        :param digest: The hex digest of the output
+        :param out:
+        :param err:
+        :param names: The list of host names the host_ids index
+        :param template: A tuple of the normalized lines of out and err,
+                         for a group of normalized output
+        """
+        self.digest = digest
+        self.out = out
+        self.err = err
+        self.host_ids = array('L')
+        self._names = names
+        self.template = template
+        self.differs = None
+        self.samples = None
+        self._lines = None
+        if template is not None:
+            # The lines of the first host, and for each line the number of
+            # hosts that had a different one and samples of what they had
+            self._lines = list(out) + list(err)
+            self.differs = array('L', [0] * len(self._lines))
+            self.samples = {}
+
+    def __len__(self):
+        return len(self.host_ids)
+
+    def __repr__(self):
+        return 'OutputGroup(%s, %d hosts)' % (self.digest, len(self))
+
+    @property
+    def hosts(self):
+        """ The names of the hosts in the group, in the order they were added """
+        names = self._names
+        # A host with more than one result is only listed once
+        return list(OrderedDict.fromkeys(names[index] for index in self.host_ids))
+
+    @property
+    def output(self):
+        """ A tuple of the out and err of the group """
+        return self.out, self.err
+
+    def compare(self, lines):
+        """
+        Count where the lines of a host added to a normalized group differ
+        from the lines of its first host
+        :param lines: The out and err lines of the host
+        """
+        for index, (first, line) in enumerate(zip(self._lines, lines)):
+            if line == first:
+                continue
+            self.differs[index] += 1
+            samples = self.samples.setdefault(index, [])
+            if len(samples) < SAMPLE_VALUES and line not in samples:
+                samples.append(line)
+
+    def view(self):
+        """
+        Get the output to show for the group, the lines that differ between
+        its hosts are replaced with their template line
+        :return: A tuple of lists of the out and err lines
+        """
+        if self.template is None or not self.samples:
+            return list(self.out), list(self.err)
+        template_out, template_err = self.template
+        lines = [
+            template_line if self.differs[index] else line
+            for index, (line, template_line) in enumerate(
+                zip(self._lines, template_out + template_err)
+            )
+        ]
+        return lines[:len(template_out)], lines[len(template_out):]
+
+    def differences(self):
+        """
+        Get the lines that differ between the hosts of the group
+        :return: A list of (line number, template line, number of hosts that
+                 differ from the first host, samples) for each line that
+                 differs, the line numbers count the err lines after the
+                 out lines, starting at 1.
+        """
+        if self.template is None:
+            return []
+        template = self.template[0] + self.template[1]
+        return [
+            (
+                index + 1, template[index], self.differs[index],
+                [self._lines[index]] + self.samples[index]
+            )
+            for index in sorted(self.samples)
+        ]
+
+    def diff_text(self):
+        """ Get the differences as text, a few lines for each line """
+        lines = []
+        for number, template, differs, samples in self.differences():
+            lines.append('%4d: %s' % (number, template.rstrip('\n')))
+            lines.append('      %d of %d hosts differ from the first: %s' % (
+                differs, len(self),
+                ', '.join(repr(sample.rstrip('\n')) for sample in samples)
+            ))
+        return ''.join(line + '\n' for line in lines)
+
+
+class OutputAggregator(object):
+    """
+    Group results by their output as they are added, in the order the
+    groups first appear.
+    """
+
+    def __init__(self, normalizers=None):
+        """
+        :param normalizers: The normalizers to group output that is the
+                            same once they have masked it, see
+                            get_normalizers()
+        """
+        self.normalizers = get_normalizers(normalizers)
+        self.host_names = []
+        self._host_ids = {}
+        self._groups = OrderedDict()
+
+    def __len__(self):
+        return len(self._groups)
+
+    def __iter__(self):
+        return iter(self._groups.values())
+
+    @staticmethod
+    def digest(result, template=None):
+        """
+        Get the hex digest of the output of a result
+        :param result:
+        :param template: The normalized out and err lines to hash instead of
+                         the output
+        """
+        digest = output_hash()
+        if template is None:
+            digest.update(result.stdout)
+        else:
+            digest.update(''.join(template[0]).encode('utf-8'))
+        # Keep output moving between the streams from hashing the same
+        digest.update(b'\0')
+        if template is None:
+            digest.update(result.stderr)
+        else:
+            digest.update(''.join(template[1]).encode('utf-8'))
+        if result.ssh_retcode:
+            digest.update(b'\0')
+            digest.update(result.ssh_error_message().encode())
+        return digest.hexdigest()
+
+    def add(self, result):
+        """
+        Add a result to the group of its output
+        :param result:
+        :return: The OutputGroup
+        """
+        template = None
+        if self.normalizers:
+            template = tuple(
+                [
+                    normalize(line, result.host, self.normalizers)
+                    for line in lines
+                ]
+                for lines in [result.out, result.err]
+            )
+        digest = self.digest(result, template)
+        group = self._groups.get(digest)
+        if group is None:
+            err = result.err
+            if result.ssh_retcode:
+                err = list(err or []) + [result.ssh_error_message()]
+                if template is not None:
+                    template = (
+                        template[0], template[1] + [result.ssh_error_message()]
+                    )
+            group = OutputGroup(
+                digest, result.out, err, self.host_names, template=template
+            )
+            self._groups[digest] = group
+        elif template is not None:
+            group.compare(list(result.out) + list(result.err))
+        host_id = self._host_ids.get(result.host)
+        if host_id is None:
+            host_id = self._host_ids[result.host] = len(self.host_names)
+            self.host_names.append(result.host)
+        group.host_ids.append(host_id)
+        return group
+
+    def group(self, digest):
+        """
+        Get the group of a digest
+        :param digest:
+        """
+        return self._groups[digest]
+
+    def host_groups(self):
+        """ A read only dict like view of digest: list of hosts """
+        return _GroupView(self, 'hosts')
+
+    def output_groups(self):
+        """ A read only dict like view of digest: (out, err) """
+        return _GroupView(self, 'output')
+
+
+class _GroupView(Mapping):
+    """
+    The aggregate_hosts and collapsed_output parm settings, kept as views of
+    an OutputAggregator so they don't have to be rebuilt as results arrive
+    """
+
+    def __init__(self, aggregator, field):
+        """
+        :param aggregator:
+        :param field: The OutputGroup attribute of the values
+        """
+        self._aggregator = aggregator
+        self._field = field
+
+    def __getitem__(self, digest):
+        return getattr(self._aggregator.group(digest), self._field)
+
+    def __len__(self):
+        return len(self._aggregator)
+
+    def __iter__(self):
+        return (group.digest for group in self._aggregator)
@@ -7,7 +7,6 @@ sshmap built in callback handlers
 from __future__ import print_function
 import os
 import sys
-import hashlib
 import json
 import stat
 import base64
@@ -19,11 +18,14 @@ import subprocess
 # except ImportError:
 #     import utility
 
+from .aggregate import OutputAggregator
 from .defaults import conf_defaults, conf_desc
+from .pipeline import stateless
 from .utility import status_clear
 
 
 # Filter callback handlers
+@stateless
 def flowthrough(result):
     """
     Builtin Callback, return the raw data passed
@@ -49,6 +51,7 @@ def summarize_failures(result):
     return result
 
 
+@stateless
 def exec_command(result):
     """
     Builtin Callback, pass the results to a command/script
@@ -65,47 +68,127 @@ def exec_command(result):
         stdout=subprocess.PIPE,
         stderr=subprocess.PIPE
     ).communicate(
-        result.out_string() + result.err_string()
+        result.stdout + result.stderr
     )
-    result.out = [result_out]
-    result.err = [result_err]
+    result.out = result_out
+    result.err = result_err
     print(result.out_string())
     return result
 
 
+class ScriptStream(object):
+    """
+    Callback passing the results to a single long lived callback script,
+    instead of starting the script for each host like exec_command.
+
+    The script is started with the first result and gets a record for each
+    result on its stdin, a JSON object with the host, command, retcode,
+    ssh_retcode, stdout and stderr.  The 'json' framing writes each record
+    on a line of its own, the 'length' framing writes the number of bytes
+    of the record on a line and then the record, for scripts that would
+    rather read a known number of bytes.  The script writes to the same
+    stdout and stderr as sshmap.  Call close() at the end of the run, it
+    closes the stdin of the script and waits for it to finish.
+
+    >>> stream = ScriptStream('jq -r .host')
+    >>> results = sshmap.run('web[1-20000]', 'uptime', output_callback=[
+    ...     sshmap.callback.summarize_failures, stream
+    ... ])
+    >>> stream.close()
+    0
+    """
+
+    framings = ['json', 'length']
+
+    def __init__(self, script, framing='json'):
+        """
+        :param script: The shell command of the script
+        :param framing: How the records are framed, 'json' or 'length'
+        """
+        if framing not in self.framings:
+            raise ValueError(
+                'Invalid framing %r, use one of %s' % (
+                    framing, ', '.join(self.framings)
+                )
+            )
+        self.script = script
+        self.framing = framing
+        self.process = None
+
+    def __call__(self, result):
+        self.send(result)
+        return result
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def record(self, result):
+        """
+        Get the framed record of a result
+        :param result:
+        :return: bytes
+        """
+        data = json.dumps(dict(
+            host=result.host, command=result.command, retcode=result.retcode,
+            ssh_retcode=result.ssh_retcode, stdout=result.out_string(),
+            stderr=result.err_string()
+        )).encode('utf-8')
+        if self.framing == 'length':
+            return ('%d\n' % len(data)).encode('ascii') + data
+        return data + b'\n'
+
+    def send(self, result):
+        """
+        Write the record of a result to the script, starting it if it isn't
+        running yet
+        :param result:
+        """
+        if self.process is None:
+            status_clear()
+            self.process = subprocess.Popen(
+                self.script, shell=True, stdin=subprocess.PIPE
+            )
+        self.process.stdin.write(self.record(result))
+        # The script sees each host as it finishes, not a buffer at a time
+        self.process.stdin.flush()
+
+    def close(self):
+        """
+        Close the stdin of the script and wait for it to finish
+        :return: The return code of the script, or None if it never started
+        """
+        if self.process is None:
+            return None
+        self.process.stdin.close()
+        return self.process.wait()
+
+
 def aggregate_output(result):
-    """ Builtin Callback, Aggregate identical results """
-    aggregate_hosts = result.setting('aggregate_hosts')
-    if not aggregate_hosts:
-        aggregate_hosts = {}
-    collapsed_output = result.setting('collapsed_output')
-    if not collapsed_output:
-        collapsed_output = {}
-    h = hashlib.md5()
-    h.update(result.stdout)
-    h.update(result.stderr)
-    if result.ssh_retcode:
-        h.update(result.ssh_error_message().encode())
-    digest = h.hexdigest()
-    if digest in aggregate_hosts.keys():
-        aggregate_hosts[digest].append(result.host)
-        aggregate_hosts[digest] = list(set(aggregate_hosts[digest]))
-    else:
-        aggregate_hosts[digest] = [result.host]
-        if result.ssh_retcode:
-            error = []
-            if result.err:
-                error = result.err
-            error.append(result.ssh_error_message())
-            collapsed_output[digest] = (result.out, error)
-        else:
-            collapsed_output[digest] = (result.out, result.err)
-    result.parm['aggregate_hosts'] = aggregate_hosts
-    if collapsed_output:
-        result.parm['collapsed_output'] = collapsed_output
+    """
+    Builtin Callback, Aggregate identical results
+
+    The groups are kept in an OutputAggregator in parm['aggregate'], with
+    views of it in parm['aggregate_hosts'], digest: hosts, and
+    parm['collapsed_output'], digest: (out, err).  The normalizers in
+    parm['aggregate_normalize'] group output that is the same once they
+    have masked it.
+    """
+    aggregator = result.setting('aggregate')
+    if aggregator is None:
+        aggregator = OutputAggregator(
+            normalizers=result.setting('aggregate_normalize')
+        )
+        result.parm['aggregate'] = aggregator
+        result.parm['aggregate_hosts'] = aggregator.host_groups()
+        result.parm['collapsed_output'] = aggregator.output_groups()
+    aggregator.add(result)
     return result
 
 
+@stateless
 def filter_match(result):
     """
     Builtin Callback, remove all output if the string is not found in the
@@ -120,6 +203,7 @@ def filter_match(result):
     return result
 
 
+@stateless
 def filter_json(result):
     """
     Builtin Callback, change stdout to json
@@ -128,10 +212,13 @@ def filter_json(result):
     >>> result.dump()
     foo [["output"], ["error"], 0] error 0 0 None
     """
-    result.out = [json.dumps((result.out, result.err, result.retcode))]
+    result.out = [
+        json.dumps((list(result.out), list(result.err), result.retcode))
+    ]
     return result
 
 
+@stateless
 def filter_base64(result):
     """
     Builtin Callback, base64 encode the info in out and err streams
@@ -210,6 +297,20 @@ def output_prefix_host(result):
     return result
 
 
+#Line callback handlers
+def output_line_prefix_host(line):
+    """
+    Builtin Line Callback, print each line of output with the hostname:
+    prefixed as soon as it arrives
+    :param line: An OutputLine
+    """
+    status_clear()
+    handle = sys.stderr if line.stream == 'stderr' else sys.stdout
+    print('%s: %s' % (line.host, line.line.rstrip('\r\n')), file=handle)
+    handle.flush()
+    return line
+
+
 # noinspection PyUnboundLocalVariable
 def read_conf(key=None, prompt=True):
     """ Read settings from the config file
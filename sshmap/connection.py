@@ -0,0 +1,281 @@
+# Copyright (c) 2010-2015, Yahoo Inc.
+# Copyrights licensed under the Apache 2.0 License
+# See the accompanying LICENSE.txt file for terms.
+"""
+sshmap ssh client and connection pool
+"""
+import logging
+import socket
+import threading
+import time
+
+# Imports from external python extension modules
+import paramiko
+
+# Imports from other sshmap modules
+from .timing import PhaseTimings
+
+
+def agent_auth(transport, username):
+    """
+    Attempt to authenticate to the given transport using any of the private
+    keys available from an SSH agent or from a local private RSA key file
+    (assumes no pass phrase).
+    :param transport:
+    :param username:
+    """
+
+    agent = paramiko.Agent()
+    agent_keys = agent.get_keys()
+    if len(agent_keys) == 0:
+        return
+
+    for key in agent_keys:
+        logging.info(
+            'Trying ssh-agent key %s' % key.get_fingerprint().encode('hex'))
+        try:
+            transport.auth_publickey(username, key)
+            logging.debug('agent_auth success!')
+            return
+        except paramiko.SSHException as e:
+            logging.debug('agent_auth failed! %s', e)
+
+
+# A version of the paramiko.SSHClient that supports timeout
+class fastSSHClient(paramiko.SSHClient):
+    """
+    ssh SSHClient class extended with timeout support and timing of the
+    connection phases
+    """
+    _timings = None
+
+    def connect(self, hostname, port=22, username=None, password=None,
+                timeout=None, timings=None, rate_limiter=None, **kwargs):
+        """
+        Connect and authenticate to a host, takes the same arguments as
+        paramiko.SSHClient.connect()
+        :param timings: A PhaseTimings to record the start of the dns,
+                        connect, kex and auth phases in
+        :param rate_limiter: A ConnectRateLimiter to wait on before the tcp
+                             connect, the wait isn't part of any phase
+        """
+        if kwargs.get('sock') is not None or \
+                (timings is None and rate_limiter is None):
+            return paramiko.SSHClient.connect(
+                self, hostname, port=port, username=username,
+                password=password, timeout=timeout, **kwargs
+            )
+        if timings is None:
+            timings = PhaseTimings()
+        timings.start('dns')
+        addresses = socket.getaddrinfo(
+            hostname, port, socket.AF_UNSPEC, socket.SOCK_STREAM
+        )
+        if rate_limiter is not None and addresses:
+            timings.exclude(
+                'dns', rate_limiter.acquire(hostname, addresses[0][4][0])
+            )
+        timings.start('connect')
+        # Try each address of the host in turn like paramiko does
+        sock = error = None
+        for family, socktype, proto, _, address in addresses:
+            sock = socket.socket(family, socktype, proto)
+            sock.settimeout(timeout)
+            try:
+                sock.connect(address)
+                error = None
+                break
+            except socket.error as err:
+                sock.close()
+                error = err
+        if error is not None:
+            raise error
+        timings.start('kex')
+        # paramiko calls _auth() once the key exchange is done
+        self._timings = timings
+        try:
+            return paramiko.SSHClient.connect(
+                self, hostname, port=port, username=username,
+                password=password, timeout=timeout, sock=sock, **kwargs
+            )
+        finally:
+            self._timings = None
+
+    def _auth(self, *args, **kwargs):
+        if self._timings is not None:
+            self._timings.start('auth')
+        return paramiko.SSHClient._auth(self, *args, **kwargs)
+
+    def exec_command(self, command, bufsize=-1, timeout=None, pty=False,
+                     timings=None):
+        """
+        Execute a command
+        :param command:
+        :param bufsize:
+        :param timeout:
+        :param pty:
+        :param timings: A PhaseTimings to record the start of the channel
+                        and exec phases in
+        :return:
+        """
+        if timings is not None:
+            timings.start('channel')
+        chan = self._transport.open_session()
+        paramiko.agent.AgentRequestHandler(chan)
+        chan.settimeout(timeout)
+        if pty:
+            chan.get_pty()
+        if timings is not None:
+            timings.start('exec')
+        chan.exec_command(command)
+        stdin = chan.makefile('wb', bufsize)
+        stdout = chan.makefile('rb', bufsize)
+        stderr = chan.makefile_stderr('rb', bufsize)
+        return stdin, stdout, stderr, chan
+
+
+class ConnectionPool(object):
+    """
+    A pool of connected and authenticated ssh clients keyed by
+    (host, username, port).
+
+    Clients are checked out with get() and handed back with release() once
+    the command is done, so later commands to the same host skip the tcp
+    connect, key exchange and authentication.  Only one command runs on a
+    checked out client at a time, get() opens another connection if all the
+    clients for a host are busy.
+
+    Pooled clients live in the process that created the pool, so a pool can
+    only be reused by engines that run the sessions in the current process.
+
+    :param max_idle: Close clients that have been unused for this many
+                     seconds
+    :param max_age: Close clients that were connected more than this many
+                    seconds ago
+    :param keepalive: Send a keepalive packet on idle transports every this
+                      many seconds, 0 to disable
+    """
+    # Minimum number of seconds between scans for expired clients
+    evict_interval = 1
+
+    def __init__(self, max_idle=300, max_age=3600, keepalive=30):
+        self.max_idle = max_idle
+        self.max_age = max_age
+        self.keepalive = keepalive
+        self._idle = {}
+        self._connected = {}
+        self._lock = threading.Lock()
+        self._last_evict = 0
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(clients) for clients in self._idle.values())
+
+    @staticmethod
+    def _active(client):
+        transport = client.get_transport()
+        return transport is not None and transport.is_active()
+
+    def _expired(self, now, connected, last_used):
+        if self.max_age and now - connected > self.max_age:
+            return True
+        if self.max_idle and now - last_used > self.max_idle:
+            return True
+        return False
+
+    def get(self, host, username=None, port=22, password=None, timeout=None,
+            timings=None, auth_timeout=None, rate_limiter=None):
+        """
+        Get a connected client for a host, reusing an idle one if there is
+        one.  Raises the same exceptions as paramiko.SSHClient.connect()
+        :param host:
+        :param username:
+        :param port:
+        :param password:
+        :param timeout:
+        :param timings: A PhaseTimings for the connection phases of a new
+                        connection
+        :param auth_timeout: The authentication timeout of a new connection
+        :param rate_limiter: A ConnectRateLimiter a new connection waits on
+        """
+        key = (host, username, port)
+        self.evict()
+        with self._lock:
+            clients = self._idle.get(key, [])
+            while clients:
+                client, connected, last_used = clients.pop()
+                if self._active(client) and \
+                        not self._expired(time.time(), connected, last_used):
+                    self._connected[id(client)] = (key, connected)
+                    return client
+                client.close()
+
+        client = fastSSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        client.connect(
+            host, port=port, username=username, password=password,
+            timeout=timeout, banner_timeout=timeout,
+            auth_timeout=auth_timeout, timings=timings,
+            rate_limiter=rate_limiter
+        )
+        if self.keepalive:
+            client.get_transport().set_keepalive(self.keepalive)
+        with self._lock:
+            self._connected[id(client)] = (key, time.time())
+        return client
+
+    def release(self, client):
+        """
+        Return a client to the pool
+        :param client:
+        """
+        with self._lock:
+            key, connected = self._connected.pop(id(client))
+            if self._active(client):
+                self._idle.setdefault(key, []).append(
+                    (client, connected, time.time())
+                )
+                return
+        client.close()
+
+    def discard(self, client):
+        """
+        Close a client that failed instead of returning it to the pool
+        :param client:
+        """
+        with self._lock:
+            self._connected.pop(id(client), None)
+        client.close()
+
+    def evict(self):
+        """ Close the idle clients that have expired """
+        now = time.time()
+        if now - self._last_evict < self.evict_interval:
+            return
+        expired = []
+        with self._lock:
+            self._last_evict = now
+            for key in list(self._idle):
+                keep = []
+                for entry in self._idle[key]:
+                    client, connected, last_used = entry
+                    if self._expired(now, connected, last_used) or \
+                            not self._active(client):
+                        expired.append(client)
+                    else:
+                        keep.append(entry)
+                if keep:
+                    self._idle[key] = keep
+                else:
+                    del self._idle[key]
+        for client in expired:
+            client.close()
+
+    def close(self):
+        """ Close all the idle clients in the pool """
+        with self._lock:
+            idle = self._idle
+            self._idle = {}
+        for clients in idle.values():
+            for client, _, _ in clients:
+                client.close()
@@ -13,10 +13,29 @@ JOB_MAX = 100
 try:
     for line in open('/proc/%d/limits' % os.getpid(), 'r').readlines():
         if line.startswith('Max processes'):
-            JOB_MAX = int(line.strip().split()[2]) / 4
+            JOB_MAX = int(line.strip().split()[2]) // 4
 except:
     pass
 
+# The most hosts of a range expanded to size the jobs and chunksize of an
+# SSHCommand before the first host is dispatched
+EXPAND_AHEAD = 1000
+
+# The number of ssh sessions each worker process of the hybrid engine runs
+# when the number of connections isn't specified
+CONNECTIONS_PER_WORKER = 64
+
+# The number of ssh sessions the async engine runs at once when neither the
+# jobs nor the connections are specified
+ASYNC_CONNECTIONS = 256
+
+# Result retain policies
+RETAIN_ALL = 'all'
+RETAIN_NONE = 'none'
+RETAIN_FAILURES = 'failures'
+RETAIN_DISK = 'disk'
+RETAIN_POLICIES = [RETAIN_ALL, RETAIN_NONE, RETAIN_FAILURES, RETAIN_DISK]
+
 # Return code values
 RUN_OK = 0
 RUN_FAIL_AUTH = 1
@@ -27,13 +46,17 @@ RUN_SUDO_PROMPT = 5
 RUN_FAIL_UNKNOWN = 6
 RUN_FAIL_NOPASSWORD = 7
 RUN_FAIL_BADPASSWORD = 8
+RUN_CANCELLED = 9
+
+# The return codes of the transient failures that are worth retrying
+RETRY_CODES = [RUN_FAIL_TIMEOUT, RUN_FAIL_CONNECT, RUN_FAIL_SSH]
 
 # Text return codes
 RUN_CODES = ['Ok', 'Authentication Error', 'Timeout', 'SSH Connection Failed',
              'SSH Failure',
              'Sudo did not send a password prompt', 'Connection refused',
              'Sudo password required',
-             'Invalid sudo password']
+             'Invalid sudo password', 'Cancelled']
 
 # Configuration file field descriptions
 conf_desc = {
@@ -0,0 +1,838 @@
+# Copyright (c) 2010-2015, Yahoo Inc.
+# Copyrights licensed under the Apache 2.0 License
+# See the accompanying LICENSE.txt file for terms.
+"""
+sshmap execution engines
+
+An engine takes the run_command() tasks generated by run() and SSHCommand and
+runs them concurrently.  All engines are driven through BaseEngine.map() so
+the results stream and the callback pipeline are the same no matter which
+engine is used.
+"""
+import collections
+import heapq
+import multiprocessing
+import pickle
+import signal
+import threading
+import time
+try:
+    import queue
+except ImportError:  # pragma: no cover
+    import Queue as queue
+try:
+    import asyncio
+    import concurrent.futures
+except ImportError:  # pragma: no cover
+    asyncio = None
+
+from . import defaults
+from .timing import clock
+
+
+# How long the dispatch loop waits for results before checking on the engine
+POLL_INTERVAL = 1
+
+# How long the dispatch loop waits for results when it is passing events, like
+# output lines, through as they happen.
+EVENT_POLL_INTERVAL = 0.05
+
+# How long a batch of tasks handed to a worker should take to run, batches
+# grow up to the chunksize while tasks are quick and shrink to single tasks
+# when they are slow.
+BATCH_TIME = 0.5
+
+# How long a task can run before the tasks queued behind it in its batch are
+# handed back, so idle workers can take them, and how often it is checked.
+STEAL_AFTER = 2
+STEAL_INTERVAL = 0.25
+
+# How long the running tasks get to stop by themselves after the engine is
+# cancelled before it is shut down under them
+CANCEL_GRACE = 0.5
+
+# Where worker code sends events and the event set when the engine is
+# cancelled, set per process in worker processes and per thread for the
+# engines that run tasks in threads of the current process.
+_worker_sink = None
+_worker_cancel = None
+_thread_sink = threading.local()
+
+
+class TaskCancelled(Exception):
+    """
+    Raised by task code that stopped because the engine running it was
+    cancelled, args holds whatever the task got done before it stopped
+    """
+
+
+# Returned by a task of the async engine that was cancelled before it started
+_NOT_STARTED = object()
+
+
+def init_worker(events=None, cancel=None):
+    """
+    Set up the signal handler, event sink and cancel event for new worker
+    processes
+    :param events: A queue to send the events emitted by tasks to
+    :param cancel: The Event set when the engine is cancelled
+    """
+    global _worker_sink, _worker_cancel
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _worker_sink = events.put if events is not None else None
+    _worker_cancel = cancel
+
+
+def event_sink():
+    """
+    Get the function the running task should pass events to, or None if the
+    engine running it is not collecting events.
+    """
+    return getattr(_thread_sink, 'sink', None) or _worker_sink
+
+
+def cancel_event():
+    """
+    Get the Event that is set when the engine running the task is cancelled,
+    or None if the task isn't run by an engine that can be cancelled.
+    """
+    return getattr(_thread_sink, 'cancel', None) or _worker_cancel
+
+
+def _call_with_sink(sink, func, task, cancel=None):
+    """
+    Run func on a task in a thread of the current process with the event sink
+    and cancel event for the thread set.
+    :param sink:
+    :param func:
+    :param task:
+    :param cancel:
+    """
+    if cancel is not None and cancel.is_set():
+        return _NOT_STARTED
+    _thread_sink.sink = sink
+    _thread_sink.cancel = cancel
+    try:
+        return func(task)
+    finally:
+        _thread_sink.sink = None
+        _thread_sink.cancel = None
+
+
+def _drain(handle):
+    """ Get everything that is waiting in a queue without blocking """
+    items = []
+    while True:
+        try:
+            items.append(handle.get_nowait())
+        except queue.Empty:
+            return items
+
+
+def _picklable_error(error):
+    """
+    Make sure an exception raised by a task can be sent back to the parent
+    :param error:
+    """
+    try:
+        pickle.dumps(error)
+    except Exception:
+        return RuntimeError('%s: %s' % (error.__class__.__name__, error))
+    return error
+
+
+def _queue_worker(worker, func, tasks, results, threads=1, events=None,
+                  steal_after=STEAL_AFTER, cancel=None):
+    """
+    Worker process of the queue based engines, runs threads threads that
+    each take batches of (index, task) tuples from the tasks queue, until
+    they get None, and run func on them one at a time.
+
+    A monitor thread hands the tasks a thread hasn't started back to the
+    parent when the task it is running takes longer than steal_after
+    seconds, so a slow host doesn't hold up the hosts batched with it.
+    Once cancel is set the tasks that haven't started are handed back
+    instead of being run.
+
+    Messages sent on the results queue are ('done', index, result, seconds),
+    ('requeue', [(index, task), ...]) and a final ('stats', stats).
+    :param worker: The number of the worker
+    :param func:
+    :param tasks:
+    :param results:
+    :param threads:
+    :param events:
+    :param steal_after:
+    :param cancel: The Event set when the engine is cancelled
+    """
+    init_worker(events, cancel)
+    lock = threading.Lock()
+    running = {}
+    stats = dict(worker=worker, threads=threads, tasks=0, busy=0.0, returned=0)
+    started = time.time()
+    finished = threading.Event()
+
+    def work(slot):
+        for batch in iter(tasks.get, None):
+            pending = collections.deque(batch)
+            while True:
+                with lock:
+                    if pending and cancel is not None and cancel.is_set():
+                        results.put(('requeue', list(pending)))
+                        pending.clear()
+                    if not pending:
+                        running.pop(slot, None)
+                        break
+                    index, task = pending.popleft()
+                    running[slot] = (time.time(), pending)
+                begin = time.time()
+                try:
+                    result = func(task)
+                except Exception as error:
+                    result = _picklable_error(error)
+                duration = time.time() - begin
+                results.put(('done', index, result, duration))
+                with lock:
+                    stats['tasks'] += 1
+                    stats['busy'] += duration
+
+    def monitor():
+        while not finished.wait(STEAL_INTERVAL):
+            with lock:
+                now = time.time()
+                for begin, pending in running.values():
+                    if pending and now - begin > steal_after:
+                        stolen = list(pending)
+                        pending.clear()
+                        stats['returned'] += len(stolen)
+                        results.put(('requeue', stolen))
+
+    monitor_thread = threading.Thread(target=monitor)
+    monitor_thread.daemon = True
+    monitor_thread.start()
+    workers = [
+        threading.Thread(target=work, args=(slot,)) for slot in range(threads)
+    ]
+    for thread in workers:
+        thread.daemon = True
+        thread.start()
+    for thread in workers:
+        thread.join()
+    finished.set()
+    monitor_thread.join()
+    stats['elapsed'] = time.time() - started
+    results.put(('stats', stats))
+
+
+class BaseEngine(object):
+    """
+    Base class for the engines that run_command() tasks are dispatched to.
+
+    Subclasses implement start(), submit(), collect() and terminate(), map()
+    handles feeding the engine and ordering the results.
+
+    Tasks can send events, like lines of output, back while they run by
+    passing them to the function returned by event_sink().  The engine
+    collects them when started with events=True.
+    """
+    name = None
+
+    # Tasks run concurrently in threads, so they can't share a single ssh
+    # client object.
+    threaded = False
+
+    # Tasks run in the current process, so objects like a ConnectionPool
+    # passed in the tasks are kept between runs.
+    in_process = False
+
+    # The number of jobs to use if the caller doesn't ask for a number
+    default_jobs = None
+
+    def __init__(self, jobs=1, chunksize=1, connections=None):
+        self.jobs = max(int(jobs or self.default_jobs or 1), 1)
+        self.chunksize = max(int(chunksize), 1)
+        self.connections = connections
+        # A dict for each worker of the last run with the number of tasks it
+        # ran, its busy and elapsed seconds and utilization, for the engines
+        # that report them.
+        self.worker_stats = []
+        # The tasks of the last map() that never started because the engine
+        # was cancelled
+        self.not_started = []
+        self.cancelled = False
+
+    @property
+    def capacity(self):
+        """ The number of tasks to keep submitted to the engine """
+        return self.jobs
+
+    def start(self, func, events=False):
+        """
+        Start the engine, func will be called with each submitted task
+        :param func:
+        :param events: Collect the events sent by the tasks
+        """
+        raise NotImplementedError
+
+    def submit(self, index, task):
+        """
+        Queue a task to be run
+        :param index: The position of the task in the task list
+        :param task:
+        """
+        raise NotImplementedError
+
+    def flush(self):
+        """ Submit any tasks the engine is holding back """
+        pass
+
+    def collect(self, timeout=None):
+        """
+        Wait up to timeout seconds for tasks to complete
+        :param timeout:
+        :return: A list of (index, result) tuples, empty if nothing completed
+        """
+        raise NotImplementedError
+
+    def events(self):
+        """ Get the events the tasks sent since the last call """
+        return []
+
+    def cancel(self):
+        """
+        Cancel the running map(), it stops handing out tasks, the tasks that
+        haven't started are dropped and the running ones are asked to stop
+        """
+        self.cancelled = True
+
+    def unstarted(self):
+        """
+        Get the indexes of the submitted tasks that were dropped without
+        being started since the last call, once the engine is cancelled
+        """
+        return []
+
+    def close(self):
+        """ Shut the engine down after all the tasks completed """
+        self.terminate()
+
+    def terminate(self):
+        """ Shut the engine down immediately """
+        raise NotImplementedError
+
+    def map(self, func, tasks, ordered=False, events=False, deadline=None,
+            expired=None, retry=None, cancelled=None):
+        """
+        Run func for every item in tasks, yielding the results as they
+        complete or in the order of tasks if ordered is True.
+        :param func:
+        :param tasks: An iterable of tasks, it is only read as fast as the
+                      engine can take them.
+        :param ordered:
+        :param events: Also yield the events the tasks send as they arrive,
+                       the events of a task are in order but can come after
+                       its result.
+        :param deadline: The clock() time to give up at, the engine is shut
+                         down and the result of each task that hadn't
+                         completed is expired(task).
+        :param expired:
+        :param retry: Called with the result of a task and the number of the
+                      attempt that gave it, returns the seconds to wait
+                      before queueing the task again at the back of the
+                      queue, or None to keep the result.
+        :param cancelled: Once cancel() is called the running tasks get
+                          CANCEL_GRACE seconds to stop, then the engine is
+                          shut down and the result of each task still
+                          running is cancelled(task).  The tasks that never
+                          started are kept in not_started.
+        """
+        tasks = enumerate(tasks)
+        exhausted = False
+        pending = {}
+        # A heap of the (clock() time, index, task, result) of the tasks
+        # waiting to be retried and the number of attempts of each task
+        waiting = []
+        attempts = {}
+        next_index = 0
+        finished = {}
+        grace = None
+        poll_interval = EVENT_POLL_INTERVAL if events else POLL_INTERVAL
+        self.cancelled = False
+        self.not_started = []
+        self.start(func, events=events)
+        try:
+            while True:
+                if self.cancelled and grace is None:
+                    grace = clock() + CANCEL_GRACE
+                    exhausted = True
+                    self.not_started += [task for _, task in tasks]
+                    # The tasks waiting to be retried keep their last result
+                    for _, index, task, result in waiting:
+                        finished[index] = result
+                    waiting = []
+                while waiting and waiting[0][0] <= clock() and \
+                        len(pending) < self.capacity:
+                    _, index, task, _ = heapq.heappop(waiting)
+                    self.submit(index, task)
+                    self.flush()
+                    pending[index] = task
+                while not exhausted and len(pending) < self.capacity:
+                    try:
+                        index, task = next(tasks)
+                    except StopIteration:
+                        exhausted = True
+                        self.flush()
+                        break
+                    self.submit(index, task)
+                    pending[index] = task
+                if not pending and not waiting:
+                    break
+                timeout = poll_interval
+                if waiting:
+                    timeout = min(timeout, max(waiting[0][0] - clock(), 0))
+                if deadline is not None:
+                    timeout = min(timeout, max(deadline - clock(), 0))
+                if grace is not None:
+                    timeout = min(timeout, max(grace - clock(), 0))
+                if pending:
+                    completed = self.collect(timeout=timeout)
+                else:
+                    time.sleep(timeout)
+                    completed = []
+                for event in self.events():
+                    yield event
+                for index in self.unstarted():
+                    self.not_started.append(pending.pop(index))
+                for index, result in completed:
+                    task = pending.pop(index)
+                    if retry is not None and not self.cancelled:
+                        attempt = attempts.get(index, 1)
+                        delay = retry(result, attempt)
+                        if delay is not None and (
+                            deadline is None or clock() + delay < deadline
+                        ):
+                            attempts[index] = attempt + 1
+                            heapq.heappush(
+                                waiting, (clock() + delay, index, task, result)
+                            )
+                            continue
+                    if ordered:
+                        finished[index] = result
+                    else:
+                        yield result
+                while next_index in finished:
+                    yield finished.pop(next_index)
+                    next_index += 1
+                if grace is not None and clock() >= grace:
+                    self.terminate()
+                    for event in self.events():
+                        yield event
+                    for index, task in sorted(pending.items()):
+                        if cancelled is not None:
+                            finished[index] = cancelled(task)
+                    pending = {}
+                    break
+                if deadline is not None and clock() >= deadline:
+                    # Ask the running sessions to close their channels, the
+                    # engines running them in threads can't kill them
+                    self.cancel()
+                    self.terminate()
+                    for event in self.events():
+                        yield event
+                    for index, task in sorted(pending.items()):
+                        finished[index] = expired(task)
+                    # The tasks waiting to be retried keep their last result
+                    for _, index, task, result in waiting:
+                        finished[index] = result
+                    for index, task in tasks:
+                        finished[index] = expired(task)
+                    for index in sorted(finished):
+                        yield finished[index]
+                    return
+            if not self.cancelled:
+                self.close()
+            for event in self.events():
+                yield event
+            # The results held back behind the tasks that never started
+            for index in sorted(finished):
+                yield finished[index]
+        finally:
+            self.terminate()
+
+
+class _QueueEngine(BaseEngine):
+    """
+    Base class of the engines running the tasks in worker processes that
+    take batches of tasks from a shared queue.
+
+    The batches grow up to max_batch tasks while the tasks run quicker than
+    BATCH_TIME and shrink down to single tasks when they are slow.  Tasks a
+    worker hands back because they were stuck behind a slow task are queued
+    again one at a time.
+    """
+
+    def __init__(self, jobs=1, chunksize=1, connections=None):
+        super(_QueueEngine, self).__init__(
+            jobs=jobs, chunksize=chunksize, connections=connections
+        )
+        self.steal_after = STEAL_AFTER
+        self._tasks = None
+        self._results = None
+        self._events = None
+        self._pending_events = []
+        self._processes = []
+        self._batch = []
+        self._task_time = None
+        self._cancel = None
+        self._unstarted = []
+
+    @property
+    def threads(self):
+        """ The number of threads running tasks in each worker process """
+        return 1
+
+    @property
+    def max_batch(self):
+        """ The most tasks handed to a worker at once """
+        return 1
+
+    @property
+    def batch_size(self):
+        """ The number of tasks to hand to a worker at once right now """
+        if not self._task_time:
+            return 1
+        return max(1, min(self.max_batch, int(BATCH_TIME / self._task_time)))
+
+    def start(self, func, events=False):
+        self._tasks = multiprocessing.Queue()
+        self._results = multiprocessing.Queue()
+        self._events = multiprocessing.Queue() if events else None
+        self._pending_events = []
+        self._processes = []
+        self._batch = []
+        self._task_time = None
+        self._cancel = multiprocessing.Event()
+        self._unstarted = []
+        self.worker_stats = []
+        for worker in range(self.jobs):
+            process = multiprocessing.Process(
+                target=_queue_worker,
+                args=(
+                    worker, func, self._tasks, self._results, self.threads,
+                    self._events, self.steal_after, self._cancel
+                )
+            )
+            process.daemon = True
+            process.start()
+            self._processes.append(process)
+
+    def submit(self, index, task):
+        self._batch.append((index, task))
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self._batch:
+            self._tasks.put(self._batch)
+            self._batch = []
+
+    def _receive(self, timeout=None):
+        """
+        Handle the messages from the workers
+        :param timeout: How long to wait for the first message
+        :return: The list of (index, result) of the completed tasks
+        """
+        completed = []
+        try:
+            messages = [self._results.get(timeout=timeout)]
+        except queue.Empty:
+            return completed
+        while True:
+            try:
+                messages.append(self._results.get_nowait())
+            except queue.Empty:
+                break
+        for message in messages:
+            if message[0] == 'done':
+                index, result, duration = message[1:]
+                if self._task_time is None:
+                    self._task_time = duration
+                else:
+                    self._task_time = 0.8 * self._task_time + 0.2 * duration
+                completed.append((index, result))
+            elif message[0] == 'requeue':
+                if self.cancelled:
+                    self._unstarted += [index for index, _ in message[1]]
+                    continue
+                for item in message[1]:
+                    self._tasks.put([item])
+            elif message[0] == 'stats':
+                stats = message[1]
+                capacity = stats['elapsed'] * stats['threads']
+                stats['utilization'] = stats['busy'] / capacity if capacity else 0.0
+                self.worker_stats.append(stats)
+        return completed
+
+    def collect(self, timeout=None):
+        completed = self._receive(timeout=timeout)
+        if not completed and \
+                not any(process.is_alive() for process in self._processes):
+            raise RuntimeError('All of the %s engine workers exited' % self.name)
+        for index, result in completed:
+            if isinstance(result, BaseException):
+                raise result
+        return completed
+
+    def events(self):
+        events = self._pending_events
+        self._pending_events = []
+        if self._events is not None:
+            events += _drain(self._events)
+        return events
+
+    def cancel(self):
+        super(_QueueEngine, self).cancel()
+        if self._cancel is None:
+            return
+        self._cancel.set()
+        # The batches no worker has taken yet
+        for batch in [self._batch] + _drain(self._tasks):
+            self._unstarted += [index for index, _ in batch]
+        self._batch = []
+
+    def unstarted(self):
+        unstarted = self._unstarted
+        self._unstarted = []
+        return unstarted
+
+    def close(self):
+        for _ in range(self.jobs * self.threads):
+            self._tasks.put(None)
+        # Keep reading the queues while the workers exit, they can't exit
+        # until everything they sent has been read.
+        while any(process.is_alive() for process in self._processes):
+            self._receive(timeout=0.1)
+            if self._events is not None:
+                self._pending_events += _drain(self._events)
+        self._receive(timeout=0)
+        self.worker_stats.sort(key=lambda stats: stats['worker'])
+        for process in self._processes:
+            process.join()
+        self._processes = []
+
+    def terminate(self):
+        for process in self._processes:
+            process.terminate()
+        for process in self._processes:
+            process.join()
+        self._processes = []
+        for handle in [self._tasks, self._results, self._events]:
+            if handle:
+                handle.cancel_join_thread()
+                handle.close()
+        self._tasks = self._results = self._events = None
+
+
+class ProcessEngine(_QueueEngine):
+    """
+    Run each task in one of jobs worker processes, one task at a time per
+    process.  Tasks are handed to the workers in batches of up to chunksize
+    tasks that adapt to how long the tasks take, and the tasks queued behind
+    a slow host are handed to other workers.
+    """
+    name = 'process'
+
+    @property
+    def max_batch(self):
+        return self.chunksize
+
+    @property
+    def capacity(self):
+        # Keep a second batch queued for every worker so they don't sit idle
+        # waiting on the parent.
+        return self.jobs * self.chunksize * 2
+
+
+class AsyncEngine(BaseEngine):
+    """
+    Run all the tasks from a single asyncio event loop in the current process.
+
+    paramiko is blocking, so this is a thread backed engine, the loop only
+    schedules the tasks and waits on them.  Each ssh session runs
+    run_command() in a thread of a pool owned by the loop, with one thread
+    per connection (jobs threads if connections is not set), so no worker
+    processes are forked but every session in flight still has a thread.
+    If func is a coroutine function it is awaited on the loop directly.
+    """
+    name = 'async'
+    threaded = True
+    in_process = True
+    default_jobs = defaults.ASYNC_CONNECTIONS
+
+    def __init__(self, jobs=1, chunksize=1, connections=None):
+        if asyncio is None:  # pragma: no cover
+            raise ValueError('The async engine requires the asyncio module')
+        super(AsyncEngine, self).__init__(
+            jobs=jobs, chunksize=chunksize, connections=connections
+        )
+        self._loop = None
+        self._executor = None
+        self._func = None
+        self._pending = {}
+        self._events = None
+        self._cancel = None
+        self._unstarted = []
+
+    @property
+    def capacity(self):
+        return max(int(self.connections or self.jobs), 1)
+
+    def start(self, func, events=False):
+        self._func = func
+        self._events = queue.Queue() if events else None
+        self._cancel = threading.Event()
+        self._unstarted = []
+        self._loop = asyncio.new_event_loop()
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.capacity
+        )
+
+    def submit(self, index, task):
+        sink = self._events.put if self._events is not None else None
+        if asyncio.iscoroutinefunction(self._func):
+            future = self._loop.create_task(self._func(task))
+        else:
+            future = self._loop.run_in_executor(
+                self._executor, _call_with_sink, sink, self._func, task,
+                self._cancel
+            )
+        self._pending[future] = index
+
+    def collect(self, timeout=None):
+        if not self._pending:
+            return []
+        done, _ = self._loop.run_until_complete(
+            asyncio.wait(
+                list(self._pending), timeout=timeout,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+        )
+        completed = []
+        for future in done:
+            index = self._pending.pop(future)
+            result = future.result()
+            if result is _NOT_STARTED:
+                self._unstarted.append(index)
+            else:
+                completed.append((index, result))
+        return completed
+
+    def events(self):
+        if self._events is None:
+            return []
+        return _drain(self._events)
+
+    def cancel(self):
+        super(AsyncEngine, self).cancel()
+        if self._cancel is not None:
+            self._cancel.set()
+
+    def unstarted(self):
+        unstarted = self._unstarted
+        self._unstarted = []
+        return unstarted
+
+    def terminate(self):
+        if not self._loop:
+            return
+        for future in self._pending:
+            future.cancel()
+        if self._pending:
+            self._loop.run_until_complete(
+                asyncio.gather(*self._pending, return_exceptions=True)
+            )
+        self._pending = {}
+        self._executor.shutdown(wait=False)
+        self._loop.close()
+        self._loop = None
+
+
+class HybridEngine(_QueueEngine):
+    """
+    Run the tasks in jobs worker processes that each run many ssh sessions
+    in threads.
+
+    jobs (defaulting to the cpu count) sets the number of processes, so the
+    crypto work is spread over all the cores, and connections sets the total
+    number of ssh sessions in flight across all of the processes.  Tasks are
+    handed out one at a time from a shared queue.
+    """
+    name = 'hybrid'
+    threaded = True
+    try:
+        default_jobs = multiprocessing.cpu_count()
+    except NotImplementedError:  # pragma: no cover
+        default_jobs = 1
+
+    def __init__(self, jobs=None, chunksize=1, connections=None):
+        super(HybridEngine, self).__init__(
+            jobs=jobs, chunksize=chunksize, connections=connections
+        )
+        if not self.connections:
+            self.connections = self.jobs * defaults.CONNECTIONS_PER_WORKER
+        self.connections = max(int(self.connections), self.jobs)
+
+    @property
+    def threads(self):
+        """ The number of ssh session threads in each worker process """
+        return -(-self.connections // self.jobs)
+
+    @property
+    def capacity(self):
+        # One extra task per process keeps the threads from waiting on the
+        # parent when a session finishes.
+        return self.connections + self.jobs
+
+
+ENGINES = {
+    ProcessEngine.name: ProcessEngine,
+    AsyncEngine.name: AsyncEngine,
+    HybridEngine.name: HybridEngine,
+}
+
+
+def engine_class(engine=None):
+    """
+    Get the engine class for an engine name or instance
+    :param engine: An engine name from ENGINES or a BaseEngine instance,
+                   defaults to the process engine.
+    """
+    if isinstance(engine, BaseEngine):
+        return engine.__class__
+    if not engine:
+        engine = ProcessEngine.name
+    if engine not in ENGINES:
+        raise ValueError(
+            'Unknown engine %r, valid engines are: %s' % (
+                engine, ', '.join(sorted(ENGINES))
+            )
+        )
+    return ENGINES[engine]
+
+
+def get_engine(engine=None, jobs=1, chunksize=1, connections=None):
+    """
+    Get an engine instance
+    :param engine: An engine name from ENGINES or a BaseEngine instance,
+                   defaults to the process engine.
+    :param jobs: The number of worker processes (threads for the async
+                 engine)
+    :param chunksize:
+    :param connections: The number of concurrent ssh sessions for the
+                        engines that run several sessions per worker
+    """
+    if isinstance(engine, BaseEngine):
+        return engine
+    return engine_class(engine)(
+        jobs=jobs, chunksize=chunksize, connections=connections
+    )
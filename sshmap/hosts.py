@@ -0,0 +1,119 @@
+# Copyright (c) 2010-2015, Yahoo Inc.
+# Copyrights licensed under the Apache 2.0 License
+# See the accompanying LICENSE.txt file for terms.
+"""
+sshmap host list expansion
+"""
+import random
+
+# Imports from other sshmap modules
+import hostlists
+from .utility import basestring
+
+
+# The hostlists set operators, a range using them has to be expanded as a
+# whole
+SET_OPERATORS = ['-']
+
+
+class HostList(object):
+    """
+    The hosts of a hostlists range, or of any iterable of host names,
+    expanded only as far as they are read and kept, so the range is only
+    expanded once and the hosts stay in the same order every time they are
+    read.
+
+    >>> hosts = HostList('foo[1-3],bar')
+    >>> hosts.count_at_least(2)
+    2
+    >>> list(hosts)
+    ['foo1', 'foo2', 'foo3', 'bar']
+    """
+
+    def __init__(self, host_range, shuffle=False):
+        """
+        :param host_range: A hostlists range string or an iterable of hosts
+        :param shuffle: Put the hosts in a random order, this expands the
+                        whole range the first time a host is read.
+        """
+        self.host_range = host_range
+        self.shuffle = shuffle
+        self._hosts = []
+        self._pending = self._expand()
+        self.expanded = False
+
+    def __iter__(self):
+        index = 0
+        while index < len(self._hosts) or self._next():
+            yield self._hosts[index]
+            index += 1
+
+    def __len__(self):
+        return len(self.expand())
+
+    def __getitem__(self, index):
+        return self.expand()[index]
+
+    def __bool__(self):
+        return self.count_at_least(1) > 0
+
+    __nonzero__ = __bool__
+
+    def __repr__(self):
+        return 'HostList(%r)' % self.host_range
+
+    def _expand(self):
+        """ Generate the hosts in the range """
+        if isinstance(self.host_range, basestring):
+            items = hostlists.range_split(self.host_range)
+            if self.shuffle or \
+                    any(item.strip() in SET_OPERATORS for item in items):
+                hosts = hostlists.expand(items)
+            else:
+                # Expand an item at a time so the first hosts can be used
+                # while the rest of a large range is still being expanded
+                hosts = (
+                    host for item in items for host in hostlists.expand([item])
+                )
+        else:
+            hosts = self.host_range
+        if self.shuffle:
+            hosts = list(hosts)
+            random.shuffle(hosts)
+        for host in hosts:
+            yield host
+
+    def _next(self):
+        """
+        Expand the next host
+        :return: False if there are no more hosts
+        """
+        if self.expanded:
+            return False
+        try:
+            self._hosts.append(next(self._pending))
+        except StopIteration:
+            self.expanded = True
+            return False
+        return True
+
+    @property
+    def count(self):
+        """ The number of hosts expanded so far """
+        return len(self._hosts)
+
+    def count_at_least(self, count):
+        """
+        Expand the range until there are count hosts
+        :param count:
+        :return: count or the number of hosts if there are fewer
+        """
+        while len(self._hosts) < count and self._next():
+            pass
+        return min(len(self._hosts), count)
+
+    def expand(self):
+        """ Expand the whole range and return the list of hosts """
+        while self._next():
+            pass
+        return self._hosts
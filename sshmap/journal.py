@@ -0,0 +1,200 @@
+# Copyright (c) 2010-2015, Yahoo Inc.
+# Copyrights licensed under the Apache 2.0 License
+# See the accompanying LICENSE.txt file for terms.
+"""
+sshmap checkpoint journal of a run
+
+A journal is a file with a line of JSON for each host that finished, with
+the return codes and output of its results.  Each line is written and
+flushed as the host finishes, so when a long run is interrupted, or the
+process running it dies, the run can be resumed from the journal.  A
+resumed run skips the hosts in the journal, or only the ones that
+succeeded, and its results hold the results read back from the journal
+followed by the results of the hosts that ran.
+
+>>> results = sshmap.run('web[1-30000]', 'uptime', journal='uptime.journal')
+>>> results = sshmap.run(
+...     'web[1-30000]', 'uptime', journal='uptime.journal', resume=True
+... )
+"""
+import json
+import os
+import threading
+import time
+
+from . import defaults
+
+
+def _entry_result(result):
+    """
+    Get the journal entry of a result
+    :param result:
+    """
+    entry = dict(
+        command=result.command, retcode=result.retcode,
+        ssh_retcode=result.ssh_retcode,
+        out=result.out_string(), err=result.err_string()
+    )
+    if getattr(result, 'attempts', 1) > 1:
+        entry['attempts'] = result.attempts
+    if getattr(result, 'records', None) is not None:
+        # The output was dropped once the reducers mapped it
+        entry['records'] = result.records
+    return entry
+
+
+def succeeded(entry):
+    """
+    Check if all the results of a journal entry succeeded
+    :param entry:
+    """
+    return all(
+        result['ssh_retcode'] == defaults.RUN_OK and result['retcode'] == 0
+        for result in entry['results']
+    )
+
+
+class Journal(object):
+    """
+    An append only file with a line of JSON for each host that finished.
+    When a host is in the journal more than once the last entry is used.
+    """
+
+    def __init__(self, path, resume=False):
+        """
+        :param path: The journal file
+        :param resume: Read the hosts already in the file and add to it,
+                       otherwise the file is started over
+        """
+        self.path = path
+        self.entries = {}
+        if resume and os.path.exists(path):
+            with open(path) as handle:
+                for line in handle:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # The last line is cut short if the process writing
+                        # it died
+                        continue
+                    self.entries[entry['host']] = entry
+        self._handle = open(path, 'a' if resume else 'w')
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def record(self, results):
+        """
+        Add the results of a host that finished
+        :param results: A result or the list of results of a host
+        """
+        if not isinstance(results, list):
+            results = [results]
+        if not results:
+            return
+        entry = dict(
+            host=results[0].host, time=time.time(),
+            results=[_entry_result(result) for result in results]
+        )
+        # Sets in the records of SetUnion reducers are kept as lists
+        line = json.dumps(entry, default=list) + '\n'
+        with self._lock:
+            self._handle.write(line)
+            self._handle.flush()
+            self.entries[entry['host']] = entry
+
+    def track(self, items):
+        """
+        Record the results of each host coming back from an engine, yielding
+        the items.  Hosts that were cancelled, or cut off by the deadline of
+        the run, didn't finish and aren't recorded.
+        :param items:
+        """
+        for item in items:
+            # The OutputLine items are tuples
+            if not isinstance(item, tuple):
+                results = item if isinstance(item, list) else [item]
+                if not any(
+                    result.ssh_retcode == defaults.RUN_CANCELLED or
+                    getattr(result, 'expired', False)
+                    for result in results
+                ):
+                    self.record(results)
+            yield item
+
+    def done(self, rerun_failed=False):
+        """
+        Get the hosts a resumed run skips
+        :param rerun_failed: Only skip the hosts that succeeded
+        :return: A set of host names
+        """
+        return set(
+            host for host, entry in self.entries.items()
+            if not rerun_failed or succeeded(entry)
+        )
+
+    def results(self, host, parm=None):
+        """
+        Get result objects for the entry of a host
+        :param host:
+        :param parm: The parm dict of the results
+        :return: A list of results
+        """
+        # Imported here, sshmap.sshmap uses this module
+        from .sshmap import ssh_result
+        results = []
+        for item in self.entries[host]['results']:
+            result = ssh_result(
+                out=item['out'], err=item['err'], host=host,
+                retcode=item['retcode'], ssh_ret=item['ssh_retcode'],
+                parm={} if parm is None else parm, command=item['command']
+            )
+            result.attempts = item.get('attempts', 1)
+            result.records = item.get('records')
+            results.append(result)
+        return results
+
+    def split(self, hosts, rerun_failed=False):
+        """
+        Split the hosts of a resumed run into the ones that still have to
+        run and the results of the ones that don't
+        :param hosts: A list of hosts
+        :param rerun_failed: Run the hosts that failed again
+        :return: A tuple of the list of hosts to run and a list with the list
+                 of results of each host that is skipped
+        """
+        done = self.done(rerun_failed=rerun_failed)
+        pending = []
+        resumed = []
+        seen = set()
+        for host in hosts:
+            if host not in done:
+                pending.append(host)
+            elif host not in seen:
+                seen.add(host)
+                resumed.append(self.results(host))
+        return pending, resumed
+
+    def close(self):
+        """ Close the journal file """
+        with self._lock:
+            self._handle.close()
+
+
+def get_journal(journal=None, resume=False):
+    """
+    Get the Journal for the journal argument of a run
+    :param journal: A Journal, or the path of the journal file
+    :param resume: Resume from the hosts already in the journal file
+    :return: The Journal or None
+    """
+    if journal is None or isinstance(journal, Journal):
+        return journal
+    return Journal(journal, resume=resume)
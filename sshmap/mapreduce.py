@@ -0,0 +1,268 @@
+# Copyright (c) 2010-2015, Yahoo Inc.
+# Copyrights licensed under the Apache 2.0 License
+# See the accompanying LICENSE.txt file for terms.
+"""
+sshmap map reduce of the results of a run
+
+A Reducer reduces the results of a run to a single value.  Its map() runs
+in the ssh worker right after the command, and turns the result into a
+small record, the kernel version of a host or the number of lines it
+printed.  The output of the results is dropped in the workers, so only the
+records come back to the current process, where combine() adds each of
+them to the value of the reducer as the results arrive.
+
+combine() has to be associative, it can't depend on the order the records
+arrive in.  With the process engines the reducers are sent to the worker
+processes, so the functions passed as map have to be picklable, a module
+level function rather than a lambda.
+
+>>> results = sshmap.run(
+...     'web[1-50000]', 'uname -r',
+...     reducers={'kernels': sshmap.mapreduce.TopK(10)}
+... )
+>>> results.parm['reduced']['kernels']
+[('4.4.0-generic', 41210), ('3.10.0-957', 8790)]
+"""
+from collections import Counter, OrderedDict
+
+from .utility import basestring
+
+
+def output_text(result):
+    """
+    The default map of the reducers, the output of the result without the
+    whitespace around it
+    :param result:
+    """
+    return result.out_string().strip()
+
+
+def output_lines(result):
+    """
+    Map a result to the set of its output lines
+    :param result:
+    """
+    return set(
+        line.strip() for line in result.out_string().splitlines()
+        if line.strip()
+    )
+
+
+class Reducer(object):
+    """
+    Reduce the results of a run to a value, the base class of the reducers
+    """
+
+    def __init__(self, map=None):
+        """
+        :param map: A function taking a result and returning its record,
+                    returning None leaves the result out
+        """
+        self._map = map
+
+    def map(self, result):
+        """
+        Get the record of a result, this runs in the worker
+        :param result:
+        """
+        return (self._map or output_text)(result)
+
+    def initial(self):
+        """ The value before any records are combined """
+        return None
+
+    def combine(self, acc, record):
+        """
+        Add a record to the value, this runs in the current process
+        :param acc: The value so far
+        :param record:
+        :return: The new value
+        """
+        raise NotImplementedError()
+
+    def finish(self, acc):
+        """
+        Get the result of the reducer from its value
+        :param acc:
+        """
+        return acc
+
+
+class Count(Reducer):
+    """
+    Count the results, the records are added up, so map can return a bool
+    to count the results it is True for
+    """
+
+    def map(self, result):
+        if self._map is None:
+            return 1
+        return self._map(result)
+
+    def initial(self):
+        return 0
+
+    def combine(self, acc, record):
+        return acc + record
+
+
+class Histogram(Reducer):
+    """
+    Count the results with each record, a Counter of record: count
+    """
+
+    def initial(self):
+        return Counter()
+
+    def combine(self, acc, record):
+        if isinstance(record, list):
+            # A tuple record read back from a journal
+            record = tuple(record)
+        acc[record] += 1
+        return acc
+
+
+class TopK(Histogram):
+    """
+    The k most common records, a list of (record, count) from the most
+    common
+    """
+
+    def __init__(self, k=10, map=None):
+        """
+        :param k: The number of records to keep
+        :param map:
+        """
+        super(TopK, self).__init__(map=map)
+        self.k = k
+
+    def finish(self, acc):
+        return acc.most_common(self.k)
+
+
+class SetUnion(Reducer):
+    """
+    The set of the values in the records, the records are single values or
+    collections of them.  The default map gives the output lines.
+    """
+
+    def map(self, result):
+        return (self._map or output_lines)(result)
+
+    def initial(self):
+        return set()
+
+    def combine(self, acc, record):
+        if isinstance(record, basestring) or \
+                not hasattr(record, '__iter__'):
+            record = [record]
+        acc.update(record)
+        return acc
+
+
+def map_result(reducers, result):
+    """
+    Get the records of a result
+    :param reducers: An OrderedDict of name: Reducer
+    :param result:
+    :return: A dict of name: record
+    """
+    return dict(
+        (name, reducer.map(result)) for name, reducer in reducers.items()
+    )
+
+
+class _MapWorker(object):
+    """
+    The worker function of a run with reducers, a class so it pickles with
+    the reducers when the engine sends it to its workers
+    """
+
+    def __init__(self, worker, reducers, keep_output):
+        self.worker = worker
+        self.reducers = reducers
+        self.keep_output = keep_output
+
+    def __call__(self, task):
+        item = self.worker(task)
+        for result in item if isinstance(item, list) else [item]:
+            result.records = map_result(self.reducers, result)
+            if not self.keep_output:
+                # Only the records go back, the error of a failed connection
+                # is kept with the return codes
+                result.out = []
+                result.err = []
+        return item
+
+
+class MapReduce(object):
+    """
+    The reducers of a run and their values
+    """
+
+    def __init__(self, reducers, keep_output=False):
+        """
+        :param reducers: A dict of name: Reducer
+        :param keep_output: Send the output of the results back with their
+                            records
+        """
+        self.reducers = OrderedDict(
+            sorted(reducers.items()) if not isinstance(reducers, OrderedDict)
+            else reducers.items()
+        )
+        self.keep_output = keep_output
+        self.values = {}
+        self.reset()
+
+    def reset(self):
+        """ Start the values of the reducers over """
+        self.values = dict(
+            (name, reducer.initial())
+            for name, reducer in self.reducers.items()
+        )
+
+    def worker_function(self, worker):
+        """
+        Get the worker function of a run, mapping the results of worker to
+        their records
+        :param worker:
+        """
+        return _MapWorker(worker, self.reducers, self.keep_output)
+
+    def combine(self, result):
+        """
+        The output callback combining the records of each result into the
+        values of the reducers.  A result made in the current process, for
+        a host that expired, was cancelled or was resumed from a journal, is
+        mapped here.
+        :param result:
+        """
+        records = result.records
+        if records is None:
+            records = map_result(self.reducers, result)
+        for name, reducer in self.reducers.items():
+            record = records.get(name)
+            if record is not None:
+                self.values[name] = reducer.combine(self.values[name], record)
+        return result
+
+    def results(self):
+        """
+        Get the result of each reducer
+        :return: A dict of name: result
+        """
+        return dict(
+            (name, reducer.finish(self.values[name]))
+            for name, reducer in self.reducers.items()
+        )
+
+
+def get_mapreduce(reducers=None):
+    """
+    Get the MapReduce for the reducers argument of a run
+    :param reducers: A MapReduce or a dict of name: Reducer
+    :return: The MapReduce or None
+    """
+    if not reducers or isinstance(reducers, MapReduce):
+        return reducers or None
+    return MapReduce(reducers)
@@ -0,0 +1,409 @@
+# Copyright (c) 2010-2015, Yahoo Inc.
+# Copyrights licensed under the Apache 2.0 License
+# See the accompanying LICENSE.txt file for terms.
+"""
+sshmap live metrics of a run
+
+A RunMetrics object is updated by run() and SSHCommand as hosts are
+dispatched and their results come back.  It can be watched while the run
+goes on by serving it over http in the Prometheus text format, with a
+MetricsServer, or by appending a snapshot to a JSON lines file at an
+interval, with a MetricsWriter.
+
+>>> metrics = RunMetrics()
+>>> server = MetricsServer(metrics, port=0).start()
+>>> results = sshmap.run('localhost', 'echo ok', metrics=metrics)
+>>> server.stop()
+"""
+import json
+import threading
+import time
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:  # pragma: no cover
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+from . import defaults
+from .timing import clock
+
+
+# The upper bounds of the latency histogram buckets in seconds
+LATENCY_BUCKETS = [
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300
+]
+
+# The phases that make up the connect and exec latencies
+CONNECT_PHASES = ['dns', 'connect', 'kex', 'auth']
+EXEC_PHASES = ['channel', 'exec', 'transfer']
+
+# How often a MetricsWriter appends a snapshot by default
+WRITE_INTERVAL = 10
+
+
+def status_name(ssh_retcode):
+    """
+    Get the defaults.RUN_CODES text of an ssh return code
+    :param ssh_retcode:
+    """
+    if 0 <= ssh_retcode < len(defaults.RUN_CODES):
+        return defaults.RUN_CODES[ssh_retcode]
+    return str(ssh_retcode)
+
+
+class Histogram(object):
+    """
+    A histogram of values counted in buckets with upper bounds, like a
+    Prometheus histogram
+    """
+
+    def __init__(self, buckets=None):
+        self.buckets = list(buckets or LATENCY_BUCKETS)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        """
+        Count a value
+        :param value:
+        """
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        """
+        Get the count of values at or below each bucket bound
+        :return: A list of (bound, count), ending with ('+Inf', count)
+        """
+        total = 0
+        cumulative = []
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            cumulative.append((bound, total))
+        cumulative.append(('+Inf', self.count))
+        return cumulative
+
+    def snapshot(self):
+        return dict(
+            buckets=[[str(bound), count] for bound, count in self.cumulative()],
+            count=self.count, sum=self.sum
+        )
+
+
+class RunMetrics(object):
+    """
+    Counters, gauges and histograms of the hosts of a run, safe to read from
+    another thread while the run updates them.
+    """
+
+    def __init__(self, buckets=None):
+        """
+        :param buckets: The upper bounds of the latency histogram buckets,
+                        defaults to LATENCY_BUCKETS
+        """
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.hosts_total = 0
+        self.dispatched = 0
+        self.completed = 0
+        self.not_run = 0
+        self.results = {}
+        self.command_failures = 0
+        self.retries = 0
+        self.received_bytes = 0
+        self.connect_seconds = Histogram(buckets)
+        self.exec_seconds = Histogram(buckets)
+        self._last_completed = clock()
+
+    @property
+    def pending(self):
+        """
+        The number of hosts handed to the engine that haven't finished, the
+        hosts are handed over ahead of the workers so this counts the hosts
+        queued in the engine along with the ones running the command
+        """
+        return self.dispatched - self.completed - self.not_run
+
+    @property
+    def failed(self):
+        """ The number of results that didn't get an ssh return code of 0 """
+        ok = defaults.RUN_CODES[defaults.RUN_OK]
+        return sum(
+            count for status, count in self.results.items() if status != ok
+        )
+
+    def dispatch(self, hosts):
+        """
+        Generate the hosts, counting each one as dispatched when it is taken
+        :param hosts:
+        """
+        for host in hosts:
+            with self._lock:
+                self.dispatched += 1
+            yield host
+
+    def skip(self, count):
+        """
+        Count dispatched hosts that never ran because the run was cancelled
+        :param count:
+        """
+        with self._lock:
+            self.not_run += count
+
+    def complete(self, results):
+        """
+        Count a host as completed with its results
+        :param results: The list of the results of the host
+        """
+        with self._lock:
+            self.completed += 1
+            self._last_completed = clock()
+            if results:
+                self.retries += getattr(results[0], 'attempts', 1) - 1
+            for result in results:
+                status = status_name(result.ssh_retcode)
+                self.results[status] = self.results.get(status, 0) + 1
+                if result.retcode:
+                    self.command_failures += 1
+                self.received_bytes += getattr(result, 'received', 0)
+                timings = getattr(result, 'timings', None)
+                if timings is None:
+                    continue
+                durations = timings.durations()
+                for histogram, phases in [
+                    (self.connect_seconds, CONNECT_PHASES),
+                    (self.exec_seconds, EXEC_PHASES)
+                ]:
+                    seconds = [
+                        durations[phase] for phase in phases
+                        if phase in durations
+                    ]
+                    if seconds:
+                        histogram.observe(sum(seconds))
+
+    def snapshot(self):
+        """
+        Get the current values as a dict that can be dumped as JSON
+        """
+        with self._lock:
+            return dict(
+                time=time.time(),
+                elapsed=time.time() - self.started,
+                hosts_total=self.hosts_total,
+                dispatched=self.dispatched,
+                pending=self.pending,
+                completed=self.completed,
+                not_run=self.not_run,
+                failed=self.failed,
+                results=dict(self.results),
+                command_failures=self.command_failures,
+                retries=self.retries,
+                received_bytes=self.received_bytes,
+                seconds_since_completed=clock() - self._last_completed,
+                connect_seconds=self.connect_seconds.snapshot(),
+                exec_seconds=self.exec_seconds.snapshot()
+            )
+
+    def prometheus(self):
+        """
+        Get the current values in the Prometheus text exposition format
+        """
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append('# HELP sshmap_%s %s' % (name, help_text))
+            lines.append('# TYPE sshmap_%s %s' % (name, kind))
+            for suffix, labels, value in samples:
+                label_text = ''
+                if labels:
+                    label_text = '{%s}' % ','.join(
+                        '%s="%s"' % item for item in labels
+                    )
+                lines.append('sshmap_%s%s%s %s' % (
+                    name, suffix, label_text, value
+                ))
+
+        def histogram(name, help_text, values):
+            samples = [
+                ('_bucket', [('le', bound)], count)
+                for bound, count in values.cumulative()
+            ]
+            samples += [
+                ('_sum', None, values.sum), ('_count', None, values.count)
+            ]
+            metric(name, 'histogram', help_text, samples)
+
+        with self._lock:
+            metric('hosts', 'gauge', 'Hosts in the host range expanded so far', [
+                ('', None, self.hosts_total)
+            ])
+            metric(
+                'hosts_pending', 'gauge',
+                'Hosts handed to the engine that are queued or running', [
+                    ('', None, self.pending)
+                ]
+            )
+            metric(
+                'hosts_dispatched_total', 'counter',
+                'Hosts handed to the engine', [('', None, self.dispatched)]
+            )
+            metric(
+                'hosts_completed_total', 'counter', 'Hosts that finished',
+                [('', None, self.completed)]
+            )
+            metric(
+                'hosts_not_run_total', 'counter',
+                'Hosts that never ran because the run was cancelled',
+                [('', None, self.not_run)]
+            )
+            metric(
+                'results_total', 'counter',
+                'Results by ssh return code', [
+                    ('', [('status', status)], count)
+                    for status, count in sorted(self.results.items())
+                ]
+            )
+            metric(
+                'command_failures_total', 'counter',
+                'Commands that exited with a non 0 return code',
+                [('', None, self.command_failures)]
+            )
+            metric(
+                'retries_total', 'counter',
+                'Hosts tried again after a transient failure',
+                [('', None, self.retries)]
+            )
+            metric(
+                'received_bytes_total', 'counter',
+                'Bytes of output received', [('', None, self.received_bytes)]
+            )
+            histogram(
+                'connect_seconds',
+                'Seconds to look up, connect and authenticate to a host',
+                self.connect_seconds
+            )
+            histogram(
+                'exec_seconds',
+                'Seconds from opening the channel to the command exiting',
+                self.exec_seconds
+            )
+        return '\n'.join(lines) + '\n'
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    """ Serve the metrics of the server's RunMetrics """
+
+    def do_GET(self):
+        metrics = self.server.metrics
+        if self.path in ['/', '/metrics']:
+            body = metrics.prometheus()
+            content_type = 'text/plain; version=0.0.4; charset=utf-8'
+        elif self.path == '/metrics.json':
+            body = json.dumps(metrics.snapshot())
+            content_type = 'application/json'
+        else:
+            self.send_error(404)
+            return
+        body = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class MetricsServer(object):
+    """
+    Serve a RunMetrics over http from a background thread, in the
+    Prometheus text format at /metrics and as JSON at /metrics.json
+    """
+
+    def __init__(self, metrics, port=9100, address='127.0.0.1'):
+        """
+        :param metrics: The RunMetrics to serve
+        :param port: The port to listen on, 0 picks a free port
+        :param address: The address to listen on
+        """
+        self.metrics = metrics
+        self._server = HTTPServer((address, port), _MetricsHandler)
+        self._server.metrics = metrics
+        self.address, self.port = self._server.server_address[:2]
+        self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        """ Start serving """
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """ Stop serving and close the socket """
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._server.server_close()
+
+
+class MetricsWriter(object):
+    """
+    Append a JSON line with a snapshot of a RunMetrics to a file every
+    interval seconds from a background thread, and a last one when stopped
+    """
+
+    def __init__(self, metrics, path, interval=WRITE_INTERVAL):
+        """
+        :param metrics: The RunMetrics to write
+        :param path: The file to append the snapshots to
+        :param interval: Seconds between snapshots
+        """
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def write(self):
+        """ Append a snapshot now """
+        with open(self.path, 'a') as handle:
+            handle.write(json.dumps(self.metrics.snapshot()) + '\n')
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def start(self):
+        """ Start writing snapshots """
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """ Stop writing and append a final snapshot """
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        self.write()
@@ -0,0 +1,172 @@
+# Copyright (c) 2010-2015, Yahoo Inc.
+# Copyrights licensed under the Apache 2.0 License
+# See the accompanying LICENSE.txt file for terms.
+"""
+sshmap compact storage for the output of a command
+"""
+from array import array
+try:
+    from collections.abc import Sequence
+except ImportError:  # pragma: no cover
+    from collections import Sequence
+
+from .store import StoredLines
+
+
+def _encode(line):
+    if isinstance(line, (bytes, bytearray)):
+        return line
+    return line.encode()
+
+
+def decode(data):
+    """
+    Decode output from a host, dropping anything that isn't valid UTF-8
+    instead of failing
+    :param data:
+    """
+    return data.decode('utf-8', 'ignore')
+
+
+class OutputBuffer(Sequence):
+    """
+    The output of a command as a list of lines, kept as a single bytes
+    buffer and the offsets where each line ends.  The lines and text
+    are decoded the first time they are used and cached.
+
+    Results hold one of these for each of stdout and stderr, so it has no
+    __dict__ and the offsets are only allocated for non empty output.
+
+    >>> output = OutputBuffer(['one\\n', 'two\\n'])
+    >>> output.tobytes()
+    b'one\\ntwo\\n'
+    >>> list(output)
+    ['one\\n', 'two\\n']
+    """
+
+    __slots__ = ('_data', '_ends', '_lines', '_text')
+
+    def __init__(self, lines=None):
+        """
+        :param lines: A list of lines, each str or bytes, or a str or bytes
+                      holding the whole output that is split into lines
+                      after each newline.
+        """
+        self._data = b''
+        self._ends = None
+        if isinstance(lines, (bytes, bytearray, str)):
+            self._data = bytes(_encode(lines))
+            self._split_lines(0)
+        elif lines:
+            lines = [_encode(line) for line in lines]
+            self._data = b''.join(lines)
+            end = 0
+            for line in lines:
+                end += len(line)
+                self._append_end(end)
+        self._lines = None
+        self._text = None
+
+    def __getstate__(self):
+        return bytes(self._data), self._ends
+
+    def __setstate__(self, state):
+        self._data, self._ends = state
+        self._lines = None
+        self._text = None
+
+    def __getitem__(self, index):
+        return self.lines()[index]
+
+    def __len__(self):
+        return len(self._ends) if self._ends else 0
+
+    def __iter__(self):
+        return iter(self.lines())
+
+    def __eq__(self, other):
+        if isinstance(other, OutputBuffer):
+            return self._data == other._data and \
+                list(self._ends or []) == list(other._ends or [])
+        return self.lines() == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return repr(self.lines())
+
+    def _append_end(self, end):
+        if self._ends is None:
+            self._ends = array('L')
+        self._ends.append(end)
+
+    def _split_lines(self, start):
+        """ Add the ends of the lines in the data after start """
+        data = self._data
+        end = data.find(b'\n', start)
+        while end != -1:
+            self._append_end(end + 1)
+            start = end + 1
+            end = data.find(b'\n', start)
+        if start < len(data):
+            self._append_end(len(data))
+
+    def append(self, line):
+        """
+        Add a line to the end of the output
+        :param line:
+        """
+        self.extend([line])
+
+    def extend(self, lines):
+        """
+        Add lines to the end of the output
+        :param lines:
+        """
+        lines = [_encode(line) for line in lines]
+        end = len(self._data)
+        if not isinstance(self._data, bytearray):
+            # Grow in place from now on instead of copying on every add
+            self._data = bytearray(self._data)
+        self._data += b''.join(lines)
+        for line in lines:
+            end += len(line)
+            self._append_end(end)
+        self._lines = None
+        self._text = None
+
+    def tobytes(self):
+        """ Return the output as bytes """
+        return bytes(self._data)
+
+    def text(self):
+        """ Return the output decoded as a str """
+        if self._text is None:
+            self._text = decode(self._data)
+        return self._text
+
+    def lines(self):
+        """ Return the lines of the output decoded as str """
+        if self._lines is None:
+            data = self._data
+            start = 0
+            lines = []
+            for end in self._ends or []:
+                lines.append(decode(data[start:end]))
+                start = end
+            self._lines = lines
+        return self._lines
+
+
+def as_output(value):
+    """
+    Get the OutputBuffer, or StoredLines, to store for a value assigned to
+    the out or err of a result
+    :param value:
+    """
+    if isinstance(value, (OutputBuffer, StoredLines)):
+        return value
+    if not value:
+        return OutputBuffer()
+    return OutputBuffer(value)
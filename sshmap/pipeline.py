@@ -0,0 +1,357 @@
+# Copyright (c) 2010-2015, Yahoo Inc.
+# Copyrights licensed under the Apache 2.0 License
+# See the accompanying LICENSE.txt file for terms.
+"""
+sshmap output callback pipeline
+
+The output_callback functions of a run are run on each result as it comes
+back.  By default they run one after the other in the process running the
+command, so an expensive callback holds up the whole run while the workers
+sit idle.
+
+Callbacks marked with the stateless() decorator only use the result they
+are passed and the settings in its parm, so they can run at the same time
+on different results.  A CallbackPipeline splits the callbacks into stages,
+runs the stages of stateless callbacks in a pool of threads or processes
+and keeps the other callbacks, like summarize_failures and
+aggregate_output that add up the results in parm, in the order the results
+arrive in the current process.  The 'worker' mode runs the stateless
+callbacks at the start of the pipeline in the ssh workers, right after the
+command.
+
+>>> results = sshmap.run(
+...     'web[1-2000]', 'rpm -qa', callback_mode='thread',
+...     output_callback=[sshmap.callback.filter_json,
+...                      sshmap.callback.summarize_failures]
+... )
+"""
+from collections import deque
+import multiprocessing
+try:
+    from collections.abc import Iterable
+except ImportError:  # pragma: no cover
+    from collections import Iterable
+try:
+    import concurrent.futures
+except ImportError:  # pragma: no cover
+    # Python 2 without the futures backport, only the serial and worker
+    # modes can be used
+    concurrent = None
+
+
+SERIAL = 'serial'
+THREAD = 'thread'
+PROCESS = 'process'
+WORKER = 'worker'
+MODES = [SERIAL, THREAD, PROCESS, WORKER]
+
+# How many results are handed to a pool for each of its workers before the
+# pipeline waits for one to come back
+WINDOW_PER_WORKER = 4
+
+# The parm the 'worker' mode sends a result back with when the retry policy
+# will try its host again, so its callbacks run once, on the attempt that
+# is kept
+CALLBACKS_PENDING = 'callbacks pending'
+
+# The callbacks and parm of the stage run by a callback process
+_process_callbacks = []
+_process_parm = {}
+
+
+def stateless(func):
+    """
+    Mark a callback as only using the result it is passed, and the settings
+    in its parm, so it can run in parallel with itself
+    :param func:
+    """
+    func.stateless = True
+    return func
+
+
+def is_stateless(func):
+    """
+    Check if a callback is marked as stateless
+    :param func:
+    """
+    return getattr(func, 'stateless', False)
+
+
+def apply_callbacks(callbacks, result):
+    """
+    Run a list of callbacks on a result
+    :param callbacks:
+    :param result:
+    :return: The result returned by the last callback
+    """
+    for callback in callbacks:
+        result = callback(result)
+    return result
+
+
+def _init_process(callbacks, parm):
+    global _process_callbacks, _process_parm
+    _process_callbacks = callbacks
+    _process_parm = parm
+
+
+def _apply_in_process(result):
+    result.parm = _process_parm
+    result = apply_callbacks(_process_callbacks, result)
+    # The parm is the copy of the settings sent to the process, the parent
+    # puts the shared one back
+    result.parm = None
+    return result
+
+
+def apply_in_worker(worker, callbacks, parm, task, retry=None):
+    """
+    Run the callbacks on the results of a task in the ssh worker that ran
+    it, this is the worker function of the 'worker' mode
+    :param worker: The worker function of the run
+    :param callbacks: The stateless callbacks
+    :param parm: A copy of the settings of the run
+    :param task:
+    :param retry: The RetryPolicy of the run, results it may try again are
+                  sent back with their callbacks pending
+    """
+    item = worker(task)
+    results = item if isinstance(item, list) else [item]
+    if retry is not None and retry.retryable(results):
+        for result in results:
+            result.parm = CALLBACKS_PENDING
+        return item
+    for index, result in enumerate(results):
+        result.parm = parm
+        result = apply_callbacks(callbacks, result)
+        # Only the result goes back to the parent, it has its own parm
+        result.parm = None
+        results[index] = result
+    return results if isinstance(item, list) else results[0]
+
+
+class CallbackPipeline(object):
+    """
+    Run a list of output callbacks on the results of a run, with the
+    stateless ones in a pool of threads or processes or in the ssh workers.
+    """
+
+    def __init__(self, callbacks, mode=SERIAL, workers=None, ordered=True):
+        """
+        :param callbacks: A callback or a list of them
+        :param mode: Where the stateless callbacks run, 'serial' in the
+                     current process one result at a time, 'thread' or
+                     'process' in a pool of threads or processes, 'worker'
+                     in the ssh workers for the ones at the start of the
+                     pipeline.
+        :param workers: The number of threads or processes of each pool,
+                        defaults to the cpu count
+        :param ordered: Keep the results in the order they came back from
+                        the hosts, otherwise they go on through the
+                        pipeline as soon as the pool is done with them
+        """
+        if mode is None:
+            mode = SERIAL
+        if mode not in MODES:
+            raise ValueError(
+                'Invalid callback mode %r, use one of %s' % (
+                    mode, ', '.join(MODES)
+                )
+            )
+        if mode in [THREAD, PROCESS] and concurrent is None:
+            raise ImportError(
+                'The %r callback mode needs concurrent.futures, install the '
+                'futures package on python 2' % mode
+            )
+        if callbacks is None:
+            callbacks = []
+        elif not isinstance(callbacks, Iterable):
+            callbacks = [callbacks]
+        self.callbacks = list(callbacks)
+        self.mode = mode
+        self.workers = max(int(workers or multiprocessing.cpu_count()), 1)
+        self.ordered = ordered
+
+    def worker_callbacks(self):
+        """
+        The stateless callbacks at the start of the pipeline, that the
+        'worker' mode runs in the ssh workers
+        """
+        if self.mode != WORKER:
+            return []
+        callbacks = []
+        for callback in self.callbacks:
+            if not is_stateless(callback):
+                break
+            callbacks.append(callback)
+        return callbacks
+
+    def worker_function(self, worker, parm, retry=None):
+        """
+        Get the worker function of a run, with the worker callbacks added to
+        it in the 'worker' mode
+        :param worker:
+        :param parm: The settings of the run the callbacks can read
+        :param retry: The RetryPolicy of the run.  The engine calls the
+                      worker function for each attempt, the callbacks of a
+                      result the policy may retry are left to the current
+                      process, see pending().
+        """
+        callbacks = self.worker_callbacks()
+        if not callbacks:
+            return worker
+        return _WorkerFunction(worker, callbacks, dict(parm), retry)
+
+    def pending(self, items, parm):
+        """
+        Run the worker callbacks on the results that came back from the
+        workers with their callbacks pending, the last attempt of a host
+        that was retried.  This runs on the items as they come back from
+        the engine, before the parm of the run is attached to them.
+        :param items:
+        :param parm: The shared parm dict of the run
+        """
+        callbacks = self.worker_callbacks()
+        for item in items:
+            # The OutputLine items are tuples
+            if callbacks and not isinstance(item, tuple):
+                results = item if isinstance(item, list) else [item]
+                for index, result in enumerate(results):
+                    if result.parm == CALLBACKS_PENDING:
+                        result.parm = parm
+                        results[index] = apply_callbacks(callbacks, result)
+                if not isinstance(item, list):
+                    item = results[0]
+            yield item
+
+    def stages(self):
+        """
+        Split the callbacks run in the current process into stages
+        :return: A list of (parallel, callbacks) tuples, parallel is True
+                 for a stage of stateless callbacks run in a pool
+        """
+        callbacks = self.callbacks[len(self.worker_callbacks()):]
+        parallel_mode = self.mode in [THREAD, PROCESS]
+        stages = []
+        for callback in callbacks:
+            parallel = parallel_mode and is_stateless(callback)
+            if stages and stages[-1][0] == parallel:
+                stages[-1][1].append(callback)
+            else:
+                stages.append((parallel, [callback]))
+        return stages
+
+    def run(self, items, parm):
+        """
+        Run the pipeline on the results coming back from a run, yielding
+        them as they come out of it.  OutputLine items are passed through.
+        :param items:
+        :param parm: The shared parm dict of the run
+        """
+        for parallel, callbacks in self.stages():
+            if parallel:
+                items = self._run_pool(callbacks, items, parm)
+            else:
+                items = self._run_serial(callbacks, items)
+        return items
+
+    @staticmethod
+    def _run_serial(callbacks, items):
+        for item in items:
+            # The OutputLine items are tuples
+            if not isinstance(item, tuple):
+                item = apply_callbacks(callbacks, item)
+            yield item
+
+    def _run_pool(self, callbacks, items, parm):
+        if self.mode == PROCESS:
+            executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.workers, initializer=_init_process,
+                initargs=(callbacks, dict(parm))
+            )
+        else:
+            executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.workers
+            )
+        window = self.workers * WINDOW_PER_WORKER
+        pending = deque()
+
+        def finished(future):
+            result = future.result()
+            result.parm = parm
+            return result
+
+        try:
+            for item in items:
+                if isinstance(item, tuple):
+                    yield item
+                    continue
+                if self.mode == PROCESS:
+                    # The settings were sent to the processes once
+                    item.parm = None
+                    pending.append(executor.submit(_apply_in_process, item))
+                else:
+                    pending.append(
+                        executor.submit(apply_callbacks, callbacks, item)
+                    )
+                while pending and (
+                    len(pending) >= window or pending[0].done()
+                    or not self.ordered and any(f.done() for f in pending)
+                ):
+                    for result in self._take(pending, finished):
+                        yield result
+            while pending:
+                for result in self._take(pending, finished):
+                    yield result
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+
+    def _take(self, pending, finished):
+        """
+        Take the next finished futures off pending, waiting for one if none
+        are finished yet
+        """
+        if self.ordered:
+            yield finished(pending.popleft())
+            return
+        done, _ = concurrent.futures.wait(
+            pending, return_when=concurrent.futures.FIRST_COMPLETED
+        )
+        for future in [future for future in pending if future in done]:
+            pending.remove(future)
+            yield finished(future)
+
+
+class _WorkerFunction(object):
+    """
+    The worker function of the 'worker' mode, a class so it pickles with
+    the callbacks and settings when the engine sends it to its workers
+    """
+
+    def __init__(self, worker, callbacks, parm, retry=None):
+        self.worker = worker
+        self.callbacks = callbacks
+        self.parm = parm
+        self.retry = retry
+
+    def __call__(self, task):
+        return apply_in_worker(
+            self.worker, self.callbacks, self.parm, task, retry=self.retry
+        )
+
+
+def get_pipeline(callbacks, mode=None, workers=None, ordered=True):
+    """
+    Get the CallbackPipeline for the output_callback of a run
+    :param callbacks: A CallbackPipeline, a callback or a list of them
+    :param mode:
+    :param workers:
+    :param ordered:
+    """
+    if isinstance(callbacks, CallbackPipeline):
+        return callbacks
+    return CallbackPipeline(
+        callbacks, mode=mode, workers=workers, ordered=ordered
+    )
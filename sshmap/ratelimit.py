@@ -0,0 +1,208 @@
+# Copyright (c) 2010-2015, Yahoo Inc.
+# Copyrights licensed under the Apache 2.0 License
+# See the accompanying LICENSE.txt file for terms.
+"""
+sshmap rate limiting of new connections
+
+Starting a large run opens a connection from every worker at the same time,
+which can trip the MaxStartups limit of an ssh server or bastion and the
+rate limits of the authentication servers behind it.  A ConnectRateLimiter
+spaces the new connections out with token buckets, one for the whole run
+and one for each host pattern or subnet given a limit of its own.
+
+The buckets are kept in shared memory so the worker processes of an engine
+all draw from the same ones.
+
+>>> results = sshmap.run(
+...     'localhost', 'echo ok', connect_rate=50,
+...     connect_limits={'10.1.0.0/16': 5, 'bastion*': 2}
+... )
+"""
+import fnmatch
+import multiprocessing
+import time
+try:
+    import ipaddress
+except ImportError:  # pragma: no cover
+    # python 2.x without the ipaddress backport only matches host patterns
+    ipaddress = None
+
+from .timing import clock
+
+
+class TokenBucket(object):
+    """
+    A token bucket holding up to burst tokens that refills at rate tokens a
+    second, shared by the processes forked after it is created.
+    """
+
+    def __init__(self, rate, burst=None):
+        """
+        :param rate: Tokens added per second
+        :param burst: The most tokens the bucket holds, the number that can
+                      be taken at once after it has been idle, defaults to 1
+        """
+        if rate <= 0:
+            raise ValueError('The rate must be more than 0')
+        self.rate = float(rate)
+        self.burst = float(max(burst or 1, 1))
+        self._lock = multiprocessing.Lock()
+        # The tokens in the bucket and the clock time they were counted at
+        self._state = multiprocessing.RawArray('d', [self.burst, clock()])
+
+    def reserve(self):
+        """
+        Take a token, the bucket goes into debt if it is empty
+        :return: The seconds to wait before the token can be used
+        """
+        with self._lock:
+            now = clock()
+            tokens, counted = self._state[0], self._state[1]
+            tokens = min(self.burst, tokens + (now - counted) * self.rate) - 1
+            self._state[0] = tokens
+            self._state[1] = now
+        return max(-tokens / self.rate, 0.0)
+
+    def acquire(self):
+        """
+        Wait for a token
+        :return: The seconds waited
+        """
+        wait = self.reserve()
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+def _network(pattern):
+    """
+    Get the ip network of a subnet pattern like 10.0.0.0/8
+    :param pattern:
+    :return: The network or None if the pattern is a host pattern
+    """
+    if ipaddress is None or '/' not in pattern:
+        return None
+    try:
+        return ipaddress.ip_network(u'%s' % pattern, strict=False)
+    except ValueError:
+        return None
+
+
+def _address(address):
+    """
+    Get the ip address of an address string
+    :param address:
+    :return: The address or None if it isn't an ip address
+    """
+    if ipaddress is None or not address:
+        return None
+    try:
+        # Drop the scope id of a link local ipv6 address
+        return ipaddress.ip_address(u'%s' % address.split('%')[0])
+    except ValueError:
+        return None
+
+
+class ConnectRateLimiter(object):
+    """
+    Limit how many new connections a second are opened, over the whole run
+    and to the hosts matching each of a set of host patterns or subnets.
+    """
+
+    def __init__(self, rate=None, burst=None, limits=None):
+        """
+        :param rate: The most new connections a second over the whole run,
+                     None for no overall limit
+        :param burst: The number of connections each bucket lets through at
+                      once before spacing them out, defaults to 1
+        :param limits: A dict of pattern: connections a second for the hosts
+                       that match it, where pattern is a subnet like
+                       10.1.0.0/16, matched against the address the host
+                       name resolves to, or a shell style host name pattern
+                       like web*.example.com
+        """
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.limits = []
+        for pattern, limit in sorted((limits or {}).items()):
+            self.limits.append(
+                (pattern, _network(pattern), TokenBucket(limit, burst))
+            )
+
+    def __repr__(self):
+        return 'ConnectRateLimiter(rate=%r, limits=%r)' % (
+            self.bucket.rate if self.bucket else None,
+            dict((pattern, bucket.rate) for pattern, _, bucket in self.limits)
+        )
+
+    def buckets(self, host, address=None):
+        """
+        Get the buckets a connection to a host draws from
+        :param host: The host name
+        :param address: The ip address the host name resolved to
+        """
+        buckets = []
+        ip_address = _address(address or host)
+        for pattern, network, bucket in self.limits:
+            if network is not None:
+                if ip_address is not None and \
+                        ip_address.version == network.version and \
+                        ip_address in network:
+                    buckets.append(bucket)
+            elif fnmatch.fnmatch(host, pattern):
+                buckets.append(bucket)
+        if self.bucket is not None:
+            buckets.append(self.bucket)
+        return buckets
+
+    def acquire(self, host, address=None):
+        """
+        Wait until a new connection to a host is allowed
+        :param host: The host name
+        :param address: The ip address the host name resolved to
+        :return: The seconds waited
+        """
+        waits = [bucket.reserve() for bucket in self.buckets(host, address)]
+        wait = max(waits) if waits else 0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+def parse_limits(items):
+    """
+    Parse host pattern or subnet limits given as pattern=rate strings
+    :param items: A list of pattern=rate strings, each can also be a comma
+                  separated list of them
+    :return: A dict of pattern: rate
+
+    >>> sorted(parse_limits(['10.1.0.0/16=5,web*=2.5']).items())
+    [('10.1.0.0/16', 5.0), ('web*', 2.5)]
+    """
+    limits = {}
+    for item in items or []:
+        for limit in item.split(','):
+            if not limit.strip():
+                continue
+            pattern, _, rate = limit.rpartition('=')
+            if not pattern:
+                raise ValueError(
+                    'The limit %r is not in the pattern=rate form' % limit
+                )
+            limits[pattern.strip()] = float(rate)
+    return limits
+
+
+def get_rate_limiter(rate=None, burst=None, limits=None):
+    """
+    Get a ConnectRateLimiter for the rate limit arguments of a run
+    :param rate: The connections a second over the whole run, or a
+                 ConnectRateLimiter to use as it is
+    :param burst:
+    :param limits:
+    :return: The ConnectRateLimiter or None if there are no limits
+    """
+    if isinstance(rate, ConnectRateLimiter):
+        return rate
+    if not rate and not limits:
+        return None
+    return ConnectRateLimiter(rate=rate, burst=burst, limits=limits)
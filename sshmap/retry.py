@@ -0,0 +1,101 @@
+# Copyright (c) 2010-2015, Yahoo Inc.
+# Copyrights licensed under the Apache 2.0 License
+# See the accompanying LICENSE.txt file for terms.
+"""
+sshmap retries of transient failures
+
+A RetryPolicy is passed to the engine running a command, which queues a host
+that failed with one of the retryable ssh return codes again at the back of
+the queue once its backoff has passed, so the worker moves on to the next
+host in the meantime.
+
+>>> results = sshmap.run('localhost', 'echo ok', retry=RetryPolicy(3))
+>>> results[0].attempts
+1
+"""
+import random
+
+from . import defaults
+
+
+class RetryPolicy(object):
+    """
+    How many times to try a host and how long to back off between the
+    attempts, growing exponentially with random jitter.
+    """
+
+    def __init__(self, attempts=3, backoff=1, max_backoff=60, jitter=1.0,
+                 retry_codes=None):
+        """
+        :param attempts: The most attempts for each host, including the first
+        :param backoff: The seconds to back off after the first attempt, it
+                        doubles after each attempt after that
+        :param max_backoff: The most seconds to back off
+        :param jitter: The fraction of the backoff that is random, 1 picks a
+                       random time between 0 and the backoff, 0 always uses
+                       the backoff
+        :param retry_codes: The ssh return codes to retry, defaults to
+                            defaults.RETRY_CODES
+        """
+        self.attempts = max(int(attempts), 1)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = min(max(jitter, 0.0), 1.0)
+        if retry_codes is None:
+            retry_codes = defaults.RETRY_CODES
+        self.retry_codes = frozenset(retry_codes)
+
+    def __repr__(self):
+        return 'RetryPolicy(attempts=%r, backoff=%r, max_backoff=%r, ' \
+            'jitter=%r, retry_codes=%r)' % (
+                self.attempts, self.backoff, self.max_backoff, self.jitter,
+                sorted(self.retry_codes)
+            )
+
+    def delay(self, attempt):
+        """
+        Get the seconds to back off after an attempt
+        :param attempt: The number of the attempt that failed, starting at 1
+        """
+        delay = min(self.backoff * 2 ** (attempt - 1), self.max_backoff)
+        return delay * (1 - self.jitter * random.random())
+
+    def retryable(self, results):
+        """
+        Check if the results of a host failed in a way worth retrying
+        :param results: A result or the list of results of a host
+        """
+        if not isinstance(results, list):
+            results = [results]
+        return any(
+            getattr(result, 'ssh_retcode', None) in self.retry_codes
+            for result in results
+        )
+
+    def __call__(self, results, attempt):
+        """
+        Record the attempt in the results of a host and decide if the host
+        is tried again, this is the retry function of BaseEngine.map()
+        :param results: A result or the list of results of a host
+        :param attempt: The number of the attempt that gave the results
+        :return: The seconds to wait before the next attempt or None
+        """
+        for result in results if isinstance(results, list) else [results]:
+            if hasattr(result, 'attempts'):
+                result.attempts = attempt
+        if attempt >= self.attempts or not self.retryable(results):
+            return None
+        return self.delay(attempt)
+
+
+def get_retry_policy(retry=None):
+    """
+    Get the RetryPolicy for the retry argument of a run
+    :param retry: A RetryPolicy, or the most attempts for each host
+    :return: The RetryPolicy or None if hosts aren't retried
+    """
+    if isinstance(retry, RetryPolicy) or retry is None:
+        return retry
+    if int(retry) <= 1:
+        return None
+    return RetryPolicy(attempts=retry)
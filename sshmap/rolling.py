@@ -0,0 +1,173 @@
+# Copyright (c) 2010-2015, Yahoo Inc.
+# Copyrights licensed under the Apache 2.0 License
+# See the accompanying LICENSE.txt file for terms.
+"""
+sshmap rolling runs in stages
+
+A rolling run puts a change out a batch of hosts at a time, like 1 host,
+then 1% of the hosts, then 10%, then the rest, and stops before the next
+batch when too many of the hosts of a batch failed.
+
+The stages are the batch sizes, a number of hosts or a percentage of all
+the hosts, and the last one is repeated until every host has had a turn.
+
+>>> command = run_rolling(
+...     'web[1-200]', 'sudo service web restart',
+...     stages=[1, '1%', '10%', '100%'], max_failure_ratio=0.05
+... )
+"""
+from __future__ import division
+import math
+
+from . import defaults
+from .sshmap import OutputLine, SSHCommand
+from .utility import basestring
+
+
+def parse_stages(stages):
+    """
+    Parse the batch sizes of the stages
+    :param stages: A list of stages, or a comma separated string of them,
+                   each an int number of hosts, a float fraction of the
+                   hosts up to 1 or a percentage like '10%'
+    :return: A list of ints for the numbers of hosts and floats between 0
+             and 1 for the fractions
+
+    >>> parse_stages('1,1%,10%,100%')
+    [1, 0.01, 0.1, 1.0]
+    """
+    if isinstance(stages, basestring):
+        stages = stages.split(',')
+    parsed = []
+    for stage in stages:
+        if isinstance(stage, basestring):
+            stage = stage.strip()
+            if stage.endswith('%'):
+                stage = float(stage[:-1]) / 100
+            else:
+                stage = int(stage)
+        if isinstance(stage, float) and stage > 1:
+            raise ValueError('Stage percentages can be up to 100')
+        if stage <= 0:
+            raise ValueError('Stages must be more than 0 hosts')
+        parsed.append(stage)
+    if not parsed:
+        raise ValueError('At least one stage is needed')
+    return parsed
+
+
+def stage_sizes(stages, total):
+    """
+    Generate the number of hosts in each batch, the last stage repeats until
+    the batches add up to total
+    :param stages: The stages as returned by parse_stages()
+    :param total: The number of hosts
+
+    >>> list(stage_sizes([1, 0.1], 25))
+    [1, 3, 3, 3, 3, 3, 3, 3, 3]
+    """
+    remaining = total
+    index = 0
+    while remaining > 0:
+        stage = stages[min(index, len(stages) - 1)]
+        if isinstance(stage, float):
+            # A fraction of all the hosts rounded up, the rounding keeps
+            # float error from adding a host
+            size = max(int(math.ceil(round(total * stage, 6))), 1)
+        else:
+            size = stage
+        size = min(size, remaining)
+        remaining -= size
+        index += 1
+        yield size
+
+
+def failed(result):
+    """
+    Check if a result counts as a failure for the stage gate
+    :param result:
+    """
+    return result.ssh_retcode != defaults.RUN_OK or result.retcode != 0
+
+
+class SSHCommandRolling(SSHCommand):
+    """
+    Run a command on batches of hosts one after the other, stopping when the
+    failure ratio of a batch is over max_failure_ratio.
+
+    parm['stages'] has a dict with the number of hosts, results and failures
+    of each batch that ran, and when a batch stops the run
+    parm['stopped_stage'] is its number and parm['skipped_hosts'] the hosts
+    that didn't run.
+    """
+
+    def __init__(self, host_range, command, stages=None, max_failure_ratio=0,
+                 stage_jobs=None, **kwargs):
+        """
+        :param host_range:
+        :param command:
+        :param stages: The batch sizes, a list, or comma separated string, of
+                       numbers of hosts and percentages like '10%', the last
+                       one is repeated for the rest of the hosts.  Defaults
+                       to all of the hosts at once.
+        :param max_failure_ratio: The most failed results over results of a
+                                  batch, between 0 and 1, that lets the run
+                                  go on to the next batch
+        :param stage_jobs: The number of jobs to run each batch with,
+                           defaults to jobs
+        :param kwargs: The other SSHCommand arguments
+        """
+        self.stages = parse_stages(stages or ['100%'])
+        self.max_failure_ratio = max_failure_ratio
+        self.stage_jobs = stage_jobs
+        super(SSHCommandRolling, self).__init__(host_range, command, **kwargs)
+
+    def _dispatch(self, events=False, deadline=None):
+        hosts = self.hosts.expand()
+        self.parm['total_host_count'] = self.metrics.hosts_total = len(hosts)
+        hosts = [host for host in hosts if host not in self._skip_hosts]
+        self.parm['stages'] = []
+        start = 0
+        for size in stage_sizes(self.stages, len(hosts)):
+            batch = hosts[start:start + size]
+            start += size
+            stage = dict(
+                stage=len(self.parm['stages']) + 1, hosts=len(batch),
+                results=0, failures=0
+            )
+            self.parm['stages'].append(stage)
+            jobs = min(self.stage_jobs or self._jobs, len(batch))
+            for item in self._map_hosts(
+                    batch, jobs, events=events, deadline=deadline
+            ):
+                if not isinstance(item, OutputLine):
+                    stage['results'] += 1
+                    if failed(item):
+                        stage['failures'] += 1
+                yield item
+            # exit_on_error cancelling a batch stops the run too
+            if 'not_run' in self.parm or stage['results'] and \
+                    stage['failures'] / stage['results'] > self.max_failure_ratio:
+                self.parm['stopped_stage'] = stage['stage']
+                self.parm['skipped_hosts'] = hosts[start:]
+                return
+
+
+def run_rolling(host_range, command, stages, max_failure_ratio=0,
+                stage_jobs=None, **kwargs):
+    """
+    Run a command on a hostlists host_range of hosts in batches, stopping
+    when too many of the hosts of a batch fail
+    :param host_range:
+    :param command:
+    :param stages: The batch sizes, see SSHCommandRolling
+    :param max_failure_ratio: The most failed results over results of a
+                              batch that lets the run go on
+    :param stage_jobs: The number of jobs to run each batch with
+    :param kwargs: The other SSHCommand arguments
+    :return: The SSHCommandRolling with the results
+    """
+    return SSHCommandRolling(
+        host_range, command, stages=stages,
+        max_failure_ratio=max_failure_ratio, stage_jobs=stage_jobs, **kwargs
+    ).run()
@@ -15,10 +15,15 @@ import getpass
 import socket
 import types
 import random
-import signal
-import multiprocessing
+import functools
+import select
 import logging
-from collections import Iterable
+import threading
+from collections import OrderedDict, namedtuple
+try:
+    from collections.abc import Iterable
+except ImportError:  # pragma: no cover
+    from collections import Iterable
 
 # Imports from external python extension modules
 import paramiko
@@ -39,55 +44,89 @@ except ImportError:
     import defaults
     import runner
 
+from .connection import ConnectionPool, agent_auth, fastSSHClient
+from .engine import TaskCancelled, cancel_event, engine_class, event_sink, \
+    get_engine
+from .hosts import HostList
+from .journal import get_journal
+from .mapreduce import get_mapreduce
+from .metrics import RunMetrics
+from .output import OutputBuffer, as_output, decode
+from .pipeline import get_pipeline
+from .ratelimit import get_rate_limiter
+from .retry import get_retry_policy
+from .store import ResultStore, StoredLines
+from .timing import PhaseTimings, TimingSummary, clock, get_timeouts
 from .utility import status_clear, status_info
 
 
-# Fix to make ctrl-c correctly terminate child processes
-# spawned by the multiprocessing module
-from multiprocessing.pool import IMapIterator
-
-
 LOG = logging.getLogger(__name__)
 
+# The most data read from a channel at a time
+READ_SIZE = 32768
 
-def wrapper(func):
-    """
-    Simple timeout wrapper for multiprocessing
-    :param func:
-    """
-    def wrap(self, timeout=None):
-        """
-        The wrapper method
-        :param timeout:
-        """
-        return func(self, timeout=timeout if timeout is not None else 1e100)
-
-    return wrap
-
+# How often a channel being read checks if the run was cancelled
+CANCEL_POLL_INTERVAL = 0.1
 
-IMapIterator.next = wrapper(IMapIterator.next)
+# A line of output from a host, stream is 'stdout' or 'stderr'
+OutputLine = namedtuple('OutputLine', ['host', 'stream', 'line'])
 
 
 class SSHResult(object):
     """
     ssh_result class, that holds the output from the ssh_call.  This is passed
     to all the callback functions.
+
+    The output is kept as the raw bytes received and only decoded when it is
+    used, results have no __dict__ to keep them small on large runs.
+
+    timings is a PhaseTimings with the time each phase of running the
+    command started, or None, received is the number of bytes of output
+    received from the host and attempts the number of times the host was
+    tried.  records holds the records of the reducers of a run, name:
+    record, when they were mapped in the worker.  expired is True for the
+    results made up for the hosts that hadn't finished by the deadline of
+    the run, which may never have started.
     """
+    __slots__ = (
+        '_out', '_err', 'retcode', 'ssh_retcode', 'parm', 'host', 'command', 'timings', 'received', 'attempts',
+        'records', 'expired'
+    )
     bootstrap = True
     bootstrap_show_retcodes = False
 
     def __init__(self, out=None, err=None, host=None, retcode=0, ssh_ret=0,
-                 parm=None):
-        if not err:
-            err = []
-        if not out:
-            out = []
+                 parm=None, command=None, timings=None):
         self.out = out
         self.err = err
         self.retcode = retcode
         self.ssh_retcode = ssh_ret
         self.parm = parm
         self.host = host
+        self.command = command
+        self.timings = timings
+        self.received = 0
+        self.attempts = 1
+        self.records = None
+        self.expired = False
+
+    @property
+    def out(self):
+        """ The stdout lines, kept in an OutputBuffer """
+        return self._out
+
+    @out.setter
+    def out(self, value):
+        self._out = as_output(value)
+
+    @property
+    def err(self):
+        """ The stderr lines, kept in an OutputBuffer """
+        return self._err
+
+    @err.setter
+    def err(self, value):
+        self._err = as_output(value)
 
     @property
     def stdout(self):
@@ -99,15 +138,10 @@ class SSHResult(object):
 
     @property
     def output(self):
-        result = self.stdout + self.stderr
-        if isinstance(result, bytes):
-            return result.decode(errors='ignore')
-        return result
+        return self.out_string() + self.err_string()
 
     def __str__(self):
-        output = self.stdout if self.stdout else ''
-        output += self.stderr if self.stderr else ''
-        return output.decode(errors='ignore')
+        return self.output
 
     def __repr__(self):
         return 'sshmap.ssh_result({0}, {1}, {2}, {3})'.format(
@@ -147,15 +181,16 @@ class SSHResult(object):
         return self._repr_html__plain_()
 
     def sequence_to_bytes(self, sequence):
-        output = b''
-        for line in sequence:
-            if isinstance(line, bytes):
-                output += line
-            else:
-                output += line.encode()
-        return output
+        if isinstance(sequence, (OutputBuffer, StoredLines)):
+            return sequence.tobytes()
+        return b''.join(
+            line if isinstance(line, bytes) else line.encode()
+            for line in sequence
+        )
 
     def sequence_to_str(self, sequence):
+        if isinstance(sequence, OutputBuffer):
+            return sequence.text()
         return self.sequence_to_bytes(sequence).decode(errors='ignore')
 
     def out_string(self):
@@ -213,10 +248,57 @@ class ssh_results(list):
     _ansi_repr = False
     ansi = False
     collapse = False
+    retain = defaults.RETAIN_ALL
+    store = None
+    # A TimingSummary of the phases of all the commands of the run
+    timings = None
+    # The RunMetrics updated as the run goes on
+    metrics = None
+    # The index of the oldest result kept by a numeric retain, the kept
+    # results are a ring buffer until order_retained() is called
+    _oldest = 0
 
     def run(self):
         pass
 
+    def clear(self):
+        del self[:]
+        self._oldest = 0
+
+    def add(self, result):
+        """
+        Keep a completed result according to the retain policy, one of:
+        'all' keeps every result, 'none' keeps nothing, 'failures' keeps the
+        results with a non 0 return code, a number N keeps the last N results
+        and 'disk' keeps the results with their output moved into the store,
+        a temporary ResultStore if one isn't set.
+        :param result:
+        """
+        if self.retain == defaults.RETAIN_NONE:
+            return
+        if self.retain == defaults.RETAIN_FAILURES and \
+                not (result.retcode or result.ssh_retcode):
+            return
+        if self.retain == defaults.RETAIN_DISK:
+            if self.store is None:
+                self.store = ResultStore()
+            result = self.store.add(result)
+        if self.retain in defaults.RETAIN_POLICIES or len(self) < self.retain:
+            self.append(result)
+            return
+        # Overwrite the oldest result instead of moving all the kept ones
+        self[self._oldest] = result
+        self._oldest = (self._oldest + 1) % self.retain
+
+    def order_retained(self):
+        """
+        Put the results kept by a numeric retain back in the order they were
+        added, once the results are all in
+        """
+        if self._oldest:
+            self[:] = self[self._oldest:] + self[:self._oldest]
+            self._oldest = 0
+
     def __repr__(self):
         if self._ansi_repr:
             return self._repr_text_()
@@ -231,79 +313,92 @@ class ssh_results(list):
     def __str__(self):
         if not self._executed:
             self.run()
-        output = ''
+        output = []
         for item in self.__iter__():
-            output += item.host + os.linesep
-            output += item.output + os.linesep
-        return output
+            output += [item.host, os.linesep, item.output, os.linesep]
+        return ''.join(output)
+
+    def _text_parts(self):
+        """
+        Generate the pieces of the text representation of the results
+        """
+        aggregator = self.setting('aggregate')
+        bold, normal = ('\033[1m', '\033[0m') if self.ansi else ('', '')
+        if self.collapse and aggregator:
+            for group in aggregator:
+                yield bold + ','.join(hostlists.compress(group.hosts)) + normal
+                yield os.linesep
+                out, err = group.view()
+                for line in out:
+                    yield line
+                for line in err:
+                    yield line
+                yield group.diff_text()
+                yield os.linesep
+        else:
+            for item in self.__iter__():
+                yield bold + item.host + normal + os.linesep
+                yield item.output
+                yield os.linesep
 
     def _repr_text_(self):
         if not self._executed:
             self.run()
-        output = ''
-        aggregate_hosts = self.setting('aggregate_hosts')
-        collapsed_output = self.setting('collapsed_output')
-        if self.collapse and aggregate_hosts and collapsed_output:
-            for md5, hosts in aggregate_hosts.items():
-                if self.ansi:
-                    output += '\033[1m'
-                output += ','.join(hostlists.compress(hosts))
-                if self.ansi:
-                    output += '\033[0m'
-                output += os.linesep
-                out, err = collapsed_output[md5]
-                output += ''.join(out)
-                output += ''.join(err)
-                output += os.linesep
-        else:
-            for item in self.__iter__():
-                if self.ansi:
-                    output += '\033[1m'
-                output += item.host
-                if self.ansi:
-                    output += '\033[0m'
-                output += os.linesep
-                output += item.output + os.linesep
+        output = ''.join(self._text_parts())
         if output.endswith(os.linesep):
             return output[:-1]
         return output
 
+    def write(self, handle=None):
+        """
+        Write the text representation of the results to a file handle a
+        piece at a time, without building it in memory first
+        :param handle: Defaults to sys.stdout
+        """
+        if not self._executed:
+            self.run()
+        if handle is None:
+            handle = sys.stdout
+        for part in self._text_parts():
+            handle.write(part)
+
     def _repr_html__plain_(self):
         """
         __repr__ in an html table format
         """
         if not self._executed:
             self.run()
-        output = '<table width="100%">'
+        output = ['<table width="100%">']
         for item in self.__iter__():
-            output += '<tr><th>{0}</th></tr>'.format(item.host)
-            output += '<tr><td><pre>{0}</pre></td></tr>'.format(item.output)
-        output += '</table>'
-        return output
+            output.append('<tr><th>{0}</th></tr>'.format(item.host))
+            output.append(
+                '<tr><td><pre>{0}</pre></td></tr>'.format(item.output)
+            )
+        output.append('</table>')
+        return ''.join(output)
 
     def _repr_html__bootstrap_(self):
         if not self._executed:
             self.run()
-        aggregate_hosts = self.setting('aggregate_hosts')
-        collapsed_output = self.setting('collapsed_output')
-        output = '<row>'
-        if self.collapse and aggregate_hosts and collapsed_output:
-            for md5, hosts in aggregate_hosts.items():
+        aggregator = self.setting('aggregate')
+        output = ['<row>']
+        if self.collapse and aggregator:
+            for group in aggregator:
                 panel_start = '<div class="panel panel-success">'
-                panel_header = '<div class="panel-heading"><strong>{host}</strong></div>'.format(host=','.join(hostlists.compress(hosts)))
-                out, err = collapsed_output[md5]
+                panel_header = '<div class="panel-heading"><strong>{host}</strong></div>'.format(host=','.join(hostlists.compress(group.hosts)))
+                out, err = group.view()
                 out = ''.join(out)
-                err = ''.join(err)
+                err = ''.join(err) + group.diff_text()
 
                 panel_body = '<div class="panel-body"><pre style="max-width:100%;">{0}{1}</pre></div>'.format(out, err)
                 panel_footer = ''
                 panel_end = '</div>'
-                output += panel_start + panel_header + panel_body + panel_footer + panel_end
+                output.append(panel_start + panel_header + panel_body + panel_footer + panel_end)
         else:
             for item in self.__iter__():
-                output += item._repr_html__bootstrap_()
-        output += '</row>'
-        return output
+                output.append(item._repr_html__bootstrap_())
+        output.append('</row>')
+        return ''.join(output)
 
     def _repr_html_(self):
         if self.bootstrap:
@@ -314,10 +409,7 @@ class ssh_results(list):
     def output(self):
         if not self._executed:
             self.run()
-        out = ''
-        for item in self.__iter__():
-            out += item.output
-        return out
+        return ''.join(item.output for item in self.__iter__())
 
     def dump(self):
         """ Dump all the result objects """
@@ -351,55 +443,17 @@ class ssh_results(list):
             return
         return self.parm.get(key, None)
 
-
-def agent_auth(transport, username):
-    """
-    Attempt to authenticate to the given transport using any of the private
-    keys available from an SSH agent or from a local private RSA key file
-    (assumes no pass phrase).
-    :param transport:
-    :param username:
-    """
-
-    agent = paramiko.Agent()
-    agent_keys = agent.get_keys()
-    if len(agent_keys) == 0:
-        return
-
-    for key in agent_keys:
-        logging.info(
-            'Trying ssh-agent key %s' % key.get_fingerprint().encode('hex'))
-        try:
-            transport.auth_publickey(username, key)
-            logging.debug('agent_auth success!')
-            return
-        except paramiko.SSHException as e:
-            logging.debug('agent_auth failed! %s', e)
-
-
-# A version of the paramiko.SSHClient that supports timeout
-class fastSSHClient(paramiko.SSHClient):
-    """ ssh SSHClient class extended with timeout support """
-
-    def exec_command(self, command, bufsize=-1, timeout=None, pty=False):
+    def by_host(self):
         """
-        Execute a command
-        :param command:
-        :param bufsize:
-        :param timeout:
-        :param pty:
-        :return:
+        Group the result objects by host
+        :return: An OrderedDict of host: list of result objects
         """
-        chan = self._transport.open_session()
-        paramiko.agent.AgentRequestHandler(chan)
-        chan.settimeout(timeout)
-        if pty:
-            chan.get_pty()
-        chan.exec_command(command)
-        stdin = chan.makefile('wb', bufsize)
-        stdout = chan.makefile('rb', bufsize)
-        stderr = chan.makefile_stderr('rb', bufsize)
-        return stdin, stdout, stderr, chan
+        if not self._executed:
+            self.run()
+        hosts = OrderedDict()
+        for item in self.__iter__():
+            hosts.setdefault(item.host, []).append(item)
+        return hosts
 
 
 def _term_readline(handle):
@@ -416,9 +470,137 @@ def _term_readline(handle):
     return buf
 
 
+def _sudo_prompt_filter(password):
+    """
+    Get a function that returns False for the password prompts and sudo
+    lecture lines at the start of the stderr of a sudo command and True for
+    every line after them.
+    :param password:
+    """
+    state = {'check_prompt': True}
+
+    def keep(line):
+        if state['check_prompt']:
+            if password in line or 'assword:' in line or \
+                    '[sudo] password' in line or line.strip() == '' or \
+                    line.strip() in defaults.sudo_message or \
+                    line.strip().startswith('sudo:'):
+                return False
+            state['check_prompt'] = False
+        return True
+
+    return keep
+
+
+def read_channel(chan, host=None, timeout=None, line_callback=None,
+                 keep_output=True, stderr_filter=None, timings=None,
+                 byte_counter=None, deadline=None, cancel_event=None):
+    """
+    Read the stdout and stderr of a channel line by line as it arrives until
+    the remote end closes it.  Both streams are read together so a command
+    filling up one of them can't block waiting on us to read the other.
+    :param chan:
+    :param host: The host passed in the OutputLine of each line
+    :param timeout: Raise socket.timeout if nothing arrives for this long
+    :param line_callback: Called with an OutputLine for each line
+    :param keep_output: Return the output, if False the lines are only passed
+                        to line_callback and memory use doesn't grow with
+                        the output.
+    :param stderr_filter: A function returning False for stderr lines to drop
+    :param timings: A PhaseTimings to start the transfer phase in when the
+                    first output arrives
+    :param byte_counter: Called with the number of bytes each time data
+                         arrives
+    :param deadline: Raise socket.timeout if the channel is still open at
+                     this clock() time
+    :param cancel_event: An Event, when it is set TaskCancelled is raised
+                         with the stdout and stderr read so far
+    :return: A tuple of OutputBuffers of the raw stdout and stderr
+    """
+    chunks = {'stdout': [], 'stderr': []}
+    partial = {'stdout': b'', 'stderr': b''}
+    # The data is only split into lines, and decoded, when something looks
+    # at the lines as they arrive
+    split_lines = line_callback or stderr_filter
+
+    def add_line(stream, line):
+        text = None
+        if stream == 'stderr' and stderr_filter:
+            text = decode(line)
+            if not stderr_filter(text):
+                return
+        if keep_output:
+            chunks[stream].append(line)
+        if line_callback:
+            line_callback(OutputLine(
+                host, stream, decode(line) if text is None else text
+            ))
+
+    def add_data(stream, data):
+        if byte_counter:
+            byte_counter(len(data))
+        if not split_lines:
+            if keep_output:
+                chunks[stream].append(data)
+            return
+        pieces = (partial[stream] + data).split(b'\n')
+        partial[stream] = pieces.pop()
+        for piece in pieces:
+            add_line(stream, piece + b'\n')
+
+    def buffers():
+        for stream in ['stdout', 'stderr']:
+            if partial[stream]:
+                add_line(stream, partial[stream])
+                partial[stream] = b''
+        return (
+            OutputBuffer(b''.join(chunks['stdout'])),
+            OutputBuffer(b''.join(chunks['stderr']))
+        )
+
+    idle_until = clock() + timeout if timeout else None
+    while True:
+        now = clock()
+        ends = [end for end in [deadline, idle_until] if end is not None]
+        wait = None
+        if ends:
+            wait = min(ends) - now
+            if wait <= 0:
+                raise socket.timeout()
+        if cancel_event is not None:
+            if cancel_event.is_set():
+                raise TaskCancelled(*buffers())
+            if wait is None or wait > CANCEL_POLL_INTERVAL:
+                wait = CANCEL_POLL_INTERVAL
+        # The channel fileno is readable when either stream has data or the
+        # channel got an EOF
+        if not select.select([chan], [], [], wait)[0]:
+            continue
+        if timeout:
+            idle_until = clock() + timeout
+        # Check for the EOF before reading, the data can arrive along with
+        # it after the streams were found empty
+        eof = chan.eof_received or chan.closed
+        received = False
+        if chan.recv_stderr_ready():
+            add_data('stderr', chan.recv_stderr(READ_SIZE))
+            received = True
+        if chan.recv_ready():
+            add_data('stdout', chan.recv(READ_SIZE))
+            received = True
+        if not received and eof:
+            break
+        if received and timings is not None:
+            timings.start('transfer')
+            timings = None
+    return buffers()
+
+
 def run_command(host, command="uname -a", username=None, password=None,
                 sudo=False, script=None, timeout=None, parms=None, client=None,
-                bufsize=-1, log_to_file=False):
+                bufsize=-1, log_to_file=False, port=22, connection_pool=None,
+                line_callback=None, keep_output=True, timeouts=None,
+                rate_limiter=None):
     """
     Run a command or script on a remote node via ssh
     :param host:
@@ -432,78 +614,291 @@ def run_command(host, command="uname -a", username=None, password=None,
     :param client:
     :param bufsize:
     :param log_to_file:
+    :param port:
+    :param connection_pool: A ConnectionPool to get the connection from and
+                            return it to afterwards, instead of connecting
+                            and disconnecting.
+    :param line_callback: Called with an OutputLine for each line of output
+                          as it arrives, defaults to sending them to the
+                          engine running the command when it collects them.
+    :param keep_output: Keep the output in the result
+    :param timeouts: A Timeouts with the connect, auth, command and idle
+                     timeouts, the ones it doesn't set default to timeout
+    :param rate_limiter: A ConnectRateLimiter to wait on before connecting
     """
     # Guess any parameters not passed that can be
     if isinstance(host, tuple):
+        # The tuple grew port, connection_pool and keep_output, a shorter
+        # one from an older caller keeps the defaults for them
+        host += (port, connection_pool, keep_output)[len(host) - 9:]
         host, command, username, password, sudo, script, timeout, parms, \
-            client = host
-    if timeout == 0:
-        timeout = None
+            client, port, connection_pool, keep_output = host
+    if not line_callback:
+        line_callback = event_sink()
+    cancel = cancel_event()
+    timeouts = get_timeouts(timeout, timeouts)
     if not username:
         username = getpass.getuser()
-    if bufsize == -1 and script and os.path.exists(script):
-        bufsize = os.path.getsize(script) + 1024
-
-    script_parameters = None
-    if script:
-        temp = command.split()
-        if len(temp) > 1:
-            command = temp[0]
-            script_parameters = temp
 
     # Get a result object to put our output in
-    result = ssh_result(host=host, parm=parms)
+    result = ssh_result(
+        host=host, parm=parms, command=command, timings=PhaseTimings()
+    )
 
     if log_to_file:
         paramiko.util.log_to_file('ssh.log')
 
-    close_client = False
+    client, close_client = connect_client(
+        result, host, username=username, password=password, port=port,
+        timeouts=timeouts, client=client, connection_pool=connection_pool,
+        rate_limiter=rate_limiter
+    )
     if not client:
+        return result
+
+    result = exec_on_client(
+        client, result, command, password=password, sudo=sudo, script=script,
+        timeouts=timeouts, bufsize=bufsize, line_callback=line_callback,
+        keep_output=keep_output, cancel_event=cancel
+    )
+    result.timings.stop()
+    release_client(
+        client, failed=result.ssh_retcode, close_client=close_client,
+        connection_pool=connection_pool
+    )
+    return result
+
+
+def run_commands(host, commands=None, username=None, password=None,
+                 sudo=False, timeout=None, parms=None, client=None, port=22,
+                 connection_pool=None, parallel=False, line_callback=None,
+                 keep_output=True, timeouts=None, rate_limiter=None):
+    """
+    Run a list of commands on a remote node over a single ssh connection
+    :param host:
+    :param commands: A list of commands to run
+    :param username:
+    :param password:
+    :param sudo:
+    :param timeout:
+    :param parms:
+    :param client:
+    :param port:
+    :param connection_pool:
+    :param parallel: Run the commands at the same time on separate channels
+                     instead of one after the other.
+    :param line_callback:
+    :param keep_output:
+    :param timeouts: A Timeouts, the command timeout applies to each command
+    :param rate_limiter: A ConnectRateLimiter to wait on before connecting
+    :return: A list with the result of each command in the order of commands
+    """
+    if isinstance(host, tuple):
+        host, commands, username, password, sudo, timeout, parms, client, \
+            port, connection_pool, parallel, keep_output = host
+    if not line_callback:
+        # Look the sink up here, the command threads don't inherit it
+        line_callback = event_sink()
+    cancel = cancel_event()
+    timeouts = get_timeouts(timeout, timeouts)
+    if not username:
+        username = getpass.getuser()
+
+    results = [
+        ssh_result(
+            host=host, parm=parms, command=command, timings=PhaseTimings()
+        )
+        for command in commands
+    ]
+    if not results:
+        return results
+
+    client, close_client = connect_client(
+        results[0], host, username=username, password=password, port=port,
+        timeouts=timeouts, client=client, connection_pool=connection_pool,
+        rate_limiter=rate_limiter
+    )
+    if not client:
+        for result in results[1:]:
+            result.err = list(results[0].err)
+            result.ssh_retcode = results[0].ssh_retcode
+        return results
+
+    def execute(result):
+        exec_on_client(
+            client, result, result.command, password=password, sudo=sudo,
+            timeouts=timeouts, line_callback=line_callback,
+            keep_output=keep_output, cancel_event=cancel
+        )
+        result.timings.stop()
+
+    if parallel:
+        threads = [
+            threading.Thread(target=execute, args=(result,))
+            for result in results
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    else:
+        for result in results:
+            execute(result)
+
+    release_client(
+        client, failed=any(result.ssh_retcode for result in results),
+        close_client=close_client, connection_pool=connection_pool
+    )
+    return results
+
+
+def connect_client(result, host, username=None, password=None, port=22,
+                   timeout=None, client=None, connection_pool=None,
+                   timeouts=None, rate_limiter=None):
+    """
+    Get a connected client for host, from the connection_pool if one is
+    passed.  If the connection fails the error is put into result.
+    :param result:
+    :param host:
+    :param username:
+    :param password:
+    :param port:
+    :param timeout:
+    :param client: An unconnected client to use instead of creating one
+    :param connection_pool:
+    :param timeouts: A Timeouts, the connect timeout covers the tcp connect
+                     and the key exchange
+    :param rate_limiter: A ConnectRateLimiter to wait on before a new
+                         connection
+    :return: A tuple of the client, or None if the connection failed, and
+             whether the caller should close it when done.
+    """
+    timeouts = get_timeouts(timeout, timeouts)
+    close_client = False
+    if connection_pool is not None:
+        client = None
+    elif not client:
         # noinspection PyBroadException
         try:
             client = fastSSHClient()
         except:
             result.err = ['Error creating client']
             result.ssh_retcode = defaults.RUN_FAIL_UNKNOWN
-            return result
+            return None, False
         client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
         # load_system_host_keys slows things way down
         #client.load_system_host_keys()
         close_client = True
         # noinspection PyBroadException
     try:
-        client.connect(host, username=username, password=password,
-                       timeout=timeout)
+        if connection_pool is not None:
+            client = connection_pool.get(
+                host, username=username, port=port, password=password,
+                timeout=timeouts.connect, timings=result.timings,
+                auth_timeout=timeouts.auth, rate_limiter=rate_limiter
+            )
+        else:
+            client.connect(host, port=port, username=username,
+                           password=password, timeout=timeouts.connect,
+                           banner_timeout=timeouts.connect,
+                           auth_timeout=timeouts.auth,
+                           timings=result.timings,
+                           rate_limiter=rate_limiter)
+        return client, close_client
     except paramiko.AuthenticationException:
         result.ssh_retcode = defaults.RUN_FAIL_AUTH
-        return result
     except paramiko.SSHException:
         result.ssh_retcode = defaults.RUN_FAIL_CONNECT
-        return result
     except AttributeError:
         result.ssh_retcode = defaults.RUN_FAIL_SSH
-        return result
     except socket.error:
         result.ssh_retcode = defaults.RUN_FAIL_CONNECT
-        return result
     except Exception as message:
         logging.debug('Got unknown exception %s', message)
         result.ssh_retcode = defaults.RUN_FAIL_UNKNOWN
+    if result.timings is not None:
+        result.timings.stop()
+    if close_client:
+        client.close()
+    return None, False
+
+
+def release_client(client, failed=False, close_client=False,
+                   connection_pool=None):
+    """
+    Hand a client from connect_client() back once the commands are done
+    :param client:
+    :param failed: The connection had an ssh error and shouldn't be reused
+    :param close_client:
+    :param connection_pool:
+    """
+    if connection_pool is not None:
+        if failed:
+            connection_pool.discard(client)
+        else:
+            connection_pool.release(client)
+    elif close_client:
+        client.close()
+
+
+def exec_on_client(client, result, command, password=None, sudo=False,
+                   script=None, timeout=None, bufsize=-1, line_callback=None,
+                   keep_output=True, timeouts=None, cancel_event=None):
+    """
+    Run a command or script over an already connected client and put the
+    output into result
+    :param client:
+    :param result:
+    :param command:
+    :param password:
+    :param sudo:
+    :param script:
+    :param timeout:
+    :param bufsize:
+    :param line_callback: Called with an OutputLine for each line of output
+    :param keep_output: Keep the output in the result
+    :param timeouts: A Timeouts, the command timeout limits the time from
+                     opening the channel until the command exits and the
+                     idle timeout the time waiting for the next output
+    :param cancel_event: An Event, when it is set the channel is closed and
+                         the result keeps the output read so far with a
+                         RUN_CANCELLED ssh return code
+    """
+    if cancel_event is not None and cancel_event.is_set():
+        # Cancelled while connecting, the command isn't started
+        result.err = ['Cancelled\n']
+        result.ssh_retcode = defaults.RUN_CANCELLED
         return result
+    timeouts = get_timeouts(timeout, timeouts)
+    deadline = None
+    if timeouts.command:
+        deadline = clock() + timeouts.command
+    if bufsize == -1 and script and os.path.exists(script):
+        bufsize = os.path.getsize(script) + 1024
+
+    script_parameters = None
+    if script:
+        temp = command.split()
+        if len(temp) > 1:
+            command = temp[0]
+            script_parameters = temp
+
     try:
     # We have to force a sudo -k first or we can't reliably know we'll be
     # prompted for our password
         if sudo:
             stdin, stdout, stderr, chan = client.exec_command(
                 'sudo -k -S %s' % command,
-                timeout=timeout, bufsize=bufsize, pty=False
+                timeout=timeouts.idle, bufsize=bufsize, pty=False,
+                timings=result.timings
             )
             if not chan:
                 result.ssh_retcode = defaults.RUN_FAIL_CONNECT
                 return result
         else:
             stdin, stdout, stderr, chan = client.exec_command(
-                command, timeout=timeout, bufsize=bufsize)
+                command, timeout=timeouts.idle, bufsize=bufsize,
+                timings=result.timings)
             if not chan:
                 result.ssh_retcode = defaults.RUN_FAIL_CONNECT
                 result.err = ["WTF, this shouldn't happen\n"]
@@ -549,49 +944,35 @@ def run_command(host, command="uname -a", username=None, password=None,
                 stdin.write(script)
         stdin.flush()
         stdin.channel.shutdown_write()
-    try:
-        # Read the output from stdout, stderr and close the connection
-        result.out = stdout.readlines()
-        result.err = stderr.readlines()
-        if result.out and len(result.out) and isinstance(result.out[0], bytes):
-            result.out = [r.decode('utf-8') for r in result.out]
-        if result.err and len(result.err) and isinstance(result.err[0], bytes):
-            result.err = [r.decode('utf-8') for r in result.err]
-        if sudo:
-            # Remove any passwords or prompts from the start of the stderr
-            # output
-            err = []
-            check_prompt = True
-            skip = False
-            for el in result.err:
-                if check_prompt:
-                    if password in el or 'assword:' in el or \
-                            '[sudo] password' in el or el.strip() == '' or \
-                            el.strip() in defaults.sudo_message or \
-                            el.strip().startswith('sudo:'):
-                        skip = True
-                    else:
-                        check_prompt = False
-                if not skip:
-                    err.append(el)
-                skip = False
-            result.err = err
+    def count_received(size):
+        result.received += size
 
+    try:
+        # Read the output from stdout, stderr and close the connection, with
+        # sudo remove any passwords or prompts from the start of stderr
+        result.out, result.err = read_channel(
+            chan, host=result.host, timeout=timeouts.idle,
+            deadline=deadline,
+            line_callback=line_callback, keep_output=keep_output,
+            stderr_filter=_sudo_prompt_filter(password) if sudo else None,
+            timings=result.timings, byte_counter=count_received,
+            cancel_event=cancel_event
+        )
         result.retcode = chan.recv_exit_status()
-        if close_client:
-            client.close()
     except socket.timeout:
         result.ssh_retcode = defaults.RUN_FAIL_TIMEOUT
         return result
+    except TaskCancelled as error:
+        # Closing the channel ends the session of the command on the host
+        chan.close()
+        result.out, result.err = error.args
+        result.err.append('Cancelled\n')
+        result.ssh_retcode = defaults.RUN_CANCELLED
+        return result
     result.ssh_retcode = defaults.RUN_OK
     return result
 
 
-def init_worker():
-    """ Set up the signal handler for new worker threads """
-    signal.signal(signal.SIGINT, signal.SIG_IGN)
-
-
 def run_with_runner(*args, **kwargs):
     """
     Run a command with a python runner script
@@ -613,9 +994,124 @@ def run_with_runner(*args, **kwargs):
     return run(*args, **kwargs)
 
 
-def run(host_range, command, username=None, password=None, sudo=False,
+def expired_result(host, command=None, commands=None):
+    """
+    Get the result of a host that didn't finish before the deadline of the
+    run
+    :param host:
+    :param command:
+    :param commands: The commands of a batch
+    :return: A result, or a list of a result for each of commands
+    """
+    if commands is not None:
+        return [expired_result(host, command=item) for item in commands]
+    result = ssh_result(
+        err=['Run deadline reached\n'], host=host,
+        ssh_ret=defaults.RUN_FAIL_TIMEOUT, command=command
+    )
+    result.expired = True
+    return result
+
+
+def cancelled_result(host, command=None, commands=None):
+    """
+    Get the result of a host that was still running when the run was
+    cancelled and didn't stop by itself in time
+    :param host:
+    :param command:
+    :param commands: The commands of a batch
+    :return: A result, or a list of a result for each of commands
+    """
+    if commands is not None:
+        return [cancelled_result(host, command=item) for item in commands]
+    return ssh_result(
+        err=['Cancelled\n'], host=host, ssh_ret=defaults.RUN_CANCELLED,
+        command=command
+    )
+
+
+def check_retain(retain):
+    """
+    Check a result retain policy is valid
+    :param retain:
+    :raises ValueError:
+    """
+    if retain in defaults.RETAIN_POLICIES:
+        return
+    if isinstance(retain, int) and not isinstance(retain, bool) and retain > 0:
+        return
+    raise ValueError(
+        'Invalid retain policy %r, use one of %s or a number of results' % (
+            retain, ', '.join(defaults.RETAIN_POLICIES)
+        )
+    )
+
+
+def _callback_results(results, items, output_callback, exit_on_error=False,
+                      line_callback=None, cancel=None):
+    """
+    Run the output_callback pipeline on the items coming back from an engine
+    and yield the results.  Items holding a list of results, from
+    run_commands(), are flattened.  OutputLine items go through the
+    line_callback pipeline instead and are yielded unless a line callback
+    returned None for them.
+    :param results: The ssh_results object holding the shared parm
+    :param items:
+    :param output_callback: A callback, a list of them or a CallbackPipeline
+    :param exit_on_error:
+    :param line_callback:
+    :param cancel: Called when exit_on_error trips, the items of the hosts
+                   that were running still come back and are yielded, if
+                   it's None the items stop there.
+    """
+    if line_callback and not isinstance(line_callback, Iterable):
+        line_callback = [line_callback]
+    pipeline = get_pipeline(output_callback)
+
+    def completed():
+        for item in pipeline.pending(items, results.parm):
+            if isinstance(item, OutputLine):
+                for cb in line_callback or []:
+                    item = cb(item)
+                    if item is None:
+                        break
+                else:
+                    yield item
+                continue
+            results.parm['completed_host_count'] += 1
+            if not isinstance(item, list):
+                item = [item]
+            if results.metrics is not None:
+                results.metrics.complete(item)
+            for result in item:
+                result.parm = results.parm
+                if results.timings is not None:
+                    results.timings.add(result.timings)
+                yield result
+
+    for result in pipeline.run(completed(), results.parm):
+        if isinstance(result, OutputLine):
+            yield result
+            continue
+        results.parm = result.parm
+        yield result
+        if exit_on_error and result.retcode != 0:
+            if cancel is None:
+                return
+            cancel()
+            cancel, exit_on_error = None, False
+
+
+def run(host_range, command=None, username=None, password=None, sudo=False,
         script=None, timeout=None, sort=False, jobs=0, output_callback=None,
-        parms=None, shuffle=False, chunksize=None, exit_on_error=False):
+        parms=None, shuffle=False, chunksize=None, exit_on_error=False,
+        engine=None, port=22, connections=None, connection_pool=None,
+        commands=None, parallel=False, line_callback=None, keep_output=True,
+        retain=defaults.RETAIN_ALL, store=None, metrics=None, timeouts=None,
+        deadline=None, connect_rate=None, connect_burst=None,
+        connect_limits=None, retry=None, journal=None, resume=False,
+        rerun_failed=False, callback_mode=None, callback_workers=None,
+        callback_ordered=True, reducers=None):
     """
     Run a command on a hostlists host_range of hosts
     :param host_range:
@@ -626,13 +1122,83 @@ def run(host_range, command, username=None, password=None, sudo=False,
     :param script:
     :param timeout:
     :param sort:
-    :param jobs:
+    :param jobs: The number of worker processes, the hybrid engine defaults
+                 to the cpu count and the async engine to
+                 defaults.ASYNC_CONNECTIONS threads.
     :param output_callback:
     :param parms:
     :param shuffle:
     :param chunksize:
     :param exit_on_error: Exit as soon as one result comes back with a non 0
-                          return code.
+                          return code.  No more hosts are started, the
+                          running ones are stopped with a RUN_CANCELLED
+                          result and the hosts that never ran are kept in
+                          parm['not_run'].
+    :param engine: The name of the engine to run the commands with, one of
+                   sshmap.engine.ENGINES, or an engine instance.  Defaults
+                   to the multiprocessing based 'process' engine.
+    :param port: The ssh port to connect to
+    :param connections: The total number of ssh sessions to run at once with
+                        the async and hybrid engines.
+    :param connection_pool: A ConnectionPool to reuse connections from, this
+                            requires an engine that runs in the current
+                            process like the async engine.
+    :param commands: A list of commands to run over a single connection to
+                     each host instead of command, the results of each host
+                     are kept together.
+    :param parallel: Run the commands at the same time on separate channels
+                     instead of one after the other.
+    :param line_callback: A function, or list of functions, called in the
+                          current process with an OutputLine for each line
+                          of output as soon as it arrives.  A function
+                          returning None stops the line going further.
+    :param keep_output: Keep the output in the results, set to False with a
+                        line_callback to stream output of any size.
+    :param retain: Which results to keep after the output_callback pipeline
+                   has run on them, 'all', 'none', 'failures', a number of
+                   the most recent results or 'disk' to move the output of
+                   the results into a temporary ResultStore.
+    :param store: The ResultStore, or the path of one to open, that 'disk'
+                  retain moves the output into.
+    :param metrics: A RunMetrics to update as the run goes on, so it can be
+                    exported while the run goes on, a new one is kept in
+                    results.metrics if it isn't passed.
+    :param timeouts: A Timeouts with separate connect, auth, command and idle
+                     timeouts, the ones it doesn't set default to timeout.
+    :param deadline: The most seconds the whole run can take, the hosts that
+                     haven't finished by then get a RUN_FAIL_TIMEOUT result
+                     and the workers are shut down.
+    :param connect_rate: The most new connections a second over the whole
+                         run, shared by all the workers, or a
+                         ConnectRateLimiter to share between runs.
+    :param connect_burst: The number of connections let through at once
+                          before they are spaced out by the rate limits
+    :param connect_limits: A dict of subnet, like '10.1.0.0/16', or host
+                           name pattern, like 'web*', to the most new
+                           connections a second to the hosts matching it.
+    :param retry: A RetryPolicy, or the most attempts for each host, to try
+                  the hosts that fail with a transient error again.  The
+                  attempts of each result are kept in its attempts.
+    :param journal: A Journal, or the path of a journal file, to record the
+                    results of each host in as it finishes.
+    :param resume: Skip the hosts already in the journal and start the
+                   results with the results recorded for them, otherwise
+                   the journal file is started over.
+    :param rerun_failed: With resume, run the hosts that failed in the
+                         journal again and only skip the ones that
+                         succeeded.
+    :param callback_mode: Where the output_callback functions marked as
+                          stateless run, one of sshmap.pipeline.MODES, see
+                          CallbackPipeline.  Defaults to 'serial'.
+    :param callback_workers: The number of threads or processes running the
+                             stateless callbacks, defaults to the cpu count.
+    :param callback_ordered: Keep the results in the order they came back
+                             when the stateless callbacks run in a pool.
+    :param reducers: A dict of name: sshmap.mapreduce.Reducer, or a
+                     MapReduce, to map the results to records in the
+                     workers, instead of sending their output back, and
+                     combine the records here.  The result of each reducer
+                     is kept in parm['reduced'].
 
     >>> res=run(host_range='localhost',command="echo ok")
     >>> print(res[0].dump())
@@ -640,6 +1206,12 @@ def run(host_range, command, username=None, password=None, sudo=False,
     'completed_host_count': 1}
     """
 
+    check_retain(retain)
+    if deadline:
+        deadline = clock() + deadline
+    rate_limiter = get_rate_limiter(
+        connect_rate, burst=connect_burst, limits=connect_limits
+    )
     if not output_callback:
         output_callback = [callback.summarize_failures]
 
@@ -659,7 +1231,13 @@ def run(host_range, command, username=None, password=None, sudo=False,
         random.shuffle(hosts)
     status_clear()
     results = ssh_results()
-        
+    results.retain = retain
+    results.timings = TimingSummary()
+    results.metrics = metrics if metrics is not None else RunMetrics()
+    if isinstance(store, str):
+        store = ResultStore(store)
+    results.store = store
+
     if parms:
         results.parm = parms
     else:
@@ -671,33 +1249,38 @@ def run(host_range, command, username=None, password=None, sudo=False,
             result.host = host
             result.err = 'Sudo password required'
             result.retcode = defaults.RUN_FAIL_NOPASSWORD
-            results.append(result)
+            results.add(result)
+        results.order_retained()
         results.parm['total_host_count'] = len(hosts)
         results.parm['completed_host_count'] = 0
         results.parm['failures'] = hosts
         return results    
 
     if jobs < 1:
-        jobs = 1
+        jobs = engine_class(engine).default_jobs or 1
     if jobs > defaults.JOB_MAX:
         jobs = defaults.JOB_MAX
 
-    # Set up our ssh client
-    client = fastSSHClient()
-    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    # load_system_host_keys slows things way down
-    #client.load_system_host_keys()
-
     results.parm['total_host_count'] = len(hosts)
     results.parm['completed_host_count'] = 0
+    results.metrics.hosts_total = len(hosts)
+
+    # A journal opened here is closed here
+    close_journal = isinstance(journal, basestring)
+    journal = get_journal(journal, resume=resume)
+    resumed = []
+    if journal is not None and resume:
+        hosts, resumed = journal.split(hosts, rerun_failed=rerun_failed)
+        results.parm['resumed_host_count'] = len(resumed)
 
     status_clear()
     status_info(output_callback, 'Spawning processes')
 
     if jobs > len(hosts):
         jobs = len(hosts)
+    if connections and connections > len(hosts):
+        connections = len(hosts)
 
-    pool = multiprocessing.Pool(processes=jobs, initializer=init_worker)
     if not chunksize:
         if jobs == 1 or jobs >= len(hosts):
             chunksize = 1
@@ -710,10 +1293,14 @@ def run(host_range, command, username=None, password=None, sudo=False,
             chunksize = 10
 
     results.parm['chunksize'] = chunksize
-    if sort:
-        map_command = pool.imap
-    else:
-        map_command = pool.imap_unordered
+    engine = get_engine(
+        engine, jobs=jobs, chunksize=chunksize, connections=connections
+    )
+    if connection_pool is not None and not engine.in_process:
+        raise ValueError(
+            'A connection pool can only be used with an engine that runs in '
+            'the current process, like the async engine'
+        )
 
     if isinstance(output_callback, list) and \
             callback.status_count in output_callback:
@@ -727,34 +1314,78 @@ def run(host_range, command, username=None, password=None, sudo=False,
     if callback.status_count in output_callback:
         callback.status_count(ssh_result(parm=results.parm))
         
+    # The settings of the run are sent to each worker once with the worker
+    # function, the tasks are just the host names and the parm is attached
+    # to the results here.
+    if commands:
+        worker = functools.partial(
+            run_commands, commands=commands, username=username,
+            password=password, sudo=sudo, timeout=timeout, port=port,
+            connection_pool=connection_pool, parallel=parallel,
+            keep_output=keep_output, timeouts=timeouts,
+            rate_limiter=rate_limiter
+        )
+        expired = functools.partial(expired_result, commands=commands)
+        cancelled = functools.partial(cancelled_result, commands=commands)
+    else:
+        worker = functools.partial(
+            run_command, command=command, username=username,
+            password=password, sudo=sudo, script=script, timeout=timeout,
+            port=port, connection_pool=connection_pool,
+            keep_output=keep_output, timeouts=timeouts,
+            rate_limiter=rate_limiter
+        )
+        expired = functools.partial(expired_result, command=command)
+        cancelled = functools.partial(cancelled_result, command=command)
+
+    mapreduce = get_mapreduce(reducers)
+    if mapreduce is not None:
+        mapreduce.reset()
+        worker = mapreduce.worker_function(worker)
+        if not isinstance(output_callback, Iterable):
+            output_callback = [output_callback]
+        output_callback = list(output_callback) + [mapreduce.combine]
+    pipeline = get_pipeline(
+        output_callback, mode=callback_mode, workers=callback_workers,
+        ordered=callback_ordered
+    )
+    retry = get_retry_policy(retry)
+    worker = pipeline.worker_function(worker, results.parm, retry=retry)
+
+    items = engine.map(
+        worker, results.metrics.dispatch(hosts), ordered=sort,
+        events=bool(line_callback), deadline=deadline, expired=expired,
+        retry=retry, cancelled=cancelled
+    )
+    if journal is not None:
+        items = journal.track(items)
     try:
-        for result in map_command(
-            run_command,
-            [
-                (
-                    host, command, username, password, sudo, script, timeout,
-                    results.parm, client
-                ) for host in hosts
-            ],
-            chunksize
+        # The hosts resumed from the journal come back first, a failure
+        # replayed from the journal doesn't trip exit_on_error
+        for result in _callback_results(
+            results, results.metrics.dispatch(resumed), pipeline
         ):
-            results.parm['completed_host_count'] += 1
-            result.parm = results.parm
-            if isinstance(output_callback, list):
-                for cb in output_callback:
-                    result = cb(result)
-            else:
-                # noinspection PyCallingNonCallable
-                result = output_callback(result)
-            results.parm = result.parm
-            results.append(result)
-            if exit_on_error and result.retcode != 0:
-                break
-        pool.close()
+            results.add(result)
+        for result in _callback_results(
+            results, items, pipeline, exit_on_error=exit_on_error,
+            line_callback=line_callback, cancel=engine.cancel
+        ):
+            if not isinstance(result, OutputLine):
+                results.add(result)
     except KeyboardInterrupt:
         print('ctrl-c pressed')
-        pool.terminate()
-    pool.terminate()
+    finally:
+        # Tear the run down even when a callback raised
+        results.order_retained()
+        engine.terminate()
+        if close_journal:
+            journal.close()
+        results.parm['worker_stats'] = engine.worker_stats
+        if mapreduce is not None:
+            results.parm['reduced'] = mapreduce.results()
+        if engine.cancelled:
+            results.parm['not_run'] = list(engine.not_started)
+            results.metrics.skip(len(engine.not_started))
     if isinstance(output_callback, list) and \
             callback.status_count in output_callback:
         status_clear()
@@ -764,13 +1395,20 @@ def run(host_range, command, username=None, password=None, sudo=False,
 class SSHCommand(ssh_results):
     _jobs = defaults.JOB_MAX
     _executed = False
+    _host_list = None
+    _metrics = None
     output_callback = [callback.summarize_failures]
     parm = {}
 
     def __init__(
             self, host_range, command, username=None, password=None, sudo=False,
             script=None, timeout=None, sort=False, jobs=None, output_callback=None,
-            parms=None, shuffle=False, chunksize=None, exit_on_error=False, collapse=False
+            parms=None, shuffle=False, chunksize=None, exit_on_error=False, collapse=False,
+            engine=None, port=22, connections=None, connection_pool=None, line_callback=None,
+            keep_output=True, retain=defaults.RETAIN_ALL, store=None, metrics=None, timeouts=None,
+            deadline=None, connect_rate=None, connect_burst=None, connect_limits=None, retry=None,
+            journal=None, resume=False, rerun_failed=False, callback_mode=None, callback_workers=None,
+            callback_ordered=True, reducers=None
     ):
         """
         A generic ssh command object class
@@ -783,13 +1421,71 @@ class SSHCommand(ssh_results):
         :param script:
         :param timeout:
         :param sort:
-        :param jobs:
+        :param jobs: The number of worker processes, the hybrid engine
+                     defaults to the cpu count and the async engine to
+                     defaults.ASYNC_CONNECTIONS threads.
         :param output_callback:
         :param parms:
         :param shuffle:
         :param chunksize:
         :param exit_on_error: Exit as soon as one result comes back with a non 0
-                              return code.
+                              return code, cancelling the running hosts and
+                              keeping the ones that never ran in
+                              parm['not_run'].
+        :param collapse:
+        :param engine: The name of the engine to run the commands with, one of
+                       sshmap.engine.ENGINES, or an engine instance.
+        :param port: The ssh port to connect to
+        :param connections: The total number of ssh sessions to run at once
+                            with the async and hybrid engines.
+        :param connection_pool: A ConnectionPool, or True to create one, that
+                                keeps the connections open between runs.
+                                This requires an engine that runs in the
+                                current process like the async engine.
+        :param line_callback: A function, or list of functions, called with
+                              an OutputLine for each line of output as it
+                              arrives.
+        :param keep_output: Keep the output in the results
+        :param retain: Which results to keep, 'all', 'none', 'failures', a
+                       number of the most recent results or 'disk' to move
+                       their output into a temporary ResultStore.
+        :param store: The ResultStore, or the path of one to open, that
+                      'disk' retain moves the output into.
+        :param metrics: A RunMetrics to update while the command runs, each
+                        run gets a new one in the metrics attribute if it
+                        isn't passed.
+        :param timeouts: A Timeouts with separate connect, auth, command and
+                         idle timeouts, the ones it doesn't set default to
+                         timeout.
+        :param deadline: The most seconds a run can take, the hosts that
+                         haven't finished by then get a RUN_FAIL_TIMEOUT
+                         result and the workers are shut down.
+        :param connect_rate: The most new connections a second over a run,
+                             or a ConnectRateLimiter to share between runs.
+        :param connect_burst: The number of connections let through at once
+                              before they are spaced out
+        :param connect_limits: A dict of subnet or host name pattern to the
+                               most new connections a second to the hosts
+                               matching it.
+        :param retry: A RetryPolicy, or the most attempts for each host, to
+                      try the hosts that fail with a transient error again.
+        :param journal: A Journal, or the path of a journal file, to record
+                        the results of each host in as it finishes.
+        :param resume: Skip the hosts already in the journal and start the
+                       results with the results recorded for them,
+                       otherwise each run starts the journal file over.
+        :param rerun_failed: With resume, run the hosts that failed in the
+                             journal again.
+        :param callback_mode: Where the output_callback functions marked as
+                              stateless run, one of sshmap.pipeline.MODES.
+        :param callback_workers: The number of threads or processes running
+                                 the stateless callbacks.
+        :param callback_ordered: Keep the results in the order they came
+                                 back when the stateless callbacks run in a
+                                 pool.
+        :param reducers: A dict of name: sshmap.mapreduce.Reducer, or a
+                         MapReduce, to map the results to records in the
+                         workers and combine into parm['reduced'].
         """
         self.host_range = host_range
         self.command = command
@@ -804,46 +1500,93 @@ class SSHCommand(ssh_results):
             self.output_callback.append(callback.aggregate_output)
         if jobs:
             self._jobs = int(jobs)
+        elif engine_class(engine).default_jobs:
+            self._jobs = engine_class(engine).default_jobs
         if output_callback:
             self.output_callback = output_callback
         if parms:
             self.parm = parms
+        self._parms = dict(parms or {})
 
         self.shuffle = shuffle
         self._chunksize = chunksize
         self.exit_on_error = exit_on_error
+        self.engine = engine
+        self.port = port
+        self.connections = connections
+        if connection_pool is True:
+            connection_pool = ConnectionPool()
+        self.connection_pool = connection_pool
+        self.line_callback = line_callback
+        self.keep_output = keep_output
+        check_retain(retain)
+        self.retain = retain
+        if isinstance(store, str):
+            store = ResultStore(store)
+        self.store = store
+        self._metrics = metrics
+        self.timeouts = timeouts
+        self.deadline = deadline
+        self.connect_rate = connect_rate
+        self.connect_burst = connect_burst
+        self.connect_limits = connect_limits
+        self.rate_limiter = None
+        self.retry = get_retry_policy(retry)
+        self.journal = journal
+        self.resume = resume
+        self.rerun_failed = rerun_failed
+        self._journal = None
+        self._skip_hosts = set()
+        self.callback_mode = callback_mode
+        self.callback_workers = callback_workers
+        self.callback_ordered = callback_ordered
+        self.mapreduce = get_mapreduce(reducers)
         self.init_client()
 
+    def init_client(self):
+        """
+        Set up the paramiko client in client.
+
+        Deprecated, the workers create their own client for each connection
+        so this one isn't used to run the command, it is kept for the
+        callers that still use it.
+        """
+        self.client = fastSSHClient()
+        self.client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+
     @property
     def hosts(self):
-        # Expand the host range if we were passed a string host list
-        if sys.version_info.major > 2:
-            basestring = str
-
-        host_list = self.host_range
-        if isinstance(self.host_range, basestring):
-            host_list = hostlists.expand(hostlists.range_split(self.host_range))
-        if self.shuffle:
-            random.shuffle(host_list)
-        return host_list
+        """
+        The HostList of the host range, it is expanded once for each run as
+        the hosts are used and keeps them in the same order.
+        """
+        if self._host_list is None:
+            self._host_list = HostList(self.host_range, shuffle=self.shuffle)
+        return self._host_list
 
     @property
     def jobs(self):
-        if self._jobs > len(self.hosts):
-            return len(self.hosts)
-        return self._jobs
+        # Only expand as many hosts as needed to know if there are fewer
+        # hosts than jobs, and no more than EXPAND_AHEAD, a range with more
+        # hosts than that gets all the jobs asked for
+        ahead = min(self._jobs, defaults.EXPAND_AHEAD)
+        hosts = self.hosts.count_at_least(ahead)
+        return hosts if hosts < ahead else self._jobs
 
     @property
     def chunksize(self):
         if self._chunksize:
-            if self._chunksize < 1:
-                return 1
-            if self._chunksize > 10:
-                return 10
-
-        if self.jobs == 1 or self.jobs >= len(self.hosts):
+            return min(max(int(self._chunksize), 1), 10)
+
+        jobs = self.jobs
+        # The chunksize is capped at 10, so there is no need to count further
+        # than the hosts of 11 chunks per job.  It is sized from at most
+        # EXPAND_AHEAD hosts, the engines adapt the batches they send to
+        # their workers anyway.
+        hosts = self.hosts.count_at_least(min(jobs * 11, defaults.EXPAND_AHEAD))
+        if jobs == 1 or jobs >= hosts:
             return 1
-        return int(len(self.hosts) / self.jobs) - 1
+        return min(max(int(hosts / jobs) - 1, 1), 10)
 
     def fail_all(self, retcode=defaults.RUN_FAIL_NOPASSWORD):
         for host in self.hosts:
@@ -853,19 +1596,68 @@ class SSHCommand(ssh_results):
             yield result
         self.parm['total_host_count'] = len(self.hosts)
         self.parm['completed_host_count'] = 0
-        self.parm['failures'] = self.hosts
-
-    def init_client(self):
-        self.client = fastSSHClient()
-        self.client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        self.parm['failures'] = list(self.hosts)
 
     def reset_parm(self):
+        # Start from the parms passed in, callbacks read settings from them
         self.parm = dict(
-            total_host_count=len(self.hosts),
+            self._parms,
+            total_host_count=self.hosts.count,
             completed_host_count=0,
             chunksize=self.chunksize
         )
 
+    def dispatch_hosts(self):
+        """
+        Generate the hosts for the engine, keeping the total_host_count up to
+        date as the host range is expanded
+        """
+        for host in self.hosts:
+            self.parm['total_host_count'] = self.metrics.hosts_total = self.hosts.count
+            if host in self._skip_hosts:
+                continue
+            yield host
+        self.parm['total_host_count'] = self.metrics.hosts_total = self.hosts.count
+
+    def worker_function(self):
+        """
+        The function the workers run for each host, carrying the settings of
+        the command
+        """
+        return functools.partial(
+            run_command, command=self.command, username=self.username, password=self.password, sudo=self.sudo,
+            script=self.script, timeout=self.timeout, port=self.port, connection_pool=self.connection_pool,
+            keep_output=self.keep_output, timeouts=self.timeouts, rate_limiter=self.rate_limiter
+        )
+
+    def expired_function(self):
+        """
+        The function giving the result of a host that didn't finish before
+        the deadline
+        """
+        return functools.partial(expired_result, command=self.command)
+
+    def cancelled_function(self):
+        """
+        The function giving the result of a host that was still running when
+        the run was cancelled
+        """
+        return functools.partial(cancelled_result, command=self.command)
+
+    def pipeline(self):
+        """
+        The CallbackPipeline running the output_callback functions on the
+        results
+        """
+        callbacks = self.output_callback
+        if self.mapreduce is not None:
+            if not isinstance(callbacks, Iterable):
+                callbacks = [callbacks]
+            callbacks = list(callbacks) + [self.mapreduce.combine]
+        return get_pipeline(
+            callbacks, mode=self.callback_mode, workers=self.callback_workers, ordered=self.callback_ordered
+        )
+
     def status_count(self):
         if not isinstance(self.output_callback, Iterable):
             return
@@ -875,10 +1667,46 @@ class SSHCommand(ssh_results):
 
     def run_iterate(self):
         """
-        Run the ssh command
+        Run the ssh command, yielding the results as they complete
+        """
+        for item in self._run_items(events=bool(self.line_callback)):
+            if not isinstance(item, OutputLine):
+                yield item
+
+    def iterate_lines(self):
+        """
+        Run the ssh command, yielding an OutputLine (host, stream, line) for
+        each line of output as soon as it arrives.  The results are kept in
+        the object as they complete.
+        """
+        self.clear()
+        for item in self._run_items(events=True):
+            if isinstance(item, OutputLine):
+                yield item
+            else:
+                self.add(item)
+        self.order_retained()
+
+    def _run_items(self, events=False):
+        """
+        Run the ssh command, yielding the results and, with events, the
+        output lines as they arrive
+        :param events:
         """
+        deadline = clock() + self.deadline if self.deadline else None
+        # New buckets for each run, so a run doesn't start in the debt of the
+        # last one
+        self.rate_limiter = get_rate_limiter(
+            self.connect_rate, burst=self.connect_burst, limits=self.connect_limits
+        )
         status_info(self.output_callback, 'Looking up hosts')
+        # Expand the host range again for each run
+        self._host_list = None
         self.reset_parm()
+        self.timings = TimingSummary()
+        self.metrics = self._metrics if self._metrics is not None else RunMetrics()
+        if self.mapreduce is not None:
+            self.mapreduce.reset()
 
         status_clear()
 
@@ -891,59 +1719,158 @@ class SSHCommand(ssh_results):
                 yield result
             return
 
-        status_info(self.output_callback, 'Spawning processes')
-        pool = multiprocessing.Pool(processes=self.jobs, initializer=init_worker)
-        map_command = pool.imap_unordered
-        if self.sort:
-            map_command = pool.imap
+        self._journal = get_journal(self.journal, resume=self.resume)
+        self._skip_hosts = set()
+        try:
+            if self._journal is not None and self.resume:
+                self._skip_hosts = self._journal.done(rerun_failed=self.rerun_failed)
+                _, resumed = self._journal.split(self.hosts.expand(), rerun_failed=self.rerun_failed)
+                self.parm['resumed_host_count'] = len(resumed)
+                # The hosts resumed from the journal come back first, a failure
+                # replayed from the journal doesn't trip exit_on_error
+                for result in _callback_results(self, self.metrics.dispatch(resumed), self.pipeline()):
+                    yield result
+            for result in self._dispatch(events=events, deadline=deadline):
+                yield result
+        except KeyboardInterrupt:
+            print('ctrl-c pressed')
+        finally:
+            # A journal opened for the run is closed with it
+            if self._journal is not self.journal:
+                self._journal.close()
+        if isinstance(self.output_callback, Iterable) and callback.status_count in self.output_callback:
+            status_clear()
 
-        # self.status_count()
+    def _dispatch(self, events=False, deadline=None):
+        """
+        Run the command on the hosts, yielding the results and, with events,
+        the output lines as they arrive
+        :param events:
+        :param deadline: The clock() time to give up at
+        """
+        return self._map_hosts(self.dispatch_hosts(), self.jobs, events=events, deadline=deadline)
+
+    def _map_hosts(self, hosts, jobs, events=False, deadline=None):
+        """
+        Run the command on hosts with a new run of the engine, yielding the
+        results after the output_callback pipeline
+        :param hosts: An iterable of hosts
+        :param jobs: The number of jobs of the engine
+        :param events:
+        :param deadline:
+        """
+        status_info(self.output_callback, 'Spawning processes')
+        engine = get_engine(
+            self.engine, jobs=jobs, chunksize=self.chunksize, connections=self.connections
+        )
+        if self.connection_pool is not None and not engine.in_process:
+            raise ValueError(
+                'A connection pool can only be used with an engine that runs in the current process, like the '
+                'async engine'
+            )
 
         status_clear()
         status_info(self.output_callback, 'Sending %d commands to each process' % self.chunksize)
         self.status_count()
 
+        pipeline = self.pipeline()
+        worker = self.worker_function()
+        if self.mapreduce is not None:
+            worker = self.mapreduce.worker_function(worker)
+        items = engine.map(
+            pipeline.worker_function(worker, self.parm, retry=self.retry), self.metrics.dispatch(hosts),
+            ordered=self.sort,
+            events=events, deadline=deadline, expired=self.expired_function(), retry=self.retry,
+            cancelled=self.cancelled_function()
+        )
+        if self._journal is not None:
+            items = self._journal.track(items)
         try:
-            for result in map_command(
-                    run_command,
-                    [
-                        (
-                                host, self.command, self.username, self.password, self.sudo, self.script, self.timeout,
-                                self.parm, self.client
-                        ) for host in self.hosts
-                    ],
-                    self.chunksize
+            for result in _callback_results(
+                    self,
+                    items,
+                    pipeline,
+                    exit_on_error=self.exit_on_error,
+                    line_callback=self.line_callback,
+                    cancel=engine.cancel
             ):
                 self._executed = True
-                self.parm['completed_host_count'] += 1
-                result.parm = self.parm
-                if isinstance(self.output_callback, Iterable):
-                    for cb in self.output_callback:
-                        result = cb(result)
-                else:
-                    result = self.output_callback(result)
-                self.parm = result.parm
                 yield result
-                if self.exit_on_error and result.retcode != 0:
-                    break
-            pool.close()
-        except KeyboardInterrupt:
-            print('ctrl-c pressed')
-            pool.terminate()
-        pool.terminate()
-        if isinstance(self.output_callback, Iterable) and callback.status_count in self.output_callback:
-            status_clear()
+        finally:
+            engine.terminate()
+            self.parm['worker_stats'] = engine.worker_stats
+            if self.mapreduce is not None:
+                self.parm['reduced'] = self.mapreduce.results()
+            if engine.cancelled:
+                self.parm.setdefault('not_run', []).extend(engine.not_started)
+                self.metrics.skip(len(engine.not_started))
 
     def run(self):
         self.clear()
         for result in self.run_iterate():
-            self.append(result)
+            self.add(result)
+        self.order_retained()
         return self
 
 
+class SSHCommandBatch(SSHCommand):
+    def __init__(self, host_range, commands, parallel=False, **kwargs):
+        """
+        Run a list of commands over a single ssh connection to each host.
+
+        There is a result object for each command on each host, the results
+        of a host are kept together and by_host() groups them.
+
+        :param host_range:
+        :param commands: The list of commands to run
+        :param parallel: Run the commands at the same time on separate
+                         channels instead of one after the other.
+        :param kwargs: The other SSHCommand arguments, script is not
+                       supported.
+        """
+        self.commands = list(commands)
+        self.parallel = parallel
+        super(SSHCommandBatch, self).__init__(host_range, None, **kwargs)
+
+    def worker_function(self):
+        return functools.partial(
+            run_commands, commands=self.commands, username=self.username, password=self.password, sudo=self.sudo,
+            timeout=self.timeout, port=self.port, connection_pool=self.connection_pool, parallel=self.parallel,
+            keep_output=self.keep_output, timeouts=self.timeouts, rate_limiter=self.rate_limiter
+        )
+
+    def expired_function(self):
+        return functools.partial(expired_result, commands=self.commands)
+
+    def cancelled_function(self):
+        return functools.partial(cancelled_result, commands=self.commands)
+
+
+def stream(host_range, command, keep_output=False, **kwargs):
+    """
+    Run a command on a hostlists host_range of hosts, yielding an OutputLine
+    (host, stream, line) for each line of output as soon as it arrives.
+
+    The output isn't kept by default so memory use stays flat no matter how
+    much the hosts send.
+
+    :param host_range:
+    :param command:
+    :param keep_output:
+    :param kwargs: The other SSHCommand arguments
+
+    >>> for host, name, line in stream('localhost', 'echo ok'):
+    ...     print(host, name, line)
+    localhost stdout ok
+    """
+    command = SSHCommand(host_range, command, keep_output=keep_output, **kwargs)
+    for line in command.iterate_lines():
+        yield line
+
+
 # Old class names for backwards compatibility
 class ssh_result(SSHResult):
-    pass
+    __slots__ = ()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,267 @@
+# Copyright (c) 2010-2015, Yahoo Inc.
+# Copyrights licensed under the Apache 2.0 License
+# See the accompanying LICENSE.txt file for terms.
+"""
+sshmap on disk storage for the output of results
+
+A store is an append only segment file holding the output of the results
+and an index file next to it, with a line of JSON for each result giving
+its host, command, return codes and where its stdout and stderr are in the
+segment file.  The segment file is read through mmap, so results read back
+from a store only hold the location of their output and any amount of
+output can be stored.  Both files are flushed as each result is added, so a
+store is readable up to the last result added if the run dies.
+"""
+import array
+import json
+import mmap
+import os
+import tempfile
+import threading
+try:
+    from collections.abc import Sequence
+except ImportError:  # pragma: no cover
+    from collections import Sequence
+
+from .timing import PhaseTimings
+
+
+class StoredLines(Sequence):
+    """
+    A read only list of the lines of output stored in a ResultStore, the
+    lines are read from the store each time they are used.  Where each line
+    ends is worked out the first time a line is looked up, so indexing only
+    reads and decodes the line asked for.
+    """
+
+    __slots__ = ('store', 'offset', 'length', '_ends')
+
+    def __init__(self, store, offset, length):
+        self.store = store
+        self.offset = offset
+        self.length = length
+        self._ends = None
+
+    def __getitem__(self, index):
+        ends = self._line_ends()
+        if isinstance(index, slice):
+            return [self[item] for item in range(*index.indices(len(ends)))]
+        if index < 0:
+            index += len(ends)
+        if not 0 <= index < len(ends):
+            raise IndexError('StoredLines index out of range')
+        start = ends[index - 1] if index else 0
+        return self.store.read(
+            self.offset + start, ends[index] - start
+        ).decode('utf-8', 'ignore')
+
+    def __len__(self):
+        return len(self._line_ends())
+
+    def __iter__(self):
+        return iter(self._lines())
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return repr(self._lines())
+
+    def _line_ends(self):
+        """ The offset just past each line, from the start of the output """
+        if self._ends is None:
+            data = self.tobytes()
+            ends = array.array('L')
+            end = data.find(b'\n')
+            while end >= 0:
+                ends.append(end + 1)
+                end = data.find(b'\n', end + 1)
+            if len(data) > (ends[-1] if ends else 0):
+                ends.append(len(data))
+            self._ends = ends
+        return self._ends
+
+    def _lines(self):
+        pieces = self.tobytes().split(b'\n')
+        lines = [piece + b'\n' for piece in pieces[:-1]]
+        if pieces[-1]:
+            lines.append(pieces[-1])
+        return [line.decode('utf-8', 'ignore') for line in lines]
+
+    def tobytes(self):
+        """ Return the output as bytes without splitting it into lines """
+        return self.store.read(self.offset, self.length)
+
+
+class ResultStore(object):
+    """
+    An append only segment file and index holding the output of results, so
+    only the small result objects have to stay in memory.
+
+    >>> store = ResultStore()
+    >>> result = store.add(sshmap.ssh_result(['out\\n'], [], 'host'))
+    >>> list(result.out)
+    ['out\\n']
+    >>> store.close()
+    """
+
+    def __init__(self, path=None):
+        """
+        :param path: The segment file to use, the index is kept in path.idx.
+                     The results already in an existing store are kept and
+                     new ones are added after them.  Defaults to temporary
+                     files that are removed when the store is closed or
+                     garbage collected.
+        """
+        if path is None:
+            self._handle = tempfile.NamedTemporaryFile(
+                prefix='sshmap-', suffix='.seg'
+            )
+            self._index_handle = tempfile.NamedTemporaryFile(
+                mode='w+', prefix='sshmap-', suffix='.seg.idx'
+            )
+        else:
+            self._handle = open(path, 'ab+')
+            self._index_handle = open(path + '.idx', 'a+')
+        self.path = self._handle.name
+        self._handle.seek(0, os.SEEK_END)
+        self._size = self._handle.tell()
+        self._map = None
+        self._lock = threading.Lock()
+        self.index = []
+        # The index entries of each host
+        self._hosts = {}
+        self._index_handle.seek(0)
+        for line in self._index_handle:
+            if line.strip():
+                self._add_entry(json.loads(line))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        return self.results()
+
+    def _add_entry(self, entry):
+        self.index.append(entry)
+        self._hosts.setdefault(entry['host'], []).append(entry)
+
+    def write(self, data):
+        """
+        Append data to the segment file
+        :param data:
+        :return: The offset the data was written at
+        """
+        with self._lock:
+            offset = self._size
+            self._handle.write(data)
+            self._size += len(data)
+            return offset
+
+    def read(self, offset, length):
+        """
+        Read length bytes at offset of the segment file
+        :param offset:
+        :param length:
+        """
+        if not length:
+            return b''
+        with self._lock:
+            if self._map is None or offset + length > len(self._map):
+                # Map the file again to take in what was added since
+                self._handle.flush()
+                if self._map is not None:
+                    self._map.close()
+                self._map = mmap.mmap(
+                    self._handle.fileno(), 0, access=mmap.ACCESS_READ
+                )
+            return self._map[offset:offset + length]
+
+    def add(self, result):
+        """
+        Move the output of a result into the store, its out and err are
+        replaced with StoredLines read from the store when used.
+        :param result:
+        :return: The result
+        """
+        entry = dict(
+            host=result.host, command=result.command, retcode=result.retcode,
+            ssh_retcode=result.ssh_retcode
+        )
+        if getattr(result, 'timings', None) is not None:
+            entry['timings'] = list(result.timings.marks)
+        if getattr(result, 'attempts', 1) > 1:
+            entry['attempts'] = result.attempts
+        for name in ['out', 'err']:
+            data = result.sequence_to_bytes(getattr(result, name) or [])
+            offset = self.write(data)
+            entry[name] = [offset, len(data)]
+            setattr(result, name, StoredLines(self, offset, len(data)))
+        with self._lock:
+            self._add_entry(entry)
+            self._index_handle.write(json.dumps(entry) + '\n')
+            # The output goes out before the index entry pointing at it
+            self._handle.flush()
+            self._index_handle.flush()
+        return result
+
+    def result(self, entry, parm=None):
+        """
+        Get a result object for an index entry
+        :param entry:
+        :param parm: The parm dict of the result
+        """
+        # Imported here, sshmap.sshmap uses this module
+        from .sshmap import ssh_result
+        timings = None
+        if entry.get('timings'):
+            timings = PhaseTimings(entry['timings'])
+        result = ssh_result(
+            out=StoredLines(self, *entry['out']),
+            err=StoredLines(self, *entry['err']),
+            host=entry['host'], retcode=entry['retcode'],
+            ssh_ret=entry['ssh_retcode'], parm={} if parm is None else parm,
+            command=entry['command'], timings=timings
+        )
+        result.attempts = entry.get('attempts', 1)
+        return result
+
+    def results(self, parm=None):
+        """
+        Iterate over result objects reading their output from the store, in
+        the order they were added
+        :param parm: The parm dict given to the results
+        """
+        for entry in list(self.index):
+            yield self.result(entry, parm=parm)
+
+    def by_host(self, host):
+        """
+        Get the results of a host
+        :param host:
+        """
+        return [self.result(entry) for entry in self._hosts.get(host, [])]
+
+    def flush(self):
+        """ Write everything added so far out to the files """
+        with self._lock:
+            self._handle.flush()
+            self._index_handle.flush()
+
+    def close(self):
+        """ Close the store, removing the files if they are temporary """
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+        self._handle.close()
+        self._index_handle.close()
@@ -0,0 +1,288 @@
+# Copyright (c) 2010-2015, Yahoo Inc.
+# Copyrights licensed under the Apache 2.0 License
+# See the accompanying LICENSE.txt file for terms.
+"""
+sshmap timing of the phases of running a command on a host
+
+The phases follow each other, each one ends when the next one starts:
+
+dns       Looking up the address of the host
+connect   The tcp connection
+kex       The ssh banner and key exchange
+auth      Authentication
+channel   Opening the session channel
+exec      Sending the command until the first output arrives
+transfer  Receiving the output until the command exits
+
+Phases that don't happen, like the connection phases of a command run on a
+pooled connection, have no time.
+
+Timeouts limits how long the phases can take.
+"""
+from array import array
+from collections import OrderedDict
+import time
+
+try:
+    clock = time.monotonic
+except AttributeError:  # pragma: no cover
+    # python 2.x has no monotonic clock
+    clock = time.time
+
+
+PHASES = ['dns', 'connect', 'kex', 'auth', 'channel', 'exec', 'transfer']
+PHASE_INDEX = dict((phase, index) for index, phase in enumerate(PHASES))
+
+# The percentiles of each phase in the summary of a run
+PERCENTILES = [50, 90, 99]
+
+NOT_STARTED = float('nan')
+
+
+def _started(mark):
+    # NaN is the only value that isn't equal to itself
+    return mark == mark
+
+
+class PhaseTimings(object):
+    """
+    The monotonic clock time each phase of running a command started and
+    the time the command finished.
+
+    >>> timings = PhaseTimings()
+    >>> timings.start('channel')
+    >>> timings.start('exec')
+    >>> timings.stop()
+    >>> list(timings.durations().keys())
+    ['channel', 'exec']
+    """
+
+    __slots__ = ('marks',)
+
+    def __init__(self, marks=None):
+        """
+        :param marks: The start time of each of the PHASES followed by the
+                      end time, NaN for the phases that didn't happen
+        """
+        if marks is None:
+            marks = [NOT_STARTED] * (len(PHASES) + 1)
+        self.marks = array('d', marks)
+
+    def __getstate__(self):
+        return self.marks
+
+    def __setstate__(self, state):
+        self.marks = state
+
+    def __repr__(self):
+        return 'PhaseTimings(%s)' % ', '.join(
+            '%s=%.6f' % item for item in self.durations().items()
+        )
+
+    def start(self, phase):
+        """
+        Start a phase, ending the one before it
+        :param phase: One of PHASES
+        """
+        self.marks[PHASE_INDEX[phase]] = clock()
+
+    def exclude(self, phase, seconds):
+        """
+        Leave seconds spent waiting on something else out of the time of a
+        running phase
+        :param phase: The running phase
+        :param seconds:
+        """
+        self.marks[PHASE_INDEX[phase]] += seconds
+
+    def stop(self):
+        """ End the last phase """
+        self.marks[-1] = clock()
+
+    def started(self, phase):
+        """
+        Get the time a phase started
+        :param phase:
+        :return: The clock time or None if the phase didn't happen
+        """
+        mark = self.marks[PHASE_INDEX[phase]]
+        return mark if _started(mark) else None
+
+    @property
+    def finished(self):
+        """ The clock time the command finished or None """
+        return self.marks[-1] if _started(self.marks[-1]) else None
+
+    def durations(self):
+        """
+        Get the seconds each phase took
+        :return: An OrderedDict of phase: seconds for the phases that
+                 happened, a phase that was still running when the command
+                 finished runs up to the finish.
+        """
+        durations = OrderedDict()
+        marks = self.marks
+        for index, phase in enumerate(PHASES):
+            if not _started(marks[index]):
+                continue
+            for end in marks[index + 1:]:
+                if _started(end):
+                    durations[phase] = end - marks[index]
+                    break
+        return durations
+
+    @property
+    def total(self):
+        """ The seconds from the first phase to the finish """
+        durations = self.durations()
+        return sum(durations.values()) if durations else None
+
+
+def percentile(values, percent):
+    """
+    Get a percentile of a sorted list of values with the nearest rank method
+    :param values:
+    :param percent:
+    """
+    if not values:
+        return None
+    rank = int(-(-len(values) * percent // 100))
+    return values[max(rank, 1) - 1]
+
+
+class TimingSummary(object):
+    """
+    The durations of each phase over all of the results of a run, kept as
+    arrays of floats so a summary of a large run stays small.
+    """
+
+    def __init__(self):
+        self.durations = OrderedDict(
+            (phase, array('d')) for phase in PHASES + ['total']
+        )
+
+    def __len__(self):
+        return len(self.durations['total'])
+
+    def add(self, timings):
+        """
+        Add the timings of a result
+        :param timings: A PhaseTimings, None is ignored
+        """
+        if timings is None:
+            return
+        durations = timings.durations()
+        if not durations:
+            return
+        for phase, seconds in durations.items():
+            self.durations[phase].append(seconds)
+        self.durations['total'].append(sum(durations.values()))
+
+    def summary(self, percentiles=None):
+        """
+        Get statistics of each phase
+        :param percentiles: The percentiles to include, defaults to
+                            PERCENTILES
+        :return: An OrderedDict of phase: OrderedDict of count, min, the
+                 percentiles as p50, p90... and max, in seconds, for the
+                 phases that happened at least once.
+        """
+        if percentiles is None:
+            percentiles = PERCENTILES
+        summary = OrderedDict()
+        for phase, durations in self.durations.items():
+            if not durations:
+                continue
+            values = sorted(durations)
+            stats = OrderedDict([('count', len(values)), ('min', values[0])])
+            for percent in percentiles:
+                stats['p%s' % percent] = percentile(values, percent)
+            stats['max'] = values[-1]
+            summary[phase] = stats
+        return summary
+
+    def report(self, percentiles=None):
+        """
+        Get the summary as a text table, in milliseconds
+        :param percentiles:
+        """
+        summary = self.summary(percentiles=percentiles)
+        if not summary:
+            return ''
+        columns = list(next(iter(summary.values())).keys())
+        lines = ['%-10s' % 'phase' + ''.join(
+            '%10s' % column for column in columns
+        )]
+        for phase, stats in summary.items():
+            line = '%-10s%10d' % (phase, stats['count'])
+            line += ''.join(
+                '%10.1f' % (stats[column] * 1000) for column in columns[1:]
+            )
+            lines.append(line)
+        return '\n'.join(lines) + '\n'
+
+
+class Timeouts(object):
+    """
+    The seconds each part of running a command can take, None for no limit
+
+    connect  The tcp connect, the ssh banner and the key exchange
+    auth     Authentication
+    command  The whole command, from opening the channel until it exits
+    idle     Waiting for the next output from the command
+
+    >>> Timeouts(command=60).with_default(10)
+    Timeouts(connect=10, auth=10, command=60, idle=10)
+    """
+
+    __slots__ = ('connect', 'auth', 'command', 'idle')
+
+    def __init__(self, connect=None, auth=None, command=None, idle=None):
+        self.connect = connect or None
+        self.auth = auth or None
+        self.command = command or None
+        self.idle = idle or None
+
+    def __getstate__(self):
+        return [getattr(self, name) for name in self.__slots__]
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+    def __eq__(self, other):
+        return isinstance(other, Timeouts) and \
+            self.__getstate__() == other.__getstate__()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'Timeouts(%s)' % ', '.join(
+            '%s=%r' % (name, getattr(self, name)) for name in self.__slots__
+        )
+
+    def with_default(self, timeout):
+        """
+        Get a copy using timeout for the connect, auth and idle timeouts
+        that aren't set, the way the single timeout option has always been
+        used.
+        :param timeout: Seconds, 0 or None for no limit
+        """
+        return Timeouts(
+            connect=self.connect or timeout, auth=self.auth or timeout,
+            command=self.command, idle=self.idle or timeout
+        )
+
+
+def get_timeouts(timeout=None, timeouts=None):
+    """
+    Get the Timeouts to use from the timeout and timeouts arguments of a
+    command
+    :param timeout: The single timeout in seconds, used for the timeouts not
+                    set in timeouts
+    :param timeouts: A Timeouts or None
+    """
+    if timeouts is None:
+        timeouts = Timeouts()
+    return timeouts.with_default(timeout or None)
@@ -8,6 +8,14 @@ import subprocess
 import sys
 
 
+# The string base class, for the modules that accept a string or a list
+try:
+    basestring = basestring
+except NameError:
+    # basestring is not in python3.x
+    basestring = str
+
+
 def get_parm_val(parm=None, key=None):
     """
     Return the value of a key
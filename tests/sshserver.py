@@ -0,0 +1,181 @@
+# Copyright (c) 2010-2015, Yahoo Inc.
+# Copyrights licensed under the Apache 2.0 License
+# See the accompanying LICENSE.txt file for terms.
+"""
+ssh server stand-in used by the unit tests
+
+The server accepts any username and password and runs exec requests with the
+local shell, so the tests can exercise the real paramiko client code paths
+without needing sshd running on the test host.
+
+It runs in a child process, the engines fork their workers from the test
+process and a fork taken while a server thread holds an OpenSSL lock leaves
+the worker stuck in its key exchange.
+"""
+import multiprocessing
+import socket
+import subprocess
+import threading
+import paramiko
+
+
+HOST_KEY = paramiko.RSAKey.generate(1024)
+
+
+class _ServerInterface(paramiko.ServerInterface):
+    """ Accept every authentication attempt and exec request """
+
+    def __init__(self, server):
+        self.server = server
+
+    def get_allowed_auths(self, username):
+        return 'password,publickey'
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_auth_publickey(self, username, key):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_forward_agent_request(self, channel):
+        return False
+
+    def check_channel_exec_request(self, channel, command):
+        if isinstance(command, bytes):
+            command = command.decode()
+        self.server.commands.append(command)
+        thread = threading.Thread(
+            target=_exec_command, args=(channel, command)
+        )
+        thread.daemon = True
+        thread.start()
+        return True
+
+
+def _copy_stdin(channel, stdin):
+    """ Copy the channel input to the process until the client sends EOF """
+    try:
+        while True:
+            data = channel.recv(32768)
+            if not data:
+                break
+            stdin.write(data)
+            stdin.flush()
+    except (IOError, OSError, socket.error):
+        pass
+    try:
+        stdin.close()
+    except (IOError, OSError):
+        pass
+
+
+def _copy_stderr(channel, stderr):
+    for data in iter(lambda: stderr.read1(32768), b''):
+        channel.sendall_stderr(data)
+
+
+def _exec_command(channel, command):
+    """ Run a command with the local shell and send its output back """
+    process = subprocess.Popen(
+        command, shell=True, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+    stdin_thread = threading.Thread(
+        target=_copy_stdin, args=(channel, process.stdin)
+    )
+    stdin_thread.daemon = True
+    stdin_thread.start()
+    stderr_thread = threading.Thread(
+        target=_copy_stderr, args=(channel, process.stderr)
+    )
+    stderr_thread.daemon = True
+    stderr_thread.start()
+    try:
+        for data in iter(lambda: process.stdout.read1(32768), b''):
+            channel.sendall(data)
+        stderr_thread.join()
+        channel.send_exit_status(process.wait())
+        # Send an EOF and leave closing the channel to the client, a quick
+        # command closing it can beat the reply to the exec request and the
+        # client fails with "Channel closed".
+        channel.shutdown_write()
+    except (EOFError, socket.error):
+        process.kill()
+        channel.close()
+
+
+class SSHServer(object):
+    """
+    A minimal ssh server listening on a random port of the loopback address
+
+    >>> server = SSHServer().start()
+    >>> server.port > 0
+    True
+    >>> server.stop()
+    """
+    host = '127.0.0.1'
+
+    def __init__(self):
+        # Counted in the server process
+        self._connections = multiprocessing.Value('i', 0)
+        self.commands = []
+        self._socket = None
+        self._process = None
+        self._transports = []
+        self._lock = threading.Lock()
+
+    @property
+    def connections(self):
+        return self._connections.value
+
+    @property
+    def port(self):
+        return self._socket.getsockname()[1]
+
+    def start(self):
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind((self.host, 0))
+        self._socket.listen(1024)
+        self._process = multiprocessing.Process(target=self._accept)
+        self._process.daemon = True
+        self._process.start()
+        return self
+
+    def stop(self):
+        self._process.terminate()
+        self._process.join()
+        self._socket.close()
+
+    def _accept(self):
+        while True:
+            try:
+                client, address = self._socket.accept()
+            except (socket.error, OSError):
+                return
+            with self._connections.get_lock():
+                self._connections.value += 1
+            thread = threading.Thread(target=self._serve, args=(client,))
+            thread.daemon = True
+            thread.start()
+
+    def _serve(self, client):
+        transport = paramiko.Transport(client)
+        transport.add_server_key(HOST_KEY)
+        with self._lock:
+            self._transports.append(transport)
+        try:
+            transport.start_server(server=_ServerInterface(self))
+        except (paramiko.SSHException, EOFError):
+            return
+        # The transport only holds weak references to its channels
+        channels = []
+        while transport.is_active():
+            channel = transport.accept(1)
+            if channel:
+                channels.append(channel)
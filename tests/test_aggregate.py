@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# Copyright (c) 2010-2015, Yahoo Inc.
+# Copyrights licensed under the Apache 2.0 License
+# See the accompanying LICENSE.txt file for terms.
+"""
+Unit tests of the streaming aggregation of identical output
+"""
+import pickle
+import unittest
+import sshmap
+from sshmap.aggregate import NORMALIZERS, OutputAggregator, get_normalizers
+
+
+def result(host, out, err=None, ssh_ret=0):
+    return sshmap.sshmap.ssh_result(out, err or [], host, ssh_ret=ssh_ret)
+
+
+class TestOutputAggregator(unittest.TestCase):
+
+    def test__add__groups_in_order(self):
+        aggregator = OutputAggregator()
+        for host, out in [('a', 'one\n'), ('b', 'two\n'), ('c', 'one\n')]:
+            aggregator.add(result(host, [out]))
+        self.assertEqual(
+            [(group.hosts, list(group.out)) for group in aggregator],
+            [(['a', 'c'], ['one\n']), (['b'], ['two\n'])]
+        )
+
+    def test__add__streams_kept_apart(self):
+        aggregator = OutputAggregator()
+        aggregator.add(result('a', ['x\n'], []))
+        aggregator.add(result('b', [], ['x\n']))
+        self.assertEqual(len(aggregator), 2)
+
+    def test__add__ssh_error(self):
+        aggregator = OutputAggregator()
+        aggregator.add(result('a', [], ssh_ret=sshmap.defaults.RUN_OK))
+        group = aggregator.add(
+            result('b', [], ssh_ret=sshmap.defaults.RUN_FAIL_CONNECT)
+        )
+        self.assertEqual(len(aggregator), 2)
+        self.assertEqual(list(group.err), ['SSH Connection Failed'])
+
+    def test__hosts__listed_once(self):
+        aggregator = OutputAggregator()
+        for _ in range(3):
+            group = aggregator.add(result('a', ['same\n']))
+        self.assertEqual(len(group), 3)
+        self.assertEqual(group.hosts, ['a'])
+        self.assertEqual(aggregator.host_names, ['a'])
+
+    def test__views(self):
+        aggregator = OutputAggregator()
+        aggregator.add(result('a', ['one\n']))
+        aggregator.add(result('b', ['one\n']))
+        hosts = aggregator.host_groups()
+        outputs = aggregator.output_groups()
+        digest = next(iter(aggregator)).digest
+        self.assertEqual(dict(hosts), {digest: ['a', 'b']})
+        self.assertEqual(list(outputs[digest][0]), ['one\n'])
+        copy = pickle.loads(pickle.dumps(hosts))
+        self.assertEqual(dict(copy), dict(hosts))
+
+    def test__aggregate_output__callback(self):
+        results = sshmap.sshmap.ssh_results()
+        results.parm = {}
+        results.collapse = True
+        for host in ['web1', 'web2', 'web3']:
+            item = result(host, ['ok\n'])
+            item.parm = results.parm
+            sshmap.callback.aggregate_output(item)
+        self.assertEqual(
+            list(results.parm['aggregate_hosts'].values()),
+            [['web1', 'web2', 'web3']]
+        )
+        results._executed = True
+        self.assertEqual(results._repr_text_(), 'web[1-3]\nok\n')
+
+
+class TestNormalizers(unittest.TestCase):
+
+    def normalize(self, line, names, host='web1.example.com'):
+        for normalizer in get_normalizers(names):
+            line = normalizer(line, host)
+        return line
+
+    def test__builtin_normalizers(self):
+        self.assertEqual(
+            self.normalize(
+                'web1 up 3 days, 10:22, from 10.1.2.3 at 2024-05-01T10:00:00Z',
+                'numbers,ips,timestamps,hostname'
+            ),
+            '<HOST> up <N> days, <TIME>, from <IP> at <TIME>'
+        )
+
+    def test__host_normalizer__whole_names(self):
+        self.assertEqual(
+            self.normalize('web1 up, web10 up, web1.example.com.', 'hostname'),
+            '<HOST> up, web10 up, <HOST>.'
+        )
+        self.assertEqual(
+            self.normalize('web1.example.community', 'hostname'),
+            '<HOST>.example.community'
+        )
+
+    def test__get_normalizers__order_and_patterns(self):
+        def function(line, host):
+            return line.upper()
+
+        normalizers = get_normalizers(['numbers', r'pid=\w+', function])
+        self.assertIs(normalizers[0], NORMALIZERS['numbers'])
+        self.assertIs(normalizers[-1], function)
+        self.assertEqual(
+            self.normalize('pid=abc 12 x', ['numbers', r'pid=\w+', function]),
+            '<*> <N> X'
+        )
+        self.assertEqual(get_normalizers(None), [])
+
+    def test__normalized_groups(self):
+        aggregator = OutputAggregator(normalizers='hostname,numbers')
+        for index in range(1, 6):
+            aggregator.add(result(
+                'web%d' % index, ['web%d up %d days\n' % (index, index), 'ok\n']
+            ))
+        aggregator.add(result('web6', ['failed\n']))
+        self.assertEqual(len(aggregator), 2)
+        group = next(iter(aggregator))
+        self.assertEqual(len(group), 5)
+        self.assertEqual(group.view(), (['<HOST> up <N> days\n', 'ok\n'], []))
+        differences = group.differences()
+        self.assertEqual(len(differences), 1)
+        number, template, differs, samples = differences[0]
+        self.assertEqual((number, template, differs), (1, '<HOST> up <N> days\n', 4))
+        # The first host and a bounded number of samples of the others
+        self.assertEqual(
+            samples,
+            ['web1 up 1 days\n', 'web2 up 2 days\n', 'web3 up 3 days\n', 'web4 up 4 days\n']
+        )
+        self.assertIn('4 of 5 hosts differ', group.diff_text())
+
+    def test__aggregate_output__normalize_setting(self):
+        parm = {'aggregate_normalize': 'numbers'}
+        for index in range(3):
+            item = result('host%d' % index, ['load %d\n' % index])
+            item.parm = parm
+            sshmap.callback.aggregate_output(item)
+        self.assertEqual(len(parm['aggregate']), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
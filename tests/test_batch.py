@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# Copyright (c) 2010-2015, Yahoo Inc.
+# Copyrights licensed under the Apache 2.0 License
+# See the accompanying LICENSE.txt file for terms.
+"""
+Unit tests of running several commands over one ssh connection
+"""
+import unittest
+import sshmap
+from sshserver import SSHServer
+
+
+class TestBatch(unittest.TestCase):
+    commands = ['echo one', 'echo two >&2', 'exit 3']
+
+    def setUp(self):
+        self.server = SSHServer().start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def check_results(self, results, hosts):
+        self.assertEqual(len(results), len(self.commands) * hosts)
+        self.assertEqual(self.server.connections, hosts)
+        for host, host_results in results.by_host().items():
+            self.assertEqual([item.command for item in host_results], self.commands)
+            self.assertEqual(host_results[0].out_string(), 'one\n')
+            self.assertEqual(host_results[1].err_string(), 'two\n')
+            self.assertEqual(host_results[2].retcode, 3)
+
+    def test__run__commands(self):
+        results = sshmap.run(
+            self.server.host, commands=self.commands, password='password',
+            port=self.server.port
+        )
+        self.check_results(results, 1)
+        self.assertEqual(results.parm['completed_host_count'], 1)
+
+    def test__run__commands_parallel(self):
+        results = sshmap.run(
+            self.server.host, commands=self.commands, password='password',
+            port=self.server.port, parallel=True, engine='async'
+        )
+        self.check_results(results, 1)
+
+    def test__ssh_command_batch(self):
+        hosts = ['127.0.0.1', 'localhost']
+        command = sshmap.SSHCommandBatch(
+            hosts, self.commands, password='password', port=self.server.port,
+            engine='async', sort=True
+        )
+        command.run()
+        self.check_results(command, 2)
+        self.assertEqual(list(command.by_host()), hosts)
+
+    def test__run_commands__connect_failure(self):
+        port = self.server.port
+        self.server.stop()
+        results = sshmap.run_commands(
+            self.server.host, self.commands, password='password', port=port,
+            timeout=5
+        )
+        self.assertEqual(len(results), 3)
+        for result in results:
+            self.assertEqual(result.ssh_retcode, sshmap.defaults.RUN_FAIL_CONNECT)
+
+
+if __name__ == '__main__':
+    unittest.main()
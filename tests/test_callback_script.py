@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# Copyright (c) 2010-2015, Yahoo Inc.
+# Copyrights licensed under the Apache 2.0 License
+# See the accompanying LICENSE.txt file for terms.
+"""
+Unit tests of passing the results to a callback script
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import sshmap
+from sshmap.callback import ScriptStream, exec_command
+from sshmap.pipeline import CallbackPipeline
+
+
+def result(host, out, parm=None):
+    return sshmap.sshmap.ssh_result(
+        [out], [], host, retcode=0, parm=parm, command='hostname'
+    )
+
+
+class TestScriptStream(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, 'records')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+
+    def test__json__single_process(self):
+        stream = ScriptStream(
+            'cat > %s; echo $$ >> %s' % (self.path, self.path)
+        )
+        for host in ['a', 'b', 'c']:
+            stream(result(host, '%s\n' % host))
+        self.assertEqual(stream.close(), 0)
+        with open(self.path) as handle:
+            lines = handle.read().splitlines()
+        # One script ran for all the hosts
+        self.assertEqual(len(lines), 4)
+        records = [json.loads(line) for line in lines[:3]]
+        self.assertEqual(
+            [record['host'] for record in records], ['a', 'b', 'c']
+        )
+        self.assertEqual(records[0]['stdout'], 'a\n')
+        self.assertEqual(records[0]['command'], 'hostname')
+
+    def test__length_framing(self):
+        with ScriptStream('cat > %s' % self.path, framing='length') as stream:
+            stream(result('a', 'caf\xe9\n'))
+            stream(result('b', 'b\n'))
+        with open(self.path, 'rb') as handle:
+            data = handle.read()
+        records = []
+        while data:
+            header, data = data.split(b'\n', 1)
+            length = int(header)
+            records.append(json.loads(data[:length].decode('utf-8')))
+            data = data[length:]
+        self.assertEqual(
+            [record['stdout'] for record in records], ['caf\xe9\n', 'b\n']
+        )
+
+    def test__not_started_without_results(self):
+        self.assertIsNone(ScriptStream('false').close())
+
+    def test__invalid_framing(self):
+        with self.assertRaises(ValueError):
+            ScriptStream('cat', framing='xml')
+
+
+class TestExecCommand(unittest.TestCase):
+
+    def test__exec_command(self):
+        parm = {'callback_script': (
+            '%s -c "import sys; print(sys.argv[1] + sys.stdin.read())"' %
+            sys.executable
+        )}
+        item = exec_command(result('a', 'out\n', parm=parm))
+        self.assertEqual(item.out_string(), 'aout\n\n')
+
+    def test__exec_command__pool(self):
+        parm = {'callback_script': 'echo'}
+        pipeline = CallbackPipeline([exec_command], mode='thread', workers=4)
+        hosts = ['host%d' % index for index in range(8)]
+        items = list(pipeline.run(
+            iter([result(host, '', parm=parm) for host in hosts]), parm
+        ))
+        self.assertEqual(
+            [item.out_string() for item in items],
+            [host + '\n' for host in hosts]
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
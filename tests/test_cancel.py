@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# Copyright (c) 2010-2015, Yahoo Inc.
+# Copyrights licensed under the Apache 2.0 License
+# See the accompanying LICENSE.txt file for terms.
+"""
+Unit tests of cancelling a run when exit_on_error trips
+"""
+import os
+import shutil
+import tempfile
+import time
+import unittest
+try:
+    from unittest import mock
+except ImportError:  # pragma: no cover
+    import mock
+import sshmap
+from sshmap.journal import Journal
+from sshserver import SSHServer
+
+
+class TestCancel(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = SSHServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        # The commands of the cancelled hosts can still be winding down on
+        # the server
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+
+    def command(self, name='failed', fail_after=0):
+        # The first host to create the directory fails, the rest print a
+        # line and run until they are cancelled
+        return 'mkdir %s 2>/dev/null && { sleep %s; exit 1; }; ' \
+            'echo started; sleep 10' % (
+                os.path.join(self.tempdir, name), fail_after
+            )
+
+    def check_cancelled(self, results, parm, hosts):
+        retcodes = [result.ssh_retcode for result in results]
+        self.assertEqual(
+            [result.retcode for result in results].count(1), 1
+        )
+        self.assertIn(sshmap.defaults.RUN_CANCELLED, retcodes)
+        self.assertEqual(len(results) + len(parm['not_run']), hosts)
+        for result in results:
+            if result.ssh_retcode == sshmap.defaults.RUN_CANCELLED:
+                self.assertEqual(result.err_string().splitlines()[-1], 'Cancelled')
+
+    def test__run__exit_on_error(self):
+        for engine in ['process', 'async']:
+            start = time.time()
+            results = sshmap.run(
+                ','.join([self.server.host] * 20), self.command(engine),
+                password='password', port=self.server.port, jobs=4,
+                engine=engine, exit_on_error=True, output_callback=[]
+            )
+            self.assertLess(time.time() - start, 5)
+            self.check_cancelled(results, results.parm, 20)
+            self.assertTrue(results.parm['not_run'])
+            self.assertEqual(results.metrics.pending, 0)
+            self.assertEqual(results.metrics.not_run, len(results.parm['not_run']))
+
+    def test__run__exit_on_error__keeps_partial_output(self):
+        results = sshmap.run(
+            ','.join([self.server.host] * 3), self.command(fail_after=1),
+            password='password', port=self.server.port, jobs=3,
+            engine='async', exit_on_error=True, output_callback=[]
+        )
+        cancelled = [
+            result for result in results
+            if result.ssh_retcode == sshmap.defaults.RUN_CANCELLED
+        ]
+        self.assertTrue(cancelled)
+        for result in cancelled:
+            self.assertEqual(result.out_string(), 'started\n')
+
+    def test__ssh_command__exit_on_error(self):
+        command = sshmap.SSHCommand(
+            ','.join([self.server.host] * 10), self.command(),
+            password='password', port=self.server.port, jobs=2,
+            exit_on_error=True, output_callback=[]
+        )
+        start = time.time()
+        command.run()
+        self.assertLess(time.time() - start, 5)
+        self.check_cancelled(command, command.parm, 10)
+
+    def test__run__callback_error_tears_down(self):
+        engine = sshmap.engine.get_engine('process', jobs=2)
+
+        def fail(result):
+            raise RuntimeError('callback failed')
+
+        close = Journal.close
+        with mock.patch.object(
+            Journal, 'close', autospec=True, side_effect=close
+        ) as closed:
+            with self.assertRaises(RuntimeError):
+                sshmap.run(
+                    ','.join([self.server.host] * 4), 'echo hello',
+                    password='password', port=self.server.port,
+                    engine=engine, output_callback=[fail],
+                    journal=os.path.join(self.tempdir, 'run.journal')
+                )
+            self.assertEqual(closed.call_count, 1)
+        self.assertEqual(engine._processes, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
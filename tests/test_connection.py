@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# Copyright (c) 2010-2015, Yahoo Inc.
+# Copyrights licensed under the Apache 2.0 License
+# See the accompanying LICENSE.txt file for terms.
+"""
+Unit tests of the sshmap connection pool
+"""
+import time
+import unittest
+import sshmap
+from sshserver import SSHServer
+
+
+class TestConnectionPool(unittest.TestCase):
+
+    def setUp(self):
+        self.server = SSHServer().start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def command(self, **kwargs):
+        return sshmap.SSHCommand(
+            ','.join([self.server.host] * 3), 'echo hello',
+            password='password', port=self.server.port, engine='async',
+            jobs=3, **kwargs
+        )
+
+    def test__ssh_command__reuses_connections(self):
+        command = self.command(connection_pool=True)
+        for _ in range(3):
+            command.run()
+            self.assertEqual([item.out_string() for item in command], ['hello\n'] * 3)
+        self.assertEqual(self.server.connections, 3)
+        self.assertEqual(len(command.connection_pool), 3)
+        command.connection_pool.close()
+        self.assertEqual(len(command.connection_pool), 0)
+
+    def test__ssh_command__without_pool(self):
+        command = self.command()
+        command.run()
+        command.run()
+        self.assertEqual(self.server.connections, 6)
+
+    def test__run_command__legacy_tuple(self):
+        legacy = (
+            self.server.host, 'echo hello', None, 'password', False, None, 5,
+            None, None
+        )
+        # The 9 item tuple of older callers, it connects to port 22
+        result = sshmap.run_command(legacy)
+        self.assertEqual(result.host, self.server.host)
+        self.assertEqual(result.command, 'echo hello')
+        # With the port it grew next
+        result = sshmap.run_command(legacy + (self.server.port,))
+        self.assertEqual(result.out_string(), 'hello\n')
+
+    def test__pool__max_age(self):
+        pool = sshmap.ConnectionPool(max_age=0.01)
+        pool.evict_interval = 0
+        command = self.command(connection_pool=pool)
+        command.run()
+        time.sleep(0.02)
+        pool.evict()
+        self.assertEqual(len(pool), 0)
+        command.run()
+        self.assertEqual(self.server.connections, 6)
+
+    def test__pool__process_engine(self):
+        with self.assertRaises(ValueError):
+            sshmap.run(
+                self.server.host, 'echo hello', port=self.server.port,
+                connection_pool=sshmap.ConnectionPool()
+            )
+
+
+if __name__ == '__main__':
+    unittest.main()
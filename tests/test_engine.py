@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+# Copyright (c) 2010-2015, Yahoo Inc.
+# Copyrights licensed under the Apache 2.0 License
+# See the accompanying LICENSE.txt file for terms.
+"""
+Unit tests of the sshmap execution engines
+"""
+import functools
+import multiprocessing
+import time
+import unittest
+import sshmap
+import sshmap.engine
+from sshserver import SSHServer
+
+
+def double(value):
+    return value * 2
+
+
+def multiply(value, factor=1):
+    return value * factor
+
+
+def sleep_on_odd(value):
+    if value % 2:
+        time.sleep(10)
+    return value
+
+
+def sleep_on_zero(value):
+    if value == 0:
+        time.sleep(1)
+    return value
+
+
+def sleep_longer_on_odd(value):
+    time.sleep(10 if value % 2 else 0.5)
+    return value
+
+
+def wait_for_cancel(value):
+    # Everything but 0 runs until the engine is cancelled
+    cancel = sshmap.engine.cancel_event()
+    if value and cancel.wait(10):
+        return -value
+    return value
+
+
+class TestEngineMap(unittest.TestCase):
+
+    def test__process_engine__map(self):
+        engine = sshmap.engine.get_engine('process', jobs=2, chunksize=3)
+        result = sorted(engine.map(double, range(20)))
+        self.assertEqual(result, [i * 2 for i in range(20)])
+
+    def test__process_engine__map_ordered(self):
+        engine = sshmap.engine.get_engine('process', jobs=3, chunksize=2)
+        result = list(engine.map(double, range(20), ordered=True))
+        self.assertEqual(result, [i * 2 for i in range(20)])
+
+    def test__process_engine__map_partial(self):
+        engine = sshmap.engine.get_engine('process', jobs=2, chunksize=2)
+        func = functools.partial(multiply, factor=3)
+        result = list(engine.map(func, range(10), ordered=True))
+        self.assertEqual(result, [i * 3 for i in range(10)])
+
+    def test__async_engine__map_ordered(self):
+        engine = sshmap.engine.get_engine('async', jobs=5)
+        result = list(engine.map(double, range(50), ordered=True))
+        self.assertEqual(result, [i * 2 for i in range(50)])
+
+    def test__hybrid_engine__map_ordered(self):
+        engine = sshmap.engine.get_engine('hybrid', jobs=2, connections=6)
+        self.assertEqual(engine.threads, 3)
+        result = list(engine.map(double, range(50), ordered=True))
+        self.assertEqual(result, [i * 2 for i in range(50)])
+
+    def test__hybrid_engine__default_jobs(self):
+        engine = sshmap.engine.get_engine('hybrid', jobs=0)
+        self.assertEqual(engine.jobs, sshmap.engine.HybridEngine.default_jobs)
+        self.assertEqual(
+            engine.connections,
+            engine.jobs * sshmap.defaults.CONNECTIONS_PER_WORKER
+        )
+
+    def test__async_engine__default_jobs(self):
+        engine = sshmap.engine.get_engine('async', jobs=0)
+        self.assertEqual(engine.jobs, sshmap.defaults.ASYNC_CONNECTIONS)
+        self.assertEqual(engine.capacity, sshmap.defaults.ASYNC_CONNECTIONS)
+
+    def test__process_engine__worker_stats(self):
+        engine = sshmap.engine.get_engine('process', jobs=2, chunksize=5)
+        result = sorted(engine.map(double, range(30)))
+        self.assertEqual(result, [i * 2 for i in range(30)])
+        self.assertEqual(
+            [stats['worker'] for stats in engine.worker_stats], [0, 1]
+        )
+        self.assertEqual(
+            sum(stats['tasks'] for stats in engine.worker_stats), 30
+        )
+        for stats in engine.worker_stats:
+            self.assertTrue(0 <= stats['utilization'] <= 1)
+
+    def test__process_engine__batch_size(self):
+        engine = sshmap.engine.get_engine('process', jobs=2, chunksize=8)
+        self.assertEqual(engine.batch_size, 1)
+        engine._task_time = 0.001
+        self.assertEqual(engine.batch_size, 8)
+        engine._task_time = sshmap.engine.BATCH_TIME / 3
+        self.assertEqual(engine.batch_size, 3)
+        engine._task_time = 10
+        self.assertEqual(engine.batch_size, 1)
+
+    def test__queue_worker__returns_tasks_behind_slow_task(self):
+        tasks = multiprocessing.Queue()
+        results = multiprocessing.Queue()
+        tasks.put([(0, 0), (1, 1), (2, 2)])
+        tasks.put(None)
+        worker = multiprocessing.Process(
+            target=sshmap.engine._queue_worker,
+            args=(0, sleep_on_zero, tasks, results, 1, None, 0.2)
+        )
+        worker.start()
+        messages = [results.get(timeout=10)]
+        while messages[-1][0] != 'stats':
+            messages.append(results.get(timeout=10))
+        worker.join()
+        self.assertEqual(messages[0], ('requeue', [(1, 1), (2, 2)]))
+        self.assertEqual(messages[1][:3], ('done', 0, 0))
+        stats = messages[-1][1]
+        self.assertEqual(stats['tasks'], 1)
+        self.assertEqual(stats['returned'], 2)
+
+    def test__map__deadline(self):
+        for name in ['process', 'async', 'hybrid']:
+            engine = sshmap.engine.get_engine(name, jobs=2, connections=2)
+            start = time.time()
+            result = list(engine.map(
+                sleep_on_odd, range(6), ordered=True,
+                deadline=sshmap.engine.clock() + 1, expired=lambda value: -value
+            ))
+            self.assertLess(time.time() - start, 5)
+            self.assertEqual(result[0], 0)
+            self.assertEqual(result[1], -1)
+            self.assertEqual(result[5], -5)
+
+    def test__map__cancel(self):
+        for name in ['process', 'async', 'hybrid']:
+            engine = sshmap.engine.get_engine(name, jobs=2, connections=2)
+            start = time.time()
+            result = []
+            for value in engine.map(wait_for_cancel, range(20)):
+                result.append(value)
+                engine.cancel()
+            self.assertLess(time.time() - start, 5)
+            self.assertIn(0, result)
+            self.assertTrue(all(value <= 0 for value in result))
+            self.assertTrue(engine.not_started)
+            self.assertEqual(
+                sorted([abs(value) for value in result] + engine.not_started),
+                list(range(20))
+            )
+
+    def test__map__cancel_grace(self):
+        engine = sshmap.engine.get_engine('async', jobs=2)
+        start = time.time()
+        result = []
+        for value in engine.map(
+                sleep_longer_on_odd, range(6), ordered=True,
+                cancelled=lambda value: -value
+        ):
+            result.append(value)
+            engine.cancel()
+        self.assertLess(time.time() - start, 5)
+        self.assertEqual(result, [0, -1])
+        self.assertEqual(engine.not_started, [2, 3, 4, 5])
+
+    def test__get_engine__invalid(self):
+        with self.assertRaises(ValueError):
+            sshmap.engine.get_engine('invalid')
+
+
+class TestEngineSSH(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = SSHServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def run_hosts(self, engine, count=5, **kwargs):
+        return sshmap.run(
+            ','.join([self.server.host] * count), 'echo hello',
+            password='password', port=self.server.port, jobs=3,
+            engine=engine, **kwargs
+        )
+
+    def test__run__async_engine(self):
+        result = self.run_hosts('async')
+        self.assertEqual(len(result), 5)
+        for item in result:
+            self.assertEqual(item.ssh_retcode, sshmap.defaults.RUN_OK)
+            self.assertEqual(item.out_string(), 'hello\n')
+        self.assertEqual(result.parm['completed_host_count'], 5)
+        self.assertEqual(result.parm['failures'], [])
+
+    def test__run__process_engine(self):
+        result = self.run_hosts('process')
+        self.assertEqual([item.out_string() for item in result], ['hello\n'] * 5)
+        for item in result:
+            self.assertIs(item.parm, result.parm)
+
+    def test__run__hybrid_engine(self):
+        result = self.run_hosts('hybrid', count=8, connections=4, sort=True)
+        self.assertEqual([item.out_string() for item in result], ['hello\n'] * 8)
+
+    def test__run__async_engine__callbacks(self):
+        result = self.run_hosts(
+            'async', output_callback=[
+                sshmap.callback.summarize_failures,
+                sshmap.callback.aggregate_output
+            ]
+        )
+        self.assertEqual(len(result.setting('aggregate_hosts')), 1)
+
+    def test__ssh_command__async_engine(self):
+        command = sshmap.SSHCommand(
+            self.server.host, 'echo $((1+1)); exit 3', password='password',
+            port=self.server.port, engine='async'
+        )
+        command.run()
+        self.assertEqual(command[0].out_string(), '2\n')
+        self.assertEqual(command[0].retcode, 3)
+
+    def test__ssh_command__init_client(self):
+        command = sshmap.SSHCommand(
+            self.server.host, 'echo hello', password='password',
+            port=self.server.port
+        )
+        self.assertIsInstance(command.client, sshmap.sshmap.fastSSHClient)
+        command.init_client()
+        command.run()
+        self.assertEqual(command[0].out_string(), 'hello\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# Copyright (c) 2010-2015, Yahoo Inc.
+# Copyrights licensed under the Apache 2.0 License
+# See the accompanying LICENSE.txt file for terms.
+"""
+Unit tests of the host list expansion
+"""
+import unittest
+try:
+    from unittest import mock
+except ImportError:  # pragma: no cover
+    import mock
+import hostlists
+import sshmap
+from sshmap.hosts import HostList
+
+
+class TestHostList(unittest.TestCase):
+
+    def test__host_list__range(self):
+        hosts = HostList('foo[1-3],bar')
+        self.assertEqual(list(hosts), ['foo1', 'foo2', 'foo3', 'bar'])
+        self.assertEqual(len(hosts), 4)
+        self.assertEqual(hosts[3], 'bar')
+
+    def test__host_list__lazy(self):
+        consumed = []
+
+        def generate():
+            for i in range(100):
+                consumed.append(i)
+                yield 'host%d' % i
+
+        hosts = HostList(generate())
+        self.assertEqual(hosts.count_at_least(5), 5)
+        self.assertEqual(len(consumed), 5)
+        first = []
+        for host in hosts:
+            first.append(host)
+            if len(first) == 7:
+                break
+        self.assertEqual(len(consumed), 7)
+        self.assertEqual(len(hosts), 100)
+        self.assertEqual(list(hosts)[:7], first)
+
+    def test__host_list__expands_range_once(self):
+        with mock.patch.object(
+            hostlists, 'expand', side_effect=hostlists.expand
+        ) as expand:
+            hosts = HostList('foo[1-5],bar[1-5]')
+            self.assertEqual(hosts.count_at_least(3), 3)
+            self.assertEqual(expand.call_count, 1)
+            list(hosts)
+            list(hosts)
+            len(hosts)
+            self.assertEqual(expand.call_count, 2)
+
+    def test__host_list__shuffle_fixed_order(self):
+        hosts = HostList('foo[1-50]', shuffle=True)
+        self.assertEqual(list(hosts), list(hosts))
+        self.assertEqual(sorted(hosts), sorted(HostList('foo[1-50]')))
+
+    def test__host_list__empty(self):
+        self.assertFalse(HostList([]))
+        self.assertTrue(HostList(['foo']))
+
+
+class TestSSHCommandHosts(unittest.TestCase):
+
+    def test__ssh_command__hosts_memoized(self):
+        command = sshmap.SSHCommand('foo[1-100]', 'true', shuffle=True, jobs=4)
+        self.assertIs(command.hosts, command.hosts)
+        order = list(command.hosts)
+        self.assertEqual(command.jobs, 4)
+        self.assertEqual(command.chunksize, 10)
+        self.assertEqual(list(command.hosts), order)
+
+    def test__ssh_command__jobs_few_hosts(self):
+        command = sshmap.SSHCommand('foo[1-3]', 'true', jobs=10)
+        self.assertEqual(command.jobs, 3)
+        self.assertEqual(command.chunksize, 1)
+
+    def test__ssh_command__default_jobs_expand_ahead(self):
+        consumed = []
+
+        def generate():
+            for i in range(20000):
+                consumed.append(i)
+                yield 'host%d' % i
+
+        command = sshmap.SSHCommand(generate(), 'true')
+        command.reset_parm()
+        self.assertEqual(command.jobs, command._jobs)
+        self.assertLessEqual(command.chunksize, 10)
+        self.assertLessEqual(len(consumed), sshmap.defaults.EXPAND_AHEAD)
+
+    def test__ssh_command__chunksize(self):
+        command = sshmap.SSHCommand('foo[1-100]', 'true', jobs=4, chunksize=50)
+        self.assertEqual(command.chunksize, 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
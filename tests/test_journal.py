@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# Copyright (c) 2010-2015, Yahoo Inc.
+# Copyrights licensed under the Apache 2.0 License
+# See the accompanying LICENSE.txt file for terms.
+"""
+Unit tests of the checkpoint journal of runs
+"""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import sshmap
+from sshmap.journal import Journal
+from sshserver import SSHServer
+
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, 'run.journal')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def record(self, host, retcode=0, ssh_ret=sshmap.defaults.RUN_OK):
+        with Journal(self.path, resume=True) as journal:
+            journal.record(sshmap.sshmap.ssh_result(
+                out=['%s\n' % host], host=host, retcode=retcode,
+                ssh_ret=ssh_ret, command='hostname'
+            ))
+
+    def test__record__reload(self):
+        self.record('host1')
+        self.record('host2', retcode=1)
+        journal = Journal(self.path, resume=True)
+        self.assertEqual(len(journal), 2)
+        result = journal.results('host1')[0]
+        self.assertEqual(result.out_string(), 'host1\n')
+        self.assertEqual(result.command, 'hostname')
+        self.assertEqual(journal.results('host2')[0].retcode, 1)
+        journal.close()
+
+    def test__truncated_line_ignored(self):
+        self.record('host1')
+        with open(self.path, 'a') as handle:
+            handle.write('{"host": "host2", "res')
+        with Journal(self.path, resume=True) as journal:
+            self.assertEqual(journal.done(), set(['host1']))
+
+    def test__not_resumed_starts_over(self):
+        self.record('host1')
+        with Journal(self.path) as journal:
+            self.assertEqual(len(journal), 0)
+        self.assertEqual(os.path.getsize(self.path), 0)
+
+    def test__split__rerun_failed(self):
+        self.record('host1')
+        self.record('host2', ssh_ret=sshmap.defaults.RUN_FAIL_CONNECT)
+        hosts = ['host1', 'host2', 'host3', 'host1']
+        with Journal(self.path, resume=True) as journal:
+            pending, resumed = journal.split(hosts)
+            self.assertEqual(pending, ['host3'])
+            self.assertEqual(
+                [results[0].host for results in resumed], ['host1', 'host2']
+            )
+            pending, resumed = journal.split(hosts, rerun_failed=True)
+            self.assertEqual(pending, ['host2', 'host3'])
+            self.assertEqual(len(resumed), 1)
+
+
+class TestJournalSSH(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = SSHServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, 'run.journal')
+        # A host finished by an earlier run, it doesn't exist so resuming
+        # can't run it again
+        with Journal(self.path) as journal:
+            journal.record(sshmap.sshmap.ssh_result(
+                out=['earlier\n'], host='done.invalid', command='echo hello'
+            ))
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test__run__records_hosts(self):
+        results = sshmap.run(
+            self.server.host, 'echo hello', password='password',
+            port=self.server.port, journal=self.path, output_callback=[]
+        )
+        self.assertEqual(results[0].out_string(), 'hello\n')
+        with open(self.path) as handle:
+            entries = [json.loads(line) for line in handle]
+        self.assertEqual([entry['host'] for entry in entries], [self.server.host])
+        self.assertEqual(entries[0]['results'][0]['out'], 'hello\n')
+
+    def test__run__resume(self):
+        results = sshmap.run(
+            'done.invalid,%s' % self.server.host, 'echo hello',
+            password='password', port=self.server.port, journal=self.path,
+            resume=True, output_callback=[]
+        )
+        self.assertEqual(
+            [result.out_string() for result in results],
+            ['earlier\n', 'hello\n']
+        )
+        self.assertEqual(results.parm['resumed_host_count'], 1)
+        self.assertEqual(results.parm['completed_host_count'], 2)
+        self.assertEqual(results.metrics.pending, 0)
+        with Journal(self.path, resume=True) as journal:
+            self.assertEqual(
+                journal.done(), set(['done.invalid', self.server.host])
+            )
+
+    def resume_failed(self, run):
+        with Journal(self.path, resume=True) as journal:
+            journal.record(sshmap.sshmap.ssh_result(
+                out=['failed\n'], host='failed.invalid', retcode=1,
+                command='echo hello'
+            ))
+        # The first host to create the directory fails, the other one runs
+        # until it is cancelled
+        command = 'mkdir %s 2>/dev/null && exit 1; sleep 10' % (
+            os.path.join(self.tempdir, 'failed')
+        )
+        return run(
+            'failed.invalid,127.0.0.1,localhost', command,
+            password='password', port=self.server.port, journal=self.path,
+            resume=True, exit_on_error=True, jobs=2, output_callback=[]
+        )
+
+    def check_resume_failed(self, results):
+        # The replayed failure doesn't cancel the run, the new one does
+        self.assertEqual(
+            sorted(result.ssh_retcode for result in results), [
+                sshmap.defaults.RUN_OK, sshmap.defaults.RUN_OK,
+                sshmap.defaults.RUN_CANCELLED
+            ]
+        )
+        self.assertEqual(
+            sorted(result.retcode for result in results)[-2:], [1, 1]
+        )
+
+    def test__run__resume_failed__exit_on_error(self):
+        self.check_resume_failed(self.resume_failed(sshmap.run))
+
+    def test__ssh_command__resume_failed__exit_on_error(self):
+        def run(*args, **kwargs):
+            command = sshmap.SSHCommand(*args, **kwargs)
+            command.run()
+            return command
+        self.check_resume_failed(self.resume_failed(run))
+
+    def test__run__deadline_not_recorded(self):
+        results = sshmap.run(
+            self.server.host, 'sleep 5', password='password',
+            port=self.server.port, journal=self.path, deadline=1,
+            output_callback=[]
+        )
+        self.assertTrue(results[0].expired)
+        with Journal(self.path, resume=True) as journal:
+            # The expired host runs again on resume
+            self.assertEqual(journal.done(), set())
+
+    def test__ssh_command__resume(self):
+        command = sshmap.SSHCommand(
+            'done.invalid,%s' % self.server.host, 'echo hello',
+            password='password', port=self.server.port, journal=self.path,
+            resume=True, output_callback=[]
+        )
+        command.run()
+        self.assertEqual(
+            sorted(result.host for result in command),
+            sorted(['done.invalid', self.server.host])
+        )
+        self.assertEqual(command.parm['resumed_host_count'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
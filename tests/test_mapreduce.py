@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# Copyright (c) 2010-2015, Yahoo Inc.
+# Copyrights licensed under the Apache 2.0 License
+# See the accompanying LICENSE.txt file for terms.
+"""
+Unit tests of the map reduce of results
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import sshmap
+from sshmap.mapreduce import Count, Histogram, MapReduce, SetUnion, TopK
+from sshserver import SSHServer
+
+
+def result(host, out, retcode=0):
+    return sshmap.sshmap.ssh_result([out], [], host, retcode=retcode)
+
+
+def failed(result):
+    return result.retcode != 0
+
+
+def run_host(host):
+    return result(host, 'kernel-%s\n' % host[-1])
+
+
+class TestReducers(unittest.TestCase):
+
+    def reduce(self, reducer, results):
+        mapreduce = MapReduce({'value': reducer})
+        for item in results:
+            mapreduce.combine(item)
+        return mapreduce.results()['value']
+
+    def test__count(self):
+        results = [result('a', 'x'), result('b', 'y', retcode=1)]
+        self.assertEqual(self.reduce(Count(), results), 2)
+        self.assertEqual(self.reduce(Count(map=failed), results), 1)
+
+    def test__histogram(self):
+        results = [result('a', 'x\n'), result('b', 'y\n'), result('c', 'x\n')]
+        self.assertEqual(
+            dict(self.reduce(Histogram(), results)), {'x': 2, 'y': 1}
+        )
+
+    def test__top_k(self):
+        results = [
+            result(host, out)
+            for host, out in [('a', 'x'), ('b', 'y'), ('c', 'x'), ('d', 'z')]
+        ]
+        self.assertEqual(self.reduce(TopK(1), results), [('x', 2)])
+
+    def test__set_union(self):
+        results = [result('a', 'x\ny\n'), result('b', 'y\nz\n')]
+        self.assertEqual(
+            self.reduce(SetUnion(), results), set(['x', 'y', 'z'])
+        )
+
+    def test__worker_function(self):
+        mapreduce = MapReduce({'kernels': Histogram()})
+        worker = mapreduce.worker_function(run_host)
+        item = worker('host1')
+        self.assertEqual(item.records, {'kernels': 'kernel-1'})
+        self.assertEqual(item.out_string(), '')
+        mapreduce.combine(item)
+        mapreduce.combine(worker('host1'))
+        self.assertEqual(
+            dict(mapreduce.results()['kernels']), {'kernel-1': 2}
+        )
+
+
+class TestMapReduceSSH(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = SSHServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def test__run__reducers(self):
+        results = sshmap.run(
+            self.server.host, 'echo hello', password='password',
+            port=self.server.port, output_callback=[],
+            reducers={'hosts': Count(), 'output': TopK(5)}
+        )
+        self.assertEqual(
+            results.parm['reduced'], {'hosts': 1, 'output': [('hello', 1)]}
+        )
+        self.assertEqual(results[0].out_string(), '')
+
+    def test__ssh_command__reducers(self):
+        command = sshmap.SSHCommand(
+            self.server.host, 'echo hello', password='password',
+            port=self.server.port, output_callback=[],
+            reducers=MapReduce({'output': SetUnion()}, keep_output=True)
+        )
+        command.run()
+        self.assertEqual(command.parm['reduced'], {'output': set(['hello'])})
+        self.assertEqual(command[0].out_string(), 'hello\n')
+
+    def test__run__resume_records(self):
+        tempdir = tempfile.mkdtemp()
+        path = os.path.join(tempdir, 'run.journal')
+        try:
+            for resume in [False, True]:
+                results = sshmap.run(
+                    self.server.host, 'echo hello', password='password',
+                    port=self.server.port, output_callback=[],
+                    journal=path, resume=resume,
+                    reducers={'output': Histogram()}
+                )
+            self.assertEqual(results.parm['resumed_host_count'], 1)
+            self.assertEqual(
+                dict(results.parm['reduced']['output']), {'hello': 1}
+            )
+        finally:
+            shutil.rmtree(tempdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
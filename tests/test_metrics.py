@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# Copyright (c) 2010-2015, Yahoo Inc.
+# Copyrights licensed under the Apache 2.0 License
+# See the accompanying LICENSE.txt file for terms.
+"""
+Unit tests of the live metrics of a run
+"""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+try:
+    from urllib.request import urlopen
+except ImportError:  # pragma: no cover
+    from urllib2 import urlopen
+import sshmap
+from sshmap.metrics import Histogram, MetricsServer, MetricsWriter, RunMetrics
+from sshmap.timing import PhaseTimings
+from sshserver import SSHServer
+
+
+def make_result(ssh_retcode=0, retcode=0, received=0):
+    result = sshmap.sshmap.ssh_result(
+        host='host', retcode=retcode, ssh_ret=ssh_retcode,
+        timings=PhaseTimings([0, 0.5, 1, 1.5, 2, 2.5, 3, 4])
+    )
+    result.received = received
+    return result
+
+
+class TestRunMetrics(unittest.TestCase):
+
+    def test__histogram__cumulative(self):
+        histogram = Histogram([1, 2])
+        for value in [0.5, 1.5, 1.7, 3]:
+            histogram.observe(value)
+        self.assertEqual(
+            histogram.cumulative(), [(1, 1), (2, 3), ('+Inf', 4)]
+        )
+        self.assertEqual(histogram.sum, 6.7)
+
+    def test__counts(self):
+        metrics = RunMetrics()
+        hosts = metrics.dispatch(['a', 'b', 'c'])
+        next(hosts)
+        next(hosts)
+        self.assertEqual(metrics.pending, 2)
+        metrics.complete([make_result(received=10)])
+        metrics.complete([
+            make_result(ssh_retcode=sshmap.defaults.RUN_FAIL_CONNECT),
+            make_result(retcode=1, received=5)
+        ])
+        self.assertEqual(metrics.pending, 0)
+        self.assertEqual(metrics.completed, 2)
+        self.assertEqual(metrics.failed, 1)
+        self.assertEqual(metrics.command_failures, 1)
+        self.assertEqual(metrics.received_bytes, 15)
+        self.assertEqual(metrics.results, {'Ok': 2, 'SSH Connection Failed': 1})
+        self.assertEqual(metrics.connect_seconds.count, 3)
+        self.assertEqual(metrics.connect_seconds.sum, 6)
+        self.assertEqual(metrics.exec_seconds.sum, 6)
+
+    def test__prometheus(self):
+        metrics = RunMetrics()
+        metrics.complete([make_result()])
+        text = metrics.prometheus()
+        self.assertIn('sshmap_hosts_completed_total 1\n', text)
+        self.assertIn('# TYPE sshmap_hosts_pending gauge\n', text)
+        self.assertIn('sshmap_results_total{status="Ok"} 1\n', text)
+        self.assertIn('sshmap_connect_seconds_bucket{le="2.5"} 1\n', text)
+        self.assertIn('sshmap_connect_seconds_count 1\n', text)
+
+
+class TestMetricsExport(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test__metrics_server(self):
+        metrics = RunMetrics()
+        metrics.complete([make_result()])
+        with MetricsServer(metrics, port=0) as server:
+            url = 'http://127.0.0.1:%d' % server.port
+            text = urlopen(url + '/metrics').read().decode()
+            snapshot = json.loads(urlopen(url + '/metrics.json').read().decode())
+        self.assertIn('sshmap_hosts_completed_total 1', text)
+        self.assertEqual(snapshot['completed'], 1)
+
+    def test__metrics_writer(self):
+        path = os.path.join(self.directory, 'metrics.jsonl')
+        metrics = RunMetrics()
+        writer = MetricsWriter(metrics, path, interval=0.05).start()
+        metrics.complete([make_result()])
+        writer.stop()
+        with open(path) as handle:
+            lines = [json.loads(line) for line in handle]
+        self.assertGreaterEqual(len(lines), 1)
+        self.assertEqual(lines[-1]['completed'], 1)
+
+
+class TestRunMetricsSSH(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = SSHServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def test__run__metrics(self):
+        metrics = RunMetrics()
+        results = sshmap.run(
+            ','.join([self.server.host] * 3), 'echo hello',
+            password='password', port=self.server.port, jobs=2,
+            metrics=metrics
+        )
+        self.assertIs(results.metrics, metrics)
+        self.assertEqual(metrics.hosts_total, 3)
+        self.assertEqual(metrics.dispatched, 3)
+        self.assertEqual(metrics.completed, 3)
+        self.assertEqual(metrics.results, {'Ok': 3})
+        self.assertEqual(metrics.received_bytes, 18)
+        self.assertEqual(metrics.exec_seconds.count, 3)
+
+    def test__ssh_command__metrics(self):
+        command = sshmap.SSHCommand(
+            ','.join([self.server.host] * 2), 'echo hello',
+            password='password', port=self.server.port, jobs=2,
+            output_callback=[]
+        )
+        command.run()
+        self.assertEqual(command.metrics.hosts_total, 2)
+        self.assertEqual(command.metrics.completed, 2)
+        self.assertEqual(command.metrics.pending, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
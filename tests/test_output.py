@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# Copyright (c) 2010-2015, Yahoo Inc.
+# Copyrights licensed under the Apache 2.0 License
+# See the accompanying LICENSE.txt file for terms.
+"""
+Unit tests of the compact output buffer of the results
+"""
+import io
+import pickle
+import unittest
+import sshmap
+import sshmap.sshmap
+from sshmap.output import OutputBuffer
+from sshserver import SSHServer
+
+
+class TestOutputBuffer(unittest.TestCase):
+
+    def test__output_buffer__lines(self):
+        output = OutputBuffer(['one\n', b'two\n', 'three'])
+        self.assertEqual(len(output), 3)
+        self.assertEqual(output[1], 'two\n')
+        self.assertEqual(output[-1], 'three')
+        self.assertEqual(output.tobytes(), b'one\ntwo\nthree')
+        self.assertEqual(output.text(), 'one\ntwo\nthree')
+        self.assertEqual(output, ['one\n', 'two\n', 'three'])
+
+    def test__output_buffer__split_string(self):
+        output = OutputBuffer('one\ntwo\n\nthree')
+        self.assertEqual(list(output), ['one\n', 'two\n', '\n', 'three'])
+
+    def test__output_buffer__append(self):
+        output = OutputBuffer(['one\n'])
+        self.assertEqual(output.text(), 'one\n')
+        output.append('two\n')
+        output.extend(['three\n', b'four\n'])
+        self.assertEqual(output.text(), 'one\ntwo\nthree\nfour\n')
+        self.assertEqual(len(output), 4)
+
+    def test__output_buffer__pickle(self):
+        output = OutputBuffer(['one\n', 'two\n'])
+        output.lines()
+        self.assertEqual(pickle.loads(pickle.dumps(output)), output)
+
+    def test__output_buffer__invalid_utf8(self):
+        output = OutputBuffer([b'ok\xff\n'])
+        self.assertEqual(output.text(), 'ok\n')
+
+
+class TestResultOutput(unittest.TestCase):
+
+    def test__result__assign_list(self):
+        result = sshmap.sshmap.ssh_result(['out\n'], ['err\n'], 'host')
+        self.assertIsInstance(result.out, OutputBuffer)
+        self.assertEqual(result.stdout, b'out\n')
+        self.assertEqual(str(result), 'out\nerr\n')
+        result.err = 'Sudo password required'
+        self.assertEqual(result.err_string(), 'Sudo password required')
+
+    def test__results__write(self):
+        results = sshmap.sshmap.ssh_results()
+        for host in ['host1', 'host2']:
+            results.append(sshmap.sshmap.ssh_result(['out\n'], [], host))
+        handle = io.StringIO()
+        results.write(handle)
+        self.assertEqual(handle.getvalue(), results._repr_text_() + '\n')
+        self.assertEqual(results.output, 'out\nout\n')
+
+    def test__result__slots(self):
+        result = sshmap.sshmap.ssh_result(['out\n'], [], 'host', retcode=2)
+        self.assertFalse(hasattr(result, '__dict__'))
+        self.assertFalse(hasattr(result.out, '__dict__'))
+        copy = pickle.loads(pickle.dumps(result))
+        self.assertEqual(copy.out_string(), 'out\n')
+        self.assertEqual(copy.retcode, 2)
+        self.assertEqual(copy.host, 'host')
+
+
+class TestRawOutput(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = SSHServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def test__run_command__invalid_utf8(self):
+        result = sshmap.run_command(
+            self.server.host, "printf 'ok\\377\\n'; printf '\\377' >&2",
+            password='password', port=self.server.port
+        )
+        self.assertEqual(result.ssh_retcode, sshmap.defaults.RUN_OK)
+        self.assertEqual(result.stdout, b'ok\xff\n')
+        self.assertEqual(result.out_string(), 'ok\n')
+        self.assertEqual(result.stderr, b'\xff')
+        self.assertEqual(list(result.out), ['ok\n'])
+
+
+if __name__ == '__main__':
+    unittest.main()
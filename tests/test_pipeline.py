@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# Copyright (c) 2010-2015, Yahoo Inc.
+# Copyrights licensed under the Apache 2.0 License
+# See the accompanying LICENSE.txt file for terms.
+"""
+Unit tests of the output callback pipeline
+"""
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import sshmap
+from sshmap.pipeline import CallbackPipeline, stateless
+from sshserver import SSHServer
+
+
+@stateless
+def slow_on_first(result):
+    if result.host == 'host0':
+        time.sleep(0.5)
+    return result
+
+
+@stateless
+def record_pid(result):
+    result.err = ['%d\n' % os.getpid()]
+    return result
+
+
+@stateless
+def read_setting(result):
+    result.out = ['%s\n' % result.setting('greeting')]
+    return result
+
+
+@stateless
+def log_host(result):
+    with open(result.setting('log'), 'a') as handle:
+        handle.write(result.host + '\n')
+    return result
+
+
+def count(result):
+    result.parm['count'] = result.parm.get('count', 0) + 1
+    return result
+
+
+def results(count_results=4):
+    return [
+        sshmap.sshmap.ssh_result(['out\n'], [], 'host%d' % index)
+        for index in range(count_results)
+    ]
+
+
+class TestCallbackPipeline(unittest.TestCase):
+
+    def test__stages(self):
+        callbacks = [
+            sshmap.callback.filter_json, slow_on_first, count,
+            sshmap.callback.flowthrough
+        ]
+        self.assertEqual(
+            CallbackPipeline(callbacks, mode='thread').stages(),
+            [(True, callbacks[:2]), (False, [count]), (True, callbacks[3:])]
+        )
+        self.assertEqual(
+            CallbackPipeline(callbacks).stages(), [(False, callbacks)]
+        )
+        pipeline = CallbackPipeline(callbacks, mode='worker')
+        self.assertEqual(pipeline.worker_callbacks(), callbacks[:2])
+        self.assertEqual(pipeline.stages(), [(False, callbacks[2:])])
+
+    def test__invalid_mode(self):
+        with self.assertRaises(ValueError):
+            CallbackPipeline([], mode='fibers')
+
+    def test__pool_needs_futures(self):
+        futures = sshmap.pipeline.concurrent
+        sshmap.pipeline.concurrent = None
+        try:
+            with self.assertRaises(ImportError):
+                CallbackPipeline([], mode='thread')
+            self.assertEqual(CallbackPipeline([], mode='worker').mode, 'worker')
+        finally:
+            sshmap.pipeline.concurrent = futures
+
+    def test__thread__ordered(self):
+        parm = {}
+        pipeline = CallbackPipeline([slow_on_first, count], mode='thread')
+        items = list(pipeline.run(iter(results()), parm))
+        self.assertEqual(
+            [item.host for item in items], ['host0', 'host1', 'host2', 'host3']
+        )
+        self.assertEqual(parm['count'], 4)
+
+    def test__thread__unordered(self):
+        pipeline = CallbackPipeline(
+            [slow_on_first], mode='thread', workers=2, ordered=False
+        )
+        items = list(pipeline.run(iter(results()), {}))
+        self.assertEqual(items[-1].host, 'host0')
+        self.assertEqual(len(items), 4)
+
+    def test__output_lines_pass_through(self):
+        line = sshmap.sshmap.OutputLine('host0', 'stdout', 'out\n')
+        pipeline = CallbackPipeline([record_pid], mode='thread')
+        items = list(pipeline.run(iter([line] + results(1)), {}))
+        self.assertEqual(items[0], line)
+
+    def test__process(self):
+        parm = {'greeting': 'hello'}
+        pipeline = CallbackPipeline(
+            [read_setting, record_pid, count], mode='process', workers=2
+        )
+        items = list(pipeline.run(iter(results()), parm))
+        self.assertEqual(
+            [item.out_string() for item in items], ['hello\n'] * 4
+        )
+        self.assertNotIn(
+            str(os.getpid()), [item.err_string().strip() for item in items]
+        )
+        self.assertTrue(all(item.parm is parm for item in items))
+        self.assertEqual(parm['count'], 4)
+
+
+class TestCallbackPipelineSSH(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = SSHServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def test__run__worker(self):
+        results = sshmap.run(
+            self.server.host, 'echo hello', password='password',
+            port=self.server.port, callback_mode='worker',
+            parms={'greeting': 'hi'},
+            output_callback=[read_setting, record_pid, count]
+        )
+        self.assertEqual(results[0].out_string(), 'hi\n')
+        self.assertNotEqual(
+            results[0].err_string().strip(), str(os.getpid())
+        )
+        self.assertEqual(results.parm['count'], 1)
+
+    def test__run__worker__retried_once(self):
+        tempdir = tempfile.mkdtemp()
+        log = os.path.join(tempdir, 'log')
+        try:
+            results = sshmap.run(
+                self.server.host, 'echo hello', password='password', port=1,
+                callback_mode='worker', parms={'log': log},
+                retry=sshmap.RetryPolicy(attempts=3, backoff=0.05),
+                output_callback=[log_host]
+            )
+            self.assertEqual(results[0].attempts, 3)
+            with open(log) as handle:
+                self.assertEqual(handle.read(), self.server.host + '\n')
+        finally:
+            shutil.rmtree(tempdir, ignore_errors=True)
+
+    def test__ssh_command__thread(self):
+        command = sshmap.SSHCommand(
+            self.server.host, 'echo hello', password='password',
+            port=self.server.port, callback_mode='thread',
+            output_callback=[
+                sshmap.callback.filter_json,
+                sshmap.callback.summarize_failures
+            ]
+        )
+        command.run()
+        self.assertEqual(
+            [result.out_string() for result in command],
+            ['[["hello\\n"], [], 0]']
+        )
+        self.assertEqual(command.parm['failures'], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# Copyright (c) 2010-2015, Yahoo Inc.
+# Copyrights licensed under the Apache 2.0 License
+# See the accompanying LICENSE.txt file for terms.
+"""
+Unit tests of the rate limiting of new connections
+"""
+import multiprocessing
+import time
+import unittest
+import sshmap
+from sshmap.ratelimit import ConnectRateLimiter, TokenBucket, \
+    get_rate_limiter, parse_limits
+from sshserver import SSHServer
+
+
+def reserve_tokens(bucket, count, waits):
+    waits.put([bucket.reserve() for _ in range(count)])
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test__reserve__burst(self):
+        bucket = TokenBucket(10, burst=2)
+        waits = [bucket.reserve() for _ in range(4)]
+        self.assertEqual(waits[:2], [0, 0])
+        self.assertAlmostEqual(waits[2], 0.1, places=2)
+        self.assertAlmostEqual(waits[3], 0.2, places=2)
+
+    def test__reserve__shared_by_processes(self):
+        bucket = TokenBucket(10)
+        waits = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(
+                target=reserve_tokens, args=(bucket, 5, waits)
+            )
+            for _ in range(2)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        waits = waits.get() + waits.get()
+        # The 10 tokens are spaced 0.1 seconds apart over both processes
+        self.assertAlmostEqual(max(waits), 0.9, places=1)
+        self.assertAlmostEqual(bucket.reserve(), 1, places=1)
+
+    def test__invalid_rate(self):
+        with self.assertRaises(ValueError):
+            TokenBucket(0)
+
+
+class TestConnectRateLimiter(unittest.TestCase):
+
+    def test__buckets__matching(self):
+        limiter = ConnectRateLimiter(
+            rate=100, limits={'10.1.0.0/16': 5, 'web*': 2}
+        )
+        subnet, pattern = [bucket for _, _, bucket in limiter.limits]
+        self.assertEqual(
+            limiter.buckets('db1', '10.1.2.3'), [subnet, limiter.bucket]
+        )
+        self.assertEqual(
+            limiter.buckets('10.1.2.3'), [subnet, limiter.bucket]
+        )
+        self.assertEqual(
+            limiter.buckets('web1', '10.2.0.1'), [pattern, limiter.bucket]
+        )
+        self.assertEqual(
+            limiter.buckets('db1', 'fe80::1%eth0'), [limiter.bucket]
+        )
+
+    def test__acquire__waits_for_slowest_bucket(self):
+        limiter = ConnectRateLimiter(rate=100, limits={'web*': 5})
+        self.assertEqual(limiter.acquire('web1'), 0)
+        start = time.time()
+        self.assertAlmostEqual(limiter.acquire('web2'), 0.2, places=2)
+        self.assertGreaterEqual(time.time() - start, 0.19)
+        self.assertEqual(limiter.acquire('db1'), 0)
+
+    def test__parse_limits(self):
+        self.assertEqual(
+            parse_limits(['10.1.0.0/16=5', 'web*=2,db*=1']),
+            {'10.1.0.0/16': 5, 'web*': 2, 'db*': 1}
+        )
+        with self.assertRaises(ValueError):
+            parse_limits(['web*'])
+
+    def test__get_rate_limiter(self):
+        self.assertIsNone(get_rate_limiter())
+        limiter = get_rate_limiter(10)
+        self.assertIs(get_rate_limiter(limiter), limiter)
+        self.assertEqual(get_rate_limiter(limits={'web*': 1}).bucket, None)
+
+
+class TestRateLimitSSH(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = SSHServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def test__run__connect_rate(self):
+        start = time.time()
+        results = sshmap.run(
+            ','.join([self.server.host] * 4), 'echo hello',
+            password='password', port=self.server.port, jobs=4,
+            connect_rate=5
+        )
+        self.assertGreaterEqual(time.time() - start, 0.6)
+        self.assertEqual(
+            [result.ssh_retcode for result in results],
+            [sshmap.defaults.RUN_OK] * 4
+        )
+        # The wait for the rate limit isn't part of the dns lookup
+        for result in results:
+            self.assertLess(result.timings.durations()['dns'], 0.1)
+
+    def test__ssh_command__connect_limits(self):
+        command = sshmap.SSHCommand(
+            ','.join([self.server.host] * 3), 'echo hello',
+            password='password', port=self.server.port, jobs=3,
+            engine='async', connect_limits={'127.0.0.0/8': 5},
+            output_callback=[]
+        )
+        start = time.time()
+        command.run()
+        self.assertGreaterEqual(time.time() - start, 0.4)
+        self.assertEqual(len(command), 3)
+        self.assertIsNotNone(command.rate_limiter)
+
+
+if __name__ == '__main__':
+    unittest.main()
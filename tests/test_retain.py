@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# Copyright (c) 2010-2015, Yahoo Inc.
+# Copyrights licensed under the Apache 2.0 License
+# See the accompanying LICENSE.txt file for terms.
+"""
+Unit tests of the result retain policies and the result store
+"""
+import os
+import unittest
+import sshmap
+import sshmap.sshmap
+from sshserver import SSHServer
+
+
+def make_results(retain, count=5):
+    results = sshmap.sshmap.ssh_results()
+    results.retain = retain
+    for i in range(count):
+        results.add(
+            sshmap.sshmap.ssh_result(
+                ['out %d\n' % i], ['err\n'], 'host%d' % i, retcode=i % 2
+            )
+        )
+    results.order_retained()
+    return results
+
+
+class TestRetain(unittest.TestCase):
+
+    def test__retain__all(self):
+        self.assertEqual(len(make_results('all')), 5)
+
+    def test__retain__none(self):
+        self.assertEqual(len(make_results('none')), 0)
+
+    def test__retain__failures(self):
+        results = make_results('failures')
+        self.assertEqual([item.host for item in results], ['host1', 'host3'])
+
+    def test__retain__last(self):
+        results = make_results(2)
+        self.assertEqual([item.host for item in results], ['host3', 'host4'])
+
+    def test__retain__last__wraps(self):
+        for count in range(8):
+            results = make_results(3, count=count)
+            self.assertEqual(
+                [item.host for item in results],
+                ['host%d' % i for i in range(max(count - 3, 0), count)]
+            )
+
+    def test__retain__disk(self):
+        results = make_results('disk')
+        path = results.store.path
+        self.assertTrue(os.path.exists(path))
+        self.assertIsInstance(results[2].out, sshmap.store.StoredLines)
+        self.assertEqual(list(results[2].out), ['out 2\n'])
+        self.assertEqual(results[2].out_string(), 'out 2\n')
+        self.assertEqual(results[2].err_string(), 'err\n')
+        results.store.close()
+        self.assertFalse(os.path.exists(path))
+
+    def test__run__sudo_without_password(self):
+        hosts = ['host%d' % index for index in range(5)]
+        for retain, kept in [('none', []), (2, hosts[3:])]:
+            results = sshmap.run(hosts, 'id', sudo=True, retain=retain)
+            self.assertEqual([item.host for item in results], kept)
+
+    def test__check_retain__invalid(self):
+        for retain in ['invalid', 0, True]:
+            with self.assertRaises(ValueError):
+                sshmap.sshmap.check_retain(retain)
+
+
+class TestRetainRun(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = SSHServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def test__run__retain_none(self):
+        seen = []
+
+        def count(result):
+            seen.append(result.out_string())
+            return result
+
+        result = sshmap.run(
+            ','.join([self.server.host] * 4), 'echo hello', password='password',
+            port=self.server.port, engine='async', retain='none',
+            output_callback=[sshmap.callback.summarize_failures, count]
+        )
+        self.assertEqual(len(result), 0)
+        self.assertEqual(seen, ['hello\n'] * 4)
+        self.assertEqual(result.parm['completed_host_count'], 4)
+
+    def test__ssh_command__retain_disk(self):
+        command = sshmap.SSHCommand(
+            ','.join([self.server.host] * 3), 'echo hello', password='password',
+            port=self.server.port, engine='async', retain='disk'
+        )
+        command.run()
+        self.assertEqual(command.output, 'hello\n' * 3)
+        command.store.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# Copyright (c) 2010-2015, Yahoo Inc.
+# Copyrights licensed under the Apache 2.0 License
+# See the accompanying LICENSE.txt file for terms.
+"""
+Unit tests of the retries of transient failures
+"""
+import unittest
+import sshmap
+from sshmap.retry import RetryPolicy, get_retry_policy
+from sshserver import SSHServer
+
+
+def make_result(ssh_retcode):
+    return sshmap.sshmap.ssh_result(host='host', ssh_ret=ssh_retcode)
+
+
+class TestRetryPolicy(unittest.TestCase):
+
+    def test__delay__exponential(self):
+        policy = RetryPolicy(backoff=1, max_backoff=5, jitter=0)
+        self.assertEqual(
+            [policy.delay(attempt) for attempt in range(1, 5)], [1, 2, 4, 5]
+        )
+
+    def test__delay__jitter(self):
+        policy = RetryPolicy(backoff=2, jitter=0.5)
+        for _ in range(100):
+            self.assertTrue(1 <= policy.delay(1) <= 2)
+
+    def test__call__attempts(self):
+        policy = RetryPolicy(attempts=2, jitter=0)
+        result = make_result(sshmap.defaults.RUN_FAIL_CONNECT)
+        self.assertEqual(policy(result, 1), 1)
+        self.assertEqual(result.attempts, 1)
+        self.assertIsNone(policy(result, 2))
+        self.assertEqual(result.attempts, 2)
+
+    def test__call__not_retryable(self):
+        policy = RetryPolicy()
+        self.assertIsNone(policy(make_result(sshmap.defaults.RUN_OK), 1))
+        self.assertIsNone(policy(make_result(sshmap.defaults.RUN_FAIL_AUTH), 1))
+        results = [
+            make_result(sshmap.defaults.RUN_OK),
+            make_result(sshmap.defaults.RUN_FAIL_TIMEOUT)
+        ]
+        self.assertIsNotNone(policy(results, 1))
+        self.assertEqual([result.attempts for result in results], [1, 1])
+
+    def test__get_retry_policy(self):
+        self.assertIsNone(get_retry_policy())
+        self.assertIsNone(get_retry_policy(1))
+        self.assertEqual(get_retry_policy(4).attempts, 4)
+        policy = RetryPolicy()
+        self.assertIs(get_retry_policy(policy), policy)
+
+
+class TestEngineRetry(unittest.TestCase):
+
+    def test__map__retry_at_back_of_queue(self):
+        calls = []
+
+        def flaky(value):
+            calls.append(value)
+            if value == 0 and calls.count(0) < 3:
+                return make_result(sshmap.defaults.RUN_FAIL_CONNECT)
+            return make_result(sshmap.defaults.RUN_OK)
+
+        engine = sshmap.engine.get_engine('async', jobs=1)
+        results = list(engine.map(
+            flaky, range(3), ordered=True,
+            retry=RetryPolicy(attempts=5, backoff=0.05)
+        ))
+        self.assertEqual(
+            [result.attempts for result in results], [3, 1, 1]
+        )
+        self.assertEqual(results[0].ssh_retcode, sshmap.defaults.RUN_OK)
+        # The first retry waits for its backoff behind the other tasks
+        self.assertEqual(calls[:3], [0, 1, 2])
+
+    def test__map__retry_deadline(self):
+        engine = sshmap.engine.get_engine('async', jobs=1)
+        results = list(engine.map(
+            lambda value: make_result(sshmap.defaults.RUN_FAIL_CONNECT),
+            range(2), deadline=sshmap.engine.clock() + 0.5,
+            retry=RetryPolicy(attempts=100, backoff=0.1, jitter=0)
+        ))
+        self.assertEqual(len(results), 2)
+        for result in results:
+            self.assertEqual(
+                result.ssh_retcode, sshmap.defaults.RUN_FAIL_CONNECT
+            )
+            self.assertLess(result.attempts, 5)
+
+
+class TestRetrySSH(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = SSHServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def test__run__retry_connect_failure(self):
+        results = sshmap.run(
+            self.server.host, 'echo hello', password='password', port=1,
+            retry=RetryPolicy(attempts=3, backoff=0.05)
+        )
+        self.assertEqual(
+            results[0].ssh_retcode, sshmap.defaults.RUN_FAIL_CONNECT
+        )
+        self.assertEqual(results[0].attempts, 3)
+        self.assertEqual(results.metrics.retries, 2)
+
+    def test__ssh_command__no_retry_on_success(self):
+        command = sshmap.SSHCommand(
+            ','.join([self.server.host] * 2), 'echo hello',
+            password='password', port=self.server.port, jobs=2, retry=3,
+            output_callback=[]
+        )
+        command.run()
+        self.assertEqual([result.attempts for result in command], [1, 1])
+        self.assertEqual(command.metrics.retries, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
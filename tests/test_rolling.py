@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# Copyright (c) 2010-2015, Yahoo Inc.
+# Copyrights licensed under the Apache 2.0 License
+# See the accompanying LICENSE.txt file for terms.
+"""
+Unit tests of rolling runs in stages
+"""
+import unittest
+import sshmap
+from sshmap.rolling import parse_stages, stage_sizes
+from sshserver import SSHServer
+
+
+class TestStages(unittest.TestCase):
+
+    def test__parse_stages(self):
+        self.assertEqual(parse_stages([1, '5', ' 50% ', 0.25]), [1, 5, 0.5, 0.25])
+        for stages in [[], '0', '-1', '150%', [2.0]]:
+            with self.assertRaises(ValueError):
+                parse_stages(stages)
+
+    def test__stage_sizes__last_stage_repeats(self):
+        self.assertEqual(list(stage_sizes([1, 0.01, 0.1, 1.0], 200)), [1, 2, 20, 177])
+        self.assertEqual(list(stage_sizes([2, 3], 10)), [2, 3, 3, 2])
+        self.assertEqual(list(stage_sizes([5], 2)), [2])
+        self.assertEqual(list(stage_sizes([1], 0)), [])
+
+    def test__stage_sizes__fraction_rounds_up(self):
+        self.assertEqual(list(stage_sizes([0.07], 100))[:2], [7, 7])
+        self.assertEqual(list(stage_sizes([0.01], 10)), [1] * 10)
+
+
+class TestRollingSSH(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = SSHServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def run_rolling(self, hosts, command, **kwargs):
+        return sshmap.run_rolling(
+            ','.join([self.server.host] * hosts), command,
+            password='password', port=self.server.port, output_callback=[],
+            **kwargs
+        )
+
+    def test__run_rolling__all_stages(self):
+        command = self.run_rolling(10, 'echo ok', stages='1,20%,100%', jobs=4)
+        self.assertEqual(len(command), 10)
+        self.assertEqual(
+            [(stage['hosts'], stage['failures']) for stage in command.parm['stages']],
+            [(1, 0), (2, 0), (7, 0)]
+        )
+        self.assertNotIn('stopped_stage', command.parm)
+        self.assertEqual(command.parm['completed_host_count'], 10)
+
+    def test__run_rolling__stops_on_failures(self):
+        command = self.run_rolling(4, 'exit 1', stages=[1, '50%'], jobs=2)
+        self.assertEqual(len(command), 1)
+        self.assertEqual(command.parm['stopped_stage'], 1)
+        self.assertEqual(len(command.parm['skipped_hosts']), 3)
+        self.assertEqual(command.metrics.dispatched, 1)
+
+    def test__run_rolling__max_failure_ratio(self):
+        command = self.run_rolling(
+            3, 'exit 1', stages=[1], max_failure_ratio=1, stage_jobs=1
+        )
+        self.assertEqual(len(command), 3)
+        self.assertEqual(len(command.parm['stages']), 3)
+
+    def test__run_rolling__keeps_parms(self):
+        command = self.run_rolling(1, 'echo ok', stages=[1], parms={'match': 'ok'})
+        self.assertEqual(command.parm['match'], 'ok')
+
+
+if __name__ == '__main__':
+    unittest.main()
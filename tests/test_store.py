@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# Copyright (c) 2010-2015, Yahoo Inc.
+# Copyrights licensed under the Apache 2.0 License
+# See the accompanying LICENSE.txt file for terms.
+"""
+Unit tests of the on disk result store
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import sshmap
+import sshmap.callback
+import sshmap.sshmap
+from sshmap.store import ResultStore, StoredLines
+
+
+class TestResultStore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'results.seg')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def add(self, store, host, out, err=None, retcode=0, ssh_retcode=0):
+        return store.add(
+            sshmap.sshmap.ssh_result(
+                out, err or [], host, retcode=retcode, ssh_ret=ssh_retcode,
+                command='cmd'
+            )
+        )
+
+    def test__store__read_after_growth(self):
+        with ResultStore(self.path) as store:
+            first = self.add(store, 'host1', ['one\n'])
+            self.assertEqual(first.out_string(), 'one\n')
+            second = self.add(store, 'host2', ['two\n' * 1000], ['err\n'])
+            self.assertEqual(second.out_string(), 'two\n' * 1000)
+            self.assertEqual(list(second.err), ['err\n'])
+            self.assertEqual(first.stdout, b'one\n')
+            self.assertEqual(list(first.err), [])
+
+    def test__store__reopen(self):
+        with ResultStore(self.path) as store:
+            self.add(store, 'host1', ['one\n'], retcode=1)
+            self.add(store, 'host2', ['two\n'], ssh_retcode=3)
+        with ResultStore(self.path) as store:
+            self.assertEqual(len(store), 2)
+            results = list(store.results())
+            self.assertEqual([item.host for item in results], ['host1', 'host2'])
+            self.assertEqual(results[0].retcode, 1)
+            self.assertEqual(results[1].ssh_retcode, 3)
+            self.assertEqual(results[1].command, 'cmd')
+            self.assertIsInstance(results[1].out, StoredLines)
+            self.assertEqual(results[1].out_string(), 'two\n')
+            self.add(store, 'host3', ['three\n'])
+            self.assertEqual(store.by_host('host3')[0].out_string(), 'three\n')
+        with ResultStore(self.path) as store:
+            self.assertEqual(len(store), 3)
+
+    def test__stored_lines__index(self):
+        with ResultStore(self.path) as store:
+            result = self.add(store, 'host1', ['one\n', 'two\n', 'three'])
+            lines = result.out
+            self.assertEqual(len(lines), 3)
+            self.assertEqual(
+                [lines[index] for index in range(len(lines))],
+                ['one\n', 'two\n', 'three']
+            )
+            self.assertEqual(lines[-1], 'three')
+            self.assertEqual(lines[1:], ['two\n', 'three'])
+            with self.assertRaises(IndexError):
+                lines[3]
+            self.assertEqual(len(self.add(store, 'host2', []).out), 0)
+
+    def test__store__by_host(self):
+        with ResultStore(self.path) as store:
+            for host in ['host1', 'host2', 'host1']:
+                self.add(store, host, [host + '\n'])
+            self.assertEqual(len(store.by_host('host1')), 2)
+            self.assertEqual(store.by_host('host3'), [])
+
+    def test__store__readable_before_close(self):
+        # A store left open by a run that died keeps the results added
+        store = ResultStore(self.path)
+        self.add(store, 'host1', ['one\n'])
+        with ResultStore(self.path) as reopened:
+            self.assertEqual(
+                [item.out_string() for item in reopened], ['one\n']
+            )
+        store.close()
+
+    def test__store__attempts(self):
+        with ResultStore(self.path) as store:
+            result = sshmap.sshmap.ssh_result([], [], 'host1', ssh_ret=3)
+            result.attempts = 3
+            store.add(result)
+            self.add(store, 'host2', ['two\n'])
+        with ResultStore(self.path) as store:
+            self.assertEqual(
+                [item.attempts for item in store.results()], [3, 1]
+            )
+
+    def test__store__aggregate_output(self):
+        with ResultStore(self.path) as store:
+            self.add(store, 'host1', ['same\n'])
+            self.add(store, 'host2', ['same\n'])
+            self.add(store, 'host3', ['other\n'], ssh_retcode=3)
+            parm = {}
+            for result in store.results(parm=parm):
+                sshmap.callback.aggregate_output(result)
+            self.assertEqual(
+                sorted(sorted(hosts) for hosts in parm['aggregate_hosts'].values()),
+                [['host1', 'host2'], ['host3']]
+            )
+
+    def test__run__store_path(self):
+        results = sshmap.sshmap.ssh_results()
+        results.retain = 'disk'
+        results.store = ResultStore(self.path)
+        self.add(results, 'host1', ['one\n'])
+        results.store.close()
+        with ResultStore(self.path) as store:
+            self.assertEqual(
+                [item.out_string() for item in store], ['one\n']
+            )
+
+
+if __name__ == '__main__':
+    unittest.main()
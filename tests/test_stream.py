@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# Copyright (c) 2010-2015, Yahoo Inc.
+# Copyrights licensed under the Apache 2.0 License
+# See the accompanying LICENSE.txt file for terms.
+"""
+Unit tests of streaming the output line by line
+"""
+import unittest
+import sshmap
+import sshmap.engine
+from sshserver import SSHServer
+
+
+# Writes enough to stderr to fill the channel window before writing stdout,
+# reading stdout to the end first deadlocks on this.
+BIG_STDERR = 'head -c 3000000 /dev/zero | tr "\\0" "e" | fold -w 99 >&2; echo done'
+
+
+def emit_events(value):
+    sink = sshmap.engine.event_sink()
+    for i in range(value):
+        sink((value, i))
+    return value
+
+
+class TestEngineEvents(unittest.TestCase):
+
+    def check_events(self, engine):
+        items = list(engine.map(emit_events, [1, 2, 3], events=True))
+        results = sorted(item for item in items if isinstance(item, int))
+        events = [item for item in items if isinstance(item, tuple)]
+        self.assertEqual(results, [1, 2, 3])
+        self.assertEqual(
+            sorted(events), [(1, 0), (2, 0), (2, 1), (3, 0), (3, 1), (3, 2)]
+        )
+
+    def test__process_engine__events(self):
+        self.check_events(sshmap.engine.get_engine('process', jobs=2))
+
+    def test__async_engine__events(self):
+        self.check_events(sshmap.engine.get_engine('async', jobs=2))
+
+    def test__hybrid_engine__events(self):
+        self.check_events(
+            sshmap.engine.get_engine('hybrid', jobs=2, connections=4)
+        )
+
+    def test__event_sink__not_collecting(self):
+        self.assertIsNone(sshmap.engine.event_sink())
+
+
+class TestStream(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = SSHServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def test__run_command__both_streams(self):
+        lines = []
+        result = sshmap.run_command(
+            self.server.host, BIG_STDERR, password='password',
+            port=self.server.port, timeout=30, line_callback=lines.append
+        )
+        self.assertEqual(result.ssh_retcode, sshmap.defaults.RUN_OK)
+        self.assertEqual(result.out, ['done\n'])
+        self.assertEqual(len(result.err), 30304)
+        self.assertEqual(len(lines), 30305)
+        self.assertIn(
+            sshmap.OutputLine(self.server.host, 'stdout', 'done\n'), lines
+        )
+        self.assertEqual(result.err[-1], 'eee')
+
+    def test__run_command__no_output_kept(self):
+        lines = []
+        result = sshmap.run_command(
+            self.server.host, 'echo one; echo two >&2; printf three',
+            password='password', port=self.server.port,
+            line_callback=lines.append, keep_output=False
+        )
+        self.assertEqual(result.out, [])
+        self.assertEqual(result.err, [])
+        self.assertEqual(
+            sorted((line.stream, line.line) for line in lines),
+            [('stderr', 'two\n'), ('stdout', 'one\n'), ('stdout', 'three')]
+        )
+
+    def test__stream(self):
+        lines = list(sshmap.stream(
+            ','.join([self.server.host] * 3), 'echo hello', password='password',
+            port=self.server.port, engine='async'
+        ))
+        self.assertEqual(
+            lines, [sshmap.OutputLine(self.server.host, 'stdout', 'hello\n')] * 3
+        )
+
+    def test__run__line_callback(self):
+        lines = []
+
+        def collect(line):
+            lines.append(line)
+
+        for engine in ['process', 'hybrid']:
+            del lines[:]
+            result = sshmap.run(
+                ','.join([self.server.host] * 4), 'echo hello',
+                password='password', port=self.server.port, jobs=2,
+                engine=engine, line_callback=collect
+            )
+            self.assertEqual(len(lines), 4)
+            self.assertEqual(
+                [item.out_string() for item in result], ['hello\n'] * 4
+            )
+
+
+if __name__ == '__main__':
+    unittest.main()
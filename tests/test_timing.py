@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# Copyright (c) 2010-2015, Yahoo Inc.
+# Copyrights licensed under the Apache 2.0 License
+# See the accompanying LICENSE.txt file for terms.
+"""
+Unit tests of the timing of the phases of running a command
+"""
+import os
+import pickle
+import subprocess
+import sys
+import time
+import unittest
+import sshmap
+from sshmap.timing import PHASES, PhaseTimings, Timeouts, TimingSummary, \
+    get_timeouts, percentile
+from sshserver import SSHServer
+
+
+class TestPhaseTimings(unittest.TestCase):
+
+    def test__durations__phases_in_order(self):
+        timings = PhaseTimings([1, 2, 4, float('nan'), 5, 5.5, 7, 8])
+        self.assertEqual(
+            list(timings.durations().items()),
+            [
+                ('dns', 1), ('connect', 2), ('kex', 1), ('channel', 0.5),
+                ('exec', 1.5), ('transfer', 1)
+            ]
+        )
+        self.assertEqual(timings.total, 7)
+        self.assertIsNone(timings.started('auth'))
+
+    def test__durations__unfinished(self):
+        timings = PhaseTimings()
+        timings.start('dns')
+        self.assertEqual(timings.durations(), {})
+        self.assertIsNone(timings.total)
+
+    def test__pickle(self):
+        timings = PhaseTimings()
+        timings.start('dns')
+        timings.stop()
+        copy = pickle.loads(pickle.dumps(timings))
+        self.assertEqual(copy.durations(), timings.durations())
+
+
+class TestTimingSummary(unittest.TestCase):
+
+    def test__percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile(values, 100), 100)
+        self.assertEqual(percentile([3], 90), 3)
+        self.assertIsNone(percentile([], 50))
+
+    def test__summary(self):
+        summary = TimingSummary()
+        for seconds in range(1, 11):
+            summary.add(PhaseTimings(
+                [float('nan')] * 4 + [0, seconds, float('nan'), seconds]
+            ))
+        summary.add(None)
+        self.assertEqual(len(summary), 10)
+        stats = summary.summary()
+        self.assertEqual(list(stats.keys()), ['channel', 'exec', 'total'])
+        self.assertEqual(
+            list(stats['channel'].items()),
+            [
+                ('count', 10), ('min', 1), ('p50', 5), ('p90', 9),
+                ('p99', 10), ('max', 10)
+            ]
+        )
+        self.assertEqual(stats['exec']['max'], 0)
+        self.assertIn('channel', summary.report())
+
+
+class TestTimeouts(unittest.TestCase):
+
+    def test__get_timeouts__single_timeout(self):
+        self.assertEqual(
+            get_timeouts(10), Timeouts(connect=10, auth=10, idle=10)
+        )
+        self.assertEqual(get_timeouts(0), Timeouts())
+
+    def test__get_timeouts__override(self):
+        self.assertEqual(
+            get_timeouts(10, Timeouts(connect=2, command=60)),
+            Timeouts(connect=2, auth=10, command=60, idle=10)
+        )
+
+    def test__pickle(self):
+        timeouts = Timeouts(connect=1, command=2)
+        self.assertEqual(pickle.loads(pickle.dumps(timeouts)), timeouts)
+
+
+class TestRunTimings(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = SSHServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def test__run_command__phases(self):
+        result = sshmap.run_command(
+            self.server.host, 'echo hello', password='password',
+            port=self.server.port
+        )
+        self.assertEqual(result.ssh_retcode, sshmap.defaults.RUN_OK)
+        self.assertEqual(list(result.timings.durations().keys()), PHASES)
+        for seconds in result.timings.durations().values():
+            self.assertGreaterEqual(seconds, 0)
+
+    def test__run_command__connect_failure(self):
+        result = sshmap.run_command(
+            self.server.host, 'echo hello', password='password', port=1
+        )
+        self.assertEqual(result.ssh_retcode, sshmap.defaults.RUN_FAIL_CONNECT)
+        self.assertEqual(
+            list(result.timings.durations().keys()), ['dns', 'connect']
+        )
+
+    def run_timeouts(self, command, timeouts):
+        start = time.time()
+        result = sshmap.run_command(
+            self.server.host, command, password='password',
+            port=self.server.port, timeouts=timeouts
+        )
+        return result, time.time() - start
+
+    def test__run_command__command_timeout(self):
+        # Output every 0.2 seconds keeps the idle timeout from firing
+        result, elapsed = self.run_timeouts(
+            'for i in 1 2 3 4 5 6 7 8 9 10; do echo $i; sleep 0.2; done',
+            Timeouts(command=0.8, idle=1)
+        )
+        self.assertEqual(result.ssh_retcode, sshmap.defaults.RUN_FAIL_TIMEOUT)
+        self.assertLess(elapsed, 1.8)
+
+    def test__run_command__idle_timeout(self):
+        result, elapsed = self.run_timeouts(
+            'echo one; sleep 5', Timeouts(idle=0.5)
+        )
+        self.assertEqual(result.ssh_retcode, sshmap.defaults.RUN_FAIL_TIMEOUT)
+        self.assertLess(elapsed, 3)
+
+    def test__run__deadline(self):
+        start = time.time()
+        results = sshmap.run(
+            ','.join([self.server.host] * 4), 'sleep 5', password='password',
+            port=self.server.port, jobs=2, deadline=1, sort=True
+        )
+        self.assertLess(time.time() - start, 4)
+        self.assertEqual(
+            [result.ssh_retcode for result in results],
+            [sshmap.defaults.RUN_FAIL_TIMEOUT] * 4
+        )
+        self.assertEqual(results.parm['completed_host_count'], 4)
+
+    def test__run__deadline__async_exits(self):
+        # The async engine runs the sessions in threads of the current
+        # process, the interpreter can't exit until they stop
+        script = (
+            'import sshmap; sshmap.run(%r, "sleep 15", password="password", '
+            'port=%d, jobs=2, deadline=1, engine="async")' % (
+                ','.join([self.server.host] * 2), self.server.port
+            )
+        )
+        root = os.path.join(os.path.dirname(__file__), '..')
+        start = time.time()
+        subprocess.check_call([sys.executable, '-c', script], cwd=root)
+        self.assertLess(time.time() - start, 6)
+
+    def test__run__summary(self):
+        results = sshmap.run(
+            ','.join([self.server.host] * 3), 'echo hello',
+            password='password', port=self.server.port, jobs=2,
+            retain='none'
+        )
+        self.assertEqual(len(results), 0)
+        summary = results.timings.summary()
+        self.assertEqual(list(summary.keys()), PHASES + ['total'])
+        self.assertEqual(summary['auth']['count'], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()